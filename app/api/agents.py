@@ -1,14 +1,29 @@
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+import asyncio
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi import APIRouter, Header
+from fastapi.responses import JSONResponse, StreamingResponse
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 
 from app.craftcard.configuration import Configuration
-from app.craftcard.craftcard_agent import CraftcardAgent
+from app.craftcard.craftcard_agent import CraftcardAgent, copy_card
 from app.models.card import ResearchStage
-from app.models.schemas import CraftCardRequest, StreamEvent
-from app.models.store import ConversationType, SessionType
+from app.models.schemas import (
+    BaseResponse,
+    CraftCardRequest,
+    KeyError,
+    StreamEvent,
+    standard_response,
+)
+from app.models.store import Card, ConversationStatus, ConversationType, SessionType
+from app.services.checkpoint_saver import checkpoint_saver
+from app.services.chunk_writer import ChunkWriter
+from app.services.job_queue import DONE_EVENT, Publish, QueueFullError, job_queue
 from app.services.store_service import store_service
 from app.utils.logger import logger
+from config.settings import settings
 
 router = APIRouter()
 
@@ -17,12 +32,123 @@ router = APIRouter()
 async def craftcard(request: CraftCardRequest):
     """
     根据query制作一张角色卡 , sse接口推送中间过程
+
+    制作在后台任务中执行, 响应头 ``X-Job-ID`` 为任务id; 连接断开后可通过
+    ``/craftcard/jobs/{job_id}/events`` 带 ``Last-Event-ID`` 续接。
+    相同的首轮请求正在制作时合并到该任务, 但仍得到独立的会话与角色卡。
+    """
+    if (
+        request.session_id
+        and await store_service.get_session(request.session_id) is None
+    ):
+        return JSONResponse(
+            status_code=404,
+            content=BaseResponse.error(
+                code=404, message="session not found", data=request.session_id
+            ).model_dump(),
+        )
+    try:
+        job = await job_queue.submit(
+            "craftcard", request.model_dump(), key=coalesce_key(request)
+        )
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=503,
+            content=BaseResponse.error(
+                code=503, message="Too many craftcard jobs", data=str(e)
+            ).model_dump(),
+        )
+    return StreamingResponse(
+        job_stream(job.id),
+        media_type="text/event-stream",
+        headers={"X-Job-ID": job.id},
+    )
+
+
+@router.get("/craftcard/jobs/{job_id}")
+@standard_response()
+async def craftcard_job_status(job_id: str):
+    """Status of a craftcard job."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise KeyError(msg="job not found", data=job_id)
+    return job
+
+
+@router.post("/craftcard/jobs/{job_id}/cancel")
+@standard_response()
+async def craftcard_job_cancel(job_id: str):
+    """Cancel a queued or running craftcard job."""
+    if await job_queue.get(job_id) is None:
+        raise KeyError(msg="job not found", data=job_id)
+    return {"cancelled": await job_queue.cancel(job_id)}
+
+
+@router.get("/craftcard/jobs/{job_id}/events")
+async def craftcard_job_events(
+    job_id: str,
+    last_event_id: str = Header(default="", alias="Last-Event-ID"),
+    after: Optional[int] = None,
+):
     """
-    return StreamingResponse(craftcard_stream(request), media_type="text/event-stream")
+    重新订阅任务的事件流: 先补发 ``Last-Event-ID`` (或 ``after``) 之后的事件,
+    任务未结束时继续推送新事件。
+    """
+    if await job_queue.get(job_id) is None:
+        return JSONResponse(
+            status_code=404,
+            content=BaseResponse.error(
+                code=404, message="job not found", data=job_id
+            ).model_dump(),
+        )
+    if after is None:
+        after = int(last_event_id) if last_event_id.isdigit() else -1
+    return StreamingResponse(
+        job_stream(job_id, after),
+        media_type="text/event-stream",
+        headers={"X-Job-ID": job_id},
+    )
 
 
-async def craftcard_stream(request: CraftCardRequest):
-    configure = Configuration(common_model=request.model).model_dump()
+async def job_stream(job_id: str, after: int = -1):
+    """SSE frames of a job, the event id is its sequence number."""
+    async for event in job_queue.subscribe(
+        job_id, after, keepalive=settings.job_keepalive_seconds
+    ):
+        if event is None:
+            # 排队或等待LLM时防止代理因空闲断开连接
+            yield ": keepalive\n\n"
+        else:
+            yield f"id: {event[0]}\ndata: {event[1]}\n\n"
+
+
+def _configure(request: CraftCardRequest) -> dict[str, Any]:
+    return Configuration(
+        common_model=request.model, node_models=request.node_models
+    ).model_dump()
+
+
+def coalesce_key(request: CraftCardRequest) -> Optional[str]:
+    """Single-flight key of a first-turn request, None if it must run on its own."""
+    if not settings.craftcard_coalesce or request.session_id or request.parent_cid:
+        return None
+    key = json.dumps(
+        [
+            # 忽略首尾空白与连续空白的差异
+            " ".join(request.query.split()),
+            _configure(request),
+            request.stream_tokens,
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+async def craftcard_job(payload: dict[str, Any], publish: Publish) -> None:
+    """Run one craftcard turn, publishing the SSE payloads of its events."""
+    request = CraftCardRequest.model_validate(payload)
+    configure = _configure(request)
 
     logger.info(
         "Craftcard stream started",
@@ -33,19 +159,30 @@ async def craftcard_stream(request: CraftCardRequest):
         },
     )
 
+    # 建会话/读历史/写入用户消息和AI占位消息在同一事务内完成
+    turn = await store_service.begin_turn(
+        query=request.query,
+        session_type=SessionType.CRAFTCARD,
+        session_id=request.session_id,
+        parent_cid=request.parent_cid,
+    )
+    session_id = turn["session_id"]
+    parent_id = turn["human_id"]
+    current_id = turn["ai_id"]
+
     message: list[BaseMessage] = [HumanMessage(content=request.query)]
     if not request.session_id:
         # 首次请求
         stage = ResearchStage.INITIALIZATION
-        session_id = await store_service.create_session(
-            request.query, SessionType.CRAFTCARD
-        )
+    elif settings.graph_checkpoint and await checkpoint_saver.prepare_thread(
+        session_id, turn["history"][-1]["id"] if turn["history"] else ""
+    ):
+        # 上一轮的图状态已保存, 只需传入新的用户消息
+        stage = ResearchStage.CLARIFICATION
     else:
         stage = ResearchStage.CLARIFICATION
-        session_id = request.session_id
-        old_message = await store_service.list_conversations(session_id)
         format_message = []
-        for msg in old_message:
+        for msg in turn["history"]:
             match msg["type"]:
                 case ConversationType.HUMAN:
                     msg = HumanMessage(content=msg["content"])
@@ -59,46 +196,147 @@ async def craftcard_stream(request: CraftCardRequest):
     craftcard_agent = CraftcardAgent(
         stage=stage,
         session_id=session_id,
+        conversation_id=current_id,
         messages=message,
     )
 
-    parent_id = await store_service.create_conversation(
+    baseEvent = StreamEvent(
         session_id=session_id,
-        content=request.query,
-        type=ConversationType.HUMAN,
-        parent_cid=request.parent_cid,
+        conversation_id=current_id,
+        parent_id=parent_id,
     )
-
-    current_id = await store_service.create_conversation(
+    # AI消息按批追加写入, 中断时已输出的部分可在重启后恢复
+    chunk_writer = ChunkWriter(
+        store_service,
+        conversation_id=current_id,
         session_id=session_id,
-        content="",
-        type=ConversationType.AI,
-        parent_cid=parent_id,
+        max_events=settings.stream_chunk_flush_events,
+        max_delay_ms=settings.stream_chunk_flush_ms,
+    )
+    try:
+        async for event in craftcard_agent.craftcard_stream(
+            config_dict=configure,
+            stream_tokens=request.stream_tokens,
+            delta_interval=settings.stream_delta_interval_ms / 1000,
+        ):
+            if event.delta:
+                # 增量事件只推送不落库, 完整内容由节点事件给出
+                baseEvent.data = {"stage": event.stage, "delta": event.delta}
+            elif event.item:
+                baseEvent.data = {
+                    "stage": event.stage,
+                    "content": event.content,
+                    "item": event.item,
+                }
+            else:
+                await chunk_writer.add(event.content + "\n")
+                baseEvent.data = event.model_dump(exclude={"delta", "item"})
+            await publish(baseEvent.model_dump_json())
+    except asyncio.CancelledError:
+        # 客户端断开或主动取消: 保留已输出的部分, 标记为已取消
+        await chunk_writer.finish(status=ConversationStatus.CANCELLED.value)
+        if settings.graph_checkpoint:
+            # 图停在中途, 下一轮改为重放历史
+            await checkpoint_saver.adelete_thread(session_id)
+        logger.info(
+            "Craftcard cancelled",
+            extra={"session_id": session_id, "conversation_id": current_id},
+        )
+        raise
+    except Exception:
+        # 合并已输出的部分并标记为失败, 历史中不会留下空的AI消息
+        await chunk_writer.finish(status=ConversationStatus.FAILED.value)
+        if settings.graph_checkpoint:
+            await checkpoint_saver.adelete_thread(session_id)
+        raise
+    except BaseException:
+        await chunk_writer.close()
+        raise
+
+    # 合并分片与写入角色卡在同一事务内完成
+    card = craftcard_agent.card
+    await chunk_writer.finish(card=card.model_dump() if card is not None else None)
+
+    logger.info(
+        "Craftcard completed",
+        extra={
+            "session_id": session_id,
+        },
+    )
+
+
+async def craftcard_follower_job(payload: dict[str, Any], publish: Publish) -> None:
+    """
+    Relay the events of an identical in-flight craftcard job.
+
+    事件改写为本请求自己的会话/消息id后推送并落库, 最终的角色卡复制一份归本会话所有。
+    """
+    request = CraftCardRequest.model_validate(payload)
+    leader_id = payload["leader_id"]
+    turn = await store_service.begin_turn(
+        query=request.query, session_type=SessionType.CRAFTCARD
+    )
+    session_id = turn["session_id"]
+    current_id = turn["ai_id"]
+    logger.info(
+        "Craftcard coalesced",
+        extra={
+            "session_id": session_id,
+            "leader_id": leader_id,
+            "query": request.query,
+        },
     )
 
     baseEvent = StreamEvent(
         session_id=session_id,
         conversation_id=current_id,
-        parent_id=parent_id,
+        parent_id=turn["human_id"],
     )
-    content = ""
-
-    async for event in craftcard_agent.craftcard_stream(
-        config_dict=configure,
-    ):
-        content += event.content + "\n"
-        baseEvent.data = event.model_dump()
-        yield f"data: {baseEvent.model_dump_json()}\n\n"
-    yield "data: [DONE]\n\n"
-
-    await store_service.update_conversation(
+    chunk_writer = ChunkWriter(
+        store_service,
         conversation_id=current_id,
-        content=content,
+        session_id=session_id,
+        max_events=settings.stream_chunk_flush_events,
+        max_delay_ms=settings.stream_chunk_flush_ms,
     )
+    card: Optional[Card] = None
+    try:
+        async for event in job_queue.subscribe(leader_id):
+            if event is None:
+                continue
+            if event[1] == DONE_EVENT:
+                break
+            data = json.loads(event[1])
+            if "data" not in data:
+                # 领头任务的结束状态事件: 失败/被取消/被中断
+                raise RuntimeError(
+                    f"Coalesced job {leader_id} {data['status']}: {data['error']}"
+                )
+            data = data["data"]
+            if data.get("FinalResp"):
+                card = await copy_card(
+                    Card.model_validate(data["FinalResp"]), session_id
+                )
+                data["FinalResp"] = card.model_dump()
+            if "delta" not in data and "item" not in data:
+                await chunk_writer.add(data["content"] + "\n")
+            baseEvent.data = data
+            await publish(baseEvent.model_dump_json())
+    except asyncio.CancelledError:
+        await chunk_writer.finish(status=ConversationStatus.CANCELLED.value)
+        raise
+    except Exception:
+        await chunk_writer.finish(status=ConversationStatus.FAILED.value)
+        raise
+    except BaseException:
+        await chunk_writer.close()
+        raise
 
+    await chunk_writer.finish(card=card.model_dump() if card is not None else None)
     logger.info(
         "Craftcard completed",
-        extra={
-            "session_id": session_id,
-        },
+        extra={"session_id": session_id, "leader_id": leader_id},
     )
+
+
+job_queue.register("craftcard", craftcard_job, follower=craftcard_follower_job)
@@ -1,20 +1,25 @@
-import asyncio
-import os
+from datetime import datetime, timedelta, timezone
 
 from fastapi import APIRouter
 
 from app.models.schemas import (
+    BulkDeleteSessionRequest,
+    BulkDeleteSessionResponse,
     ConversationListRequest,
     ConversationListResponse,
     DeleteSessionRequest,
     DeleteSessionResponse,
+    KeyError,
+    SearchHit,
+    SearchRequest,
+    SearchResponse,
     SessionListRequest,
     SessionListResponse,
     standard_response,
 )
 from app.models.store import Conversation, Session
+from app.services.maintenance import card_reaper
 from app.services.store_service import store_service
-from config.settings import settings
 
 router = APIRouter()
 
@@ -22,16 +27,61 @@ router = APIRouter()
 @router.post("/session/list")
 @standard_response()
 async def sessions_list(param: SessionListRequest):
-    """List sessions with pagination and search."""
-    lists = await store_service.list_sessions(limit=param.limit, offset=param.offset)
-    sessions = [Session.model_validate(session) for session in lists]
-    return SessionListResponse(sessions=sessions)
+    """List sessions with keyset pagination, optionally filtered by type."""
+    if param.offset and not param.cursor:
+        # 兼容旧的offset分页
+        lists = await store_service.list_sessions(
+            limit=param.limit, offset=param.offset
+        )
+        sessions = [Session.model_validate(session) for session in lists]
+        return SessionListResponse(sessions=sessions)
+
+    try:
+        page = await store_service.page_sessions(
+            limit=param.limit,
+            cursor=param.cursor,
+            type=param.type.value if param.type else None,
+        )
+    except ValueError as e:
+        raise KeyError(msg="invalid cursor", data=str(e), code=400) from e
+    sessions = [Session.model_validate(session) for session in page["sessions"]]
+    return SessionListResponse(
+        sessions=sessions,
+        next_cursor=page["next_cursor"],
+        has_more=page["has_more"],
+    )
+
+
+@router.post("/search")
+@standard_response()
+async def search(param: SearchRequest):
+    """Full-text search over session titles, conversations and cards."""
+    page = await store_service.search(
+        query=param.query,
+        limit=param.limit,
+        offset=param.offset,
+        kinds=list(param.kinds) or None,
+    )
+    results = [SearchHit.model_validate(hit) for hit in page["results"]]
+    return SearchResponse(results=results, has_more=page["has_more"])
+
+
+@router.post("/storage/report")
+@standard_response()
+async def storage_report():
+    """Stored vs. plain size of the compressible text columns."""
+    return await store_service.storage_report()
 
 
 @router.post("/conversation/list")
 @standard_response()
 async def list_conversations(param: ConversationListRequest):
-    lists = await store_service.list_conversations(session_id=param.session_id)
+    if param.leaf_cid:
+        lists = await store_service.get_branch(
+            leaf_cid=param.leaf_cid, session_id=param.session_id
+        )
+    else:
+        lists = await store_service.list_conversations(session_id=param.session_id)
     conversations = [
         Conversation.model_validate(conversation) for conversation in lists
     ]
@@ -43,18 +93,29 @@ async def list_conversations(param: ConversationListRequest):
 async def delete_session(param: DeleteSessionRequest):
     """Delete a session by its ID."""
     card = await store_service.get_cards_by_session(param.session_id)
-    if card is not None:
-        hash = card.get("hash", "")
-        if hash:
-            try:
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(
-                    None,
-                    lambda: os.remove(
-                        os.path.join(settings.card_folder, f"{hash}.json")
-                    ),
-                )
-            except Exception:
-                pass
     success = await store_service.delete_session(param.session_id)
+    if card is not None:
+        card_reaper.enqueue([card.get("hash", "")])
     return DeleteSessionResponse(success=success)
+
+
+@router.post("/session/bulk_delete")
+@standard_response()
+async def bulk_delete_sessions(param: BulkDeleteSessionRequest):
+    """Delete many sessions by ID or by age; card files are removed in background."""
+    if bool(param.session_ids) == (param.older_than_days is not None):
+        raise KeyError(
+            msg="invalid request",
+            data="exactly one of session_ids or older_than_days is required",
+            code=400,
+        )
+    before = None
+    if param.older_than_days is not None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=param.older_than_days)
+        # 与SQLite的CURRENT_TIMESTAMP格式一致 (UTC)
+        before = cutoff.strftime("%Y-%m-%d %H:%M:%S")
+    result = await store_service.delete_sessions(
+        session_ids=param.session_ids or None, before=before
+    )
+    card_reaper.enqueue(result["card_hashes"])
+    return BulkDeleteSessionResponse(deleted=result["deleted"])
@@ -3,6 +3,9 @@ from typing import Any
 from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel, Field
 
+from app.utils.model_config import model_registry
+from config.settings import settings
+
 
 class Configuration(BaseModel):
     """Main configuration class for the card craft agent"""
@@ -11,12 +14,47 @@ class Configuration(BaseModel):
 
     common_model_provider: str = Field(default="")
 
+    node_models: dict[str, str] = Field(
+        default_factory=dict,
+        description="节点到模型的映射, 如 {'clarify_intension': 'local_model'}",
+    )
+
     max_loop_count: int = Field(default=3, description="最大ReAct次数")
 
     clarify_enable: bool = Field(default=True, description="是否开启意图澄清")
 
     max_clarify_turns: int = Field(default=3, description="最大意图澄清轮数")
 
+    clarify_force_fast_path: bool = Field(
+        default=True,
+        description="达到最大澄清轮数时不调用模型, 直接用历史对话作为剧本需求",
+    )
+
+    history_compact_enable: bool = Field(
+        default=True, description="澄清历史超过保留轮数或token预算时压缩为摘要"
+    )
+
+    history_keep_turns: int = Field(default=2, description="澄清历史中保留原文的轮数")
+
+    expand_enable: bool = Field(default=True, description="是否并行扩写事件链")
+
+    expand_concurrency: int = Field(
+        default=4, description="每个模型供应商同时进行的事件扩写数"
+    )
+
+    llm_cache_nodes: list[str] = Field(
+        default_factory=lambda: list(settings.llm_cache_nodes),
+        description="开启LLM响应缓存的节点, 如 play_core, play_complete",
+    )
+
+    def model_for(self, node: str) -> str:
+        """请求中的节点映射 > llm_config.yaml中的node_models > common_model"""
+        return (
+            self.node_models.get(node)
+            or model_registry.config.node_models.get(node)
+            or self.common_model
+        )
+
     @classmethod
     def from_runnable_config(cls, config: RunnableConfig | None) -> "Configuration":
         configurable = config.get("configurable", {}) if config else {}
@@ -1,10 +1,14 @@
+import asyncio
+import hashlib
+import os
 import time
+import uuid
 from datetime import datetime
 from typing import Any, AsyncGenerator
 
 from langchain_core.messages import BaseMessage
 from langchain_core.runnables import RunnableConfig
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from app.craftcard.graph import card_flow
 from app.craftcard.state import AgentInputState
@@ -17,24 +21,56 @@ from app.models.card import (
     ResearchStage,
 )
 from app.models.store import Card
-from app.services.store_service import store_service
+from app.services.node_usage import node_usage
 from app.utils.logger import logger
 from config.settings import settings
 
+# 需要逐token推送的节点 (其余节点为结构化输出, 只推送节点结果)
+_TOKEN_STREAM_NODES = {"writer": ResearchStage.WRITER}
+
+# 角色卡中写入世界书的字段: (世界书备注, 缺省名称, 推送文案)
+_BOOK_FIELDS = {
+    "main_character": ("角色背景", "未知角色", "👤 主角"),
+    "others": ("角色背景", "未知角色", "👥 角色"),
+    "events": ("事件描述", "未知事件", "📌 事件"),
+}
+
+
+def _book_entry(field: str, item: dict) -> CharacterBookEntry:
+    comment, default_name, _ = _BOOK_FIELDS[field]
+    return CharacterBookEntry(
+        id=0,
+        keys=[item.get("name", default_name)],
+        comment=comment,
+        content=item.get("description", ""),
+    )
+
 
 class CraftcardAgent(BaseModel):
     """制作角色卡的agent"""
 
     stage: ResearchStage = ResearchStage.INITIALIZATION
     session_id: str = ""
+    conversation_id: str = ""  # 本轮AI消息的id
     messages: list[BaseMessage] = []
+    card: Card | None = None  # 本轮生成的角色卡, 由调用方在finish_turn中落库
+    # play_complete流式输出中已闭合的角色/事件, 预先构建好的世界书条目
+    _book_entries: dict[tuple[str, Any], CharacterBookEntry] = PrivateAttr(
+        default_factory=dict
+    )
 
     async def craftcard_stream(
         self,
         config_dict: dict,
+        stream_tokens: bool = False,
+        delta_interval: float = 0.05,
     ) -> AsyncGenerator[CraftStreamingEvent, None]:
         """
         主流程异步迭代器
+
+        ``stream_tokens`` 开启后额外推送writer节点的逐token增量事件
+        (``content`` 为空, ``delta`` 为增量文本), 每 ``delta_interval`` 秒合并一帧,
+        以及最终角色卡中每个生成完毕的条目 (``item``); 默认关闭, 与原有事件流一致。
         """
         session_id = self.session_id
         if self.stage == ResearchStage.INITIALIZATION:
@@ -50,13 +86,50 @@ class CraftcardAgent(BaseModel):
         )
 
         input_state = AgentInputState(messages=self.messages)
-        config = RunnableConfig(configurable=config_dict)
+        # conversation_id 写入元数据: checkpoint据此判断下一轮能否续跑,
+        # 取消时据此结算未完成的LLM调用
+        config = RunnableConfig(
+            configurable=config_dict,
+            callbacks=[node_usage],
+            metadata={"conversation_id": self.conversation_id},
+        )
+        if card_flow.checkpointer is not None:
+            config["configurable"] = {**config_dict, "thread_id": session_id}
         node_count = 0
         chunk_start_time = time.time()
+        stream_mode = ["updates", "custom"]
+        if stream_tokens:
+            stream_mode.append("messages")
+        pending: list[str] = []
+        pending_node = ""
+        last_delta = time.monotonic()
         try:
-            async for chunk in card_flow.astream(
-                input_state, config=config, stream_mode="updates"
+            async for mode, chunk in card_flow.astream(
+                input_state, config=config, stream_mode=stream_mode
             ):
+                if mode == "messages":
+                    message, metadata = chunk
+                    if metadata.get("langgraph_node") not in _TOKEN_STREAM_NODES:
+                        continue
+                    if isinstance(message.content, str) and message.content:
+                        pending.append(message.content)
+                        pending_node = metadata["langgraph_node"]
+                    if pending and time.monotonic() - last_delta >= delta_interval:
+                        yield self._delta_event(pending_node, pending)
+                        pending = []
+                        last_delta = time.monotonic()
+                    continue
+                if mode == "custom":
+                    # 条目总是预先构建世界书, 只在开启时推送
+                    event = self._item_event(chunk)
+                    if stream_tokens:
+                        yield event
+                    continue
+
+                if pending:
+                    # 节点结束前先推送剩余的增量
+                    yield self._delta_event(pending_node, pending)
+                    pending = []
                 node_count += 1
                 current_time = time.time()
                 chunk_duration = current_time - chunk_start_time
@@ -73,10 +146,36 @@ class CraftcardAgent(BaseModel):
 
                 chunk_start_time = current_time
 
+        except asyncio.CancelledError:
+            node_usage.cancel_runs(self.conversation_id)
+            raise
         except Exception as e:
             logger.error(f"Craftcard error: {str(e)}", extra={"session_id": session_id})
             raise e
 
+    def _delta_event(self, node_name: str, parts: list[str]) -> CraftStreamingEvent:
+        return CraftStreamingEvent(
+            stage=_TOKEN_STREAM_NODES[node_name],
+            content="",
+            delta="".join(parts),
+            timestamp=datetime.now().isoformat(),
+        )
+
+    def _item_event(self, item: dict) -> CraftStreamingEvent:
+        """最终角色卡中一个条目 (备选开场/角色/事件) 生成完毕"""
+        field, index, value = item["field"], item["index"], item["value"]
+        if field in _BOOK_FIELDS and isinstance(value, dict):
+            self._book_entries[(field, index)] = _book_entry(field, value)
+            content = f"{_BOOK_FIELDS[field][2]}: {value.get('name', '')}"
+        else:
+            content = f"💬 备选开场 {index + 1}"
+        return CraftStreamingEvent(
+            stage=ResearchStage.PLAY_COMPLETE,
+            content=content,
+            item=item,
+            timestamp=datetime.now().isoformat(),
+        )
+
     async def _process_node(
         self, node_name: str, node_data: Any, session_id: str, node_count: int
     ) -> CraftStreamingEvent:
@@ -112,6 +211,12 @@ class CraftcardAgent(BaseModel):
                         # for idx, event in enumerate(event_chain, start=1):
                         #     event_desc = event.get("name", "未知事件")
                         #     content += f"   {idx}. {event_desc}"
+                case ResearchStage.EXPANSION:
+                    if isinstance(node_data, dict) and node_data.get("expanded_events"):
+                        name = node_data["expanded_events"][-1]["name"]
+                        content = f"📖 事件扩写完成: {name}"
+                    else:
+                        content = "📖 事件扩写全部完成"
                 case ResearchStage.WRITER:
                     content = "✍️ 剧本撰写中..."
                     if isinstance(node_data, dict) and "final" in node_data:
@@ -138,6 +243,8 @@ class CraftcardAgent(BaseModel):
         stage_mapping = {
             "clarify_intension": ResearchStage.CLARIFICATION,
             "play_core": ResearchStage.PLAY_CORE,
+            "expand_event": ResearchStage.EXPANSION,
+            "merge_events": ResearchStage.EXPANSION,
             "writer": ResearchStage.WRITER,
             "supervisor": ResearchStage.SUPERVISOR,
             "play_complete": ResearchStage.PLAY_COMPLETE,
@@ -164,10 +271,6 @@ class CraftcardAgent(BaseModel):
 
     async def store_card(self, data: dict) -> Card:
         """导出角色卡"""
-        import asyncio
-        import hashlib
-        import os
-
         logger.info("Storing final card", extra={"session_id": self.session_id})
         title = data.get("title")
         first_msg = data.get("first_msg")
@@ -180,22 +283,18 @@ class CraftcardAgent(BaseModel):
         other = data.get("others", [])
         events = data.get("events", [])
         entries: list = []
-        for char in [main_character] + other:
-            entry = CharacterBookEntry(
-                id=len(entries),
-                keys=[char.get("name", "未知角色")],
-                comment="角色背景",
-                content=char.get("description", ""),
-            )
-            entries.append(entry)
-
-        for event in events:
-            entry = CharacterBookEntry(
-                id=len(entries),
-                keys=[event.get("name", "未知事件")],
-                comment="事件描述",
-                content=event.get("description", ""),
-            )
+        items = [("main_character", None, main_character)]
+        items += [("others", i, char) for i, char in enumerate(other)]
+        items += [("events", i, event) for i, event in enumerate(events)]
+        for field, index, item in items:
+            # 优先使用流式阶段已构建的条目, 与最终结果不一致时重新构建
+            entry = self._book_entries.get((field, index))
+            if entry is None or (entry.keys, entry.content) != (
+                [item.get("name", _BOOK_FIELDS[field][1])],
+                item.get("description", ""),
+            ):
+                entry = _book_entry(field, item)
+            entry.id = len(entries)
             entries.append(entry)
         card = CharacterCardV3(
             name=title,
@@ -208,36 +307,63 @@ class CraftcardAgent(BaseModel):
             ),
             create_date=datetime.now().isoformat(),
         )
-        json_data = card.model_dump_json()
-        hash_filename = hashlib.md5(json_data.encode("utf-8")).hexdigest()[:12]
-        filename = f"{hash_filename}.json"
-
-        def sync_write():
-            with open(
-                os.path.join(settings.card_folder, filename), "w", encoding="utf-8"
-            ) as f:
-                f.write(json_data)
-
-        # 使用线程池执行
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, sync_write)
-
-        card_id = await store_service.create_card(
-            session_id=self.session_id,
-            name=card.name,
-            hash=hash_filename,
-            background=first_msg,
-        )
+        hash_filename = await write_card_file(card)
+        card_id = uuid.uuid4().hex
 
         logger.info(
-            f"Card stored with ID: {card_id}, Filename: {filename}",
+            f"Card stored with ID: {card_id}, Filename: {hash_filename}.json",
             extra={"session_id": self.session_id},
         )
 
-        return Card(
+        self.card = Card(
             id=card_id,
             session_id=self.session_id,
             name=card.name,
             hash=hash_filename,
             background=data.get("first_msg", ""),
         )
+        return self.card
+
+
+async def write_card_file(card: CharacterCardV3) -> str:
+    """Write ``card`` into the card folder, returns its hash (the file name)."""
+    json_data = card.model_dump_json()
+    hash_filename = hashlib.md5(json_data.encode("utf-8")).hexdigest()[:12]
+
+    def sync_write():
+        with open(
+            os.path.join(settings.card_folder, f"{hash_filename}.json"),
+            "w",
+            encoding="utf-8",
+        ) as f:
+            f.write(json_data)
+
+    # 使用线程池执行
+    await asyncio.get_running_loop().run_in_executor(None, sync_write)
+    return hash_filename
+
+
+async def copy_card(card: Card, session_id: str) -> Card:
+    """
+    Copy a stored card into another session.
+
+    会话删除时会一并删除角色卡文件, 因此副本写入一个新文件 (重设创建时间后哈希不同)。
+    """
+
+    def sync_read() -> str:
+        with open(
+            os.path.join(settings.card_folder, f"{card.hash}.json"), encoding="utf-8"
+        ) as f:
+            return f.read()
+
+    data = CharacterCardV3.model_validate_json(
+        await asyncio.get_running_loop().run_in_executor(None, sync_read)
+    )
+    data.create_date = datetime.now().isoformat()
+    return card.model_copy(
+        update={
+            "id": uuid.uuid4().hex,
+            "session_id": session_id,
+            "hash": await write_card_file(data),
+        }
+    )
@@ -1,50 +1,75 @@
-from typing import Literal
+from typing import Any, Callable, Literal
 
+import openai
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.exceptions import OutputParserException
 from langchain_core.messages import (
     AIMessage,
+    BaseMessage,
     HumanMessage,
     SystemMessage,
     get_buffer_string,
 )
 from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables.config import merge_configs
+from langgraph.config import get_stream_writer
 from langgraph.graph import END, START, StateGraph
-from langgraph.types import Command
+from langgraph.types import Command, Send
 
+from app.services.checkpoint_saver import checkpoint_saver
+from app.services.history_compaction import history_compactor
+from app.services.llm_cache import llm_cache
 from app.utils.logger import logger
+from app.utils.structured_output import JSONStreamParser
+from config.settings import settings
 
-from ..utils.model_config import modelSet
+from ..utils.model_config import model_registry
 from .configuration import Configuration
 from .prompts import (
     clarify_intension_prompt,
     final_output_prompt,
+    history_summary_prompt,
     play_core_prompt,
     supervisor_prompt,
+    text_expand_prompt,
     writer_prompt,
 )
 from .state import (
     AgentInputState,
     AgentState,
     ClarifyIntension,
+    ExpandEventState,
+    ExpandResp,
     FinalResp,
     PlayCoreResp,
     SupervisorResp,
 )
 
 
+def _cache(configurable: Configuration, node: str) -> BaseCache | None:
+    """LLM response cache for ``node`` when enabled in the configuration."""
+    return llm_cache if node in configurable.llm_cache_nodes else None
+
+
+# 强制结束澄清时回复给用户的衔接语
+_FORCE_CLARIFY_REPLY = "好的, 信息已经足够, 接下来根据我们的对话开始创作剧本。"
+
+
+def _history_query(messages: list[BaseMessage]) -> str:
+    """把澄清阶段的多轮对话整理为 play_core 的输入"""
+    lines = []
+    for message in messages:
+        role = "用户" if message.type == "human" else "助手"
+        lines.append(f"{role}: {message.text()}")
+    return "\n".join(lines)
+
+
 async def clarify_intension(
     state: AgentState, config: RunnableConfig
 ) -> Command[Literal["supervisor", "__end__"]]:
     configurable = Configuration.from_runnable_config(config)
     messages = state["messages"]
-    model_config = modelSet.models[configurable.common_model]
-    if model_config is None:
-        raise ValueError("model not found")
-    model = ChatOpenAI(
-        openai_api_key=model_config.model_provider.api_key,
-        openai_api_base=model_config.model_provider.base_url,
-        model_name=model_config.model,
-    )
 
     if configurable.clarify_enable is False:
         return Command(
@@ -54,23 +79,59 @@ async def clarify_intension(
             },
         )
 
-    clarification_model = model.with_structured_output(ClarifyIntension).with_retry(
-        stop_after_attempt=2
-    )
+    force = len(messages) / 2 + 1 >= configurable.max_clarify_turns
+    if force and configurable.clarify_force_fast_path:
+        # 结果已确定为不再澄清, 省去一次带完整历史的模型调用
+        logger.info(
+            "clarify forced",
+            extra={"stage": "clarify_intension", "turns": len(messages)},
+        )
+        return Command(
+            goto="play_core",
+            update={
+                "messages": [AIMessage(content=_FORCE_CLARIFY_REPLY)],
+                "query": _history_query(messages),
+            },
+        )
 
-    logger.info(
-        "llm call",
-        extra={"stage": "clarify_intension", "history": get_buffer_string(messages)},
+    clarification_model = model_registry.structured(
+        configurable.model_for("clarify_intension"),
+        ClarifyIntension,
+        cache=_cache(configurable, "clarify_intension"),
     )
-    force = len(messages) / 2 + 1 >= configurable.max_clarify_turns
+
     prompt_content = clarify_intension_prompt.format(force=str(force).lower())
+    history: dict[str, Any] = {}
+    if configurable.history_compact_enable:
+        model_name = configurable.model_for("clarify_intension")
+        model_config = model_registry.config.models.get(model_name)
+        prompt, summary, summarized = await history_compactor.compact(
+            messages,
+            prompt_content,
+            summary=state.get("history_summary", ""),
+            summarized=state.get("summarized_count", 0),
+            keep_turns=configurable.history_keep_turns,
+            budget=model_config.prompt_token_budget if model_config else None,
+            summarizer=model_registry.retrying(
+                configurable.model_for("history_summary"),
+                cache=_cache(configurable, "history_summary"),
+            ),
+            summary_prompt=history_summary_prompt,
+            stage="clarify_intension",
+        )
+        history = {"history_summary": summary, "summarized_count": summarized}
+    else:
+        prompt = [SystemMessage(content=prompt_content), *messages]
 
-    resp = await clarification_model.ainvoke(
-        [SystemMessage(content=prompt_content), *messages]
+    logger.info(
+        "llm call",
+        extra={"stage": "clarify_intension", "history": get_buffer_string(prompt[1:])},
     )
+    resp = await clarification_model.ainvoke(prompt)
     if resp.need_clarification:
         return Command(
-            goto=END, update={"messages": [AIMessage(content=resp.question)]}
+            goto=END,
+            update={"messages": [AIMessage(content=resp.question)], **history},
         )
     else:
         return Command(
@@ -80,24 +141,19 @@ async def clarify_intension(
                     AIMessage(content=resp.question)
                 ],  # 此时questions是衔接术语
                 "query": resp.verification,
+                **history,
             },
         )
 
 
 async def play_core(
     state: AgentState, config: RunnableConfig
-) -> Command[Literal["play_complete"]]:
+) -> Command[Literal["writer", "expand_event"]]:
     configurable = Configuration.from_runnable_config(config)
-    model_config = modelSet.models[configurable.common_model]
-    if model_config is None:
-        raise ValueError("model not found")
-    model = ChatOpenAI(
-        openai_api_key=model_config.model_provider.api_key,
-        openai_api_base=model_config.model_provider.base_url,
-        model_name=model_config.model,
-    )
-    play_core_model = model.with_structured_output(PlayCoreResp).with_retry(
-        stop_after_attempt=2
+    play_core_model = model_registry.structured(
+        configurable.model_for("play_core"),
+        PlayCoreResp,
+        cache=_cache(configurable, "play_core"),
     )
     prompt_content = play_core_prompt.format(query=state["query"])
 
@@ -111,8 +167,22 @@ async def play_core(
     剧本背景：{play_core_resp.background}
     剧本事件链：{play_core_resp.eventChain}
     """
+    goto: str | list[Send] = "writer"
+    if configurable.expand_enable and play_core_resp.eventChain:
+        # 每个事件一个并行任务, 总耗时取决于最慢的事件
+        goto = [
+            Send(
+                "expand_event",
+                ExpandEventState(
+                    index=index,
+                    event=event,
+                    background=play_core_resp.background,
+                ),
+            )
+            for index, event in enumerate(play_core_resp.eventChain)
+        ]
     return Command(
-        goto="writer",
+        goto=goto,
         update={
             "playname": play_core_resp.name,
             "background": play_core_resp.background,
@@ -124,6 +194,63 @@ async def play_core(
                     HumanMessage(content=raw_note),
                 ],
             },
+            "expanded_events": {"type": "override", "value": []},
+            # 续跑时清除上一轮的循环状态
+            "loop_count": 0,
+            "should_continue": True,
+        },
+    )
+
+
+def _event_name(index: int, event: dict[str, str]) -> str:
+    return event.get("name") or f"事件{index + 1}"
+
+
+def _event_text(event: dict[str, str]) -> str:
+    text = event.get("text") or event.get("description")
+    if text:
+        return text
+    return "\n".join(f"{k}: {v}" for k, v in event.items())
+
+
+async def expand_event(state: ExpandEventState, config: RunnableConfig) -> dict:
+    configurable = Configuration.from_runnable_config(config)
+    index, event = state["index"], state["event"]
+    expand_model = model_registry.structured(
+        configurable.model_for("expand_event"),
+        ExpandResp,
+        cache=_cache(configurable, "expand_event"),
+    )
+    prompt_content = text_expand_prompt.format(
+        background=state["background"], text=_event_text(event)
+    )
+
+    logger.info("llm call", extra={"stage": "expand_event", "history": index})
+    try:
+        async with model_registry.limiter(
+            configurable.model_for("expand_event"), configurable.expand_concurrency
+        ):
+            text = (await expand_model.ainvoke(prompt_content)).text
+    except (openai.APIError, OutputParserException) as e:
+        # 单个事件扩写失败 (模型调用或解析出错) 时保留原文, 不影响整体流程
+        logger.warning(f"Expand event {index} failed: {e}")
+        text = _event_text(event)
+    return {
+        "expanded_events": [
+            {"index": index, "name": _event_name(index, event), "text": text}
+        ]
+    }
+
+
+async def merge_events(
+    state: AgentState, config: RunnableConfig
+) -> Command[Literal["writer"]]:
+    expanded = sorted(state.get("expanded_events", []), key=lambda e: e["index"])
+    note = "\n\n".join(f"{e['name']}\n{e['text']}" for e in expanded)
+    return Command(
+        goto="writer",
+        update={
+            "writer_messages": [HumanMessage(content=f"扩写后的事件：\n{note}")],
         },
     )
 
@@ -132,14 +259,6 @@ async def writer(
     state: AgentState, config: RunnableConfig
 ) -> Command[Literal["play_complete", "supervisor"]]:
     configurable = Configuration.from_runnable_config(config)
-    model_config = modelSet.models[configurable.common_model]
-    if model_config is None:
-        raise ValueError("model not found")
-    model = ChatOpenAI(
-        openai_api_key=model_config.model_provider.api_key,
-        openai_api_base=model_config.model_provider.base_url,
-        model_name=model_config.model,
-    )
     loop_count = state.get("loop_count", 0)
     should_continue = state.get("should_continue", True)
     writer_messages = state.get("writer_messages", [])
@@ -151,7 +270,9 @@ async def writer(
             },
         )
 
-    writer_model = model.with_retry(stop_after_attempt=2)
+    writer_model = model_registry.retrying(
+        configurable.model_for("writer"), cache=_cache(configurable, "writer")
+    )
     logger.info(
         "llm call",
         extra={"stage": "writer", "history": get_buffer_string(writer_messages)},
@@ -181,18 +302,12 @@ async def supervisor(
     state: AgentState, config: RunnableConfig
 ) -> Command[Literal["supervisor"]]:
     configurable = Configuration.from_runnable_config(config)
-    model_config = modelSet.models[configurable.common_model]
-    if model_config is None:
-        raise ValueError("model not found")
-    model = ChatOpenAI(
-        openai_api_key=model_config.model_provider.api_key,
-        openai_api_base=model_config.model_provider.base_url,
-        model_name=model_config.model,
-    )
     writer_messages = state.get("writer_messages", [])
     most_recent_message = writer_messages[-1]
-    supervisor_model = model.with_structured_output(SupervisorResp).with_retry(
-        stop_after_attempt=2
+    supervisor_model = model_registry.structured(
+        configurable.model_for("supervisor"),
+        SupervisorResp,
+        cache=_cache(configurable, "supervisor"),
     )
     prompt_content = supervisor_prompt.format(messages=most_recent_message)
     logger.info(
@@ -210,27 +325,68 @@ async def supervisor(
     )
 
 
+class _CardItemStream(AsyncCallbackHandler):
+    """
+    增量解析 play_complete 的流式输出, 备选开场/角色/事件一旦闭合
+    就通过custom流推送 ``{"field", "index", "value"}``。
+    """
+
+    FIELDS = {"alternate_msgs", "main_character", "others", "events"}
+
+    def __init__(self, write: Callable[[Any], None]):
+        self._write = write
+        self._parser = JSONStreamParser(depth=2)
+        self._sent: set[tuple[str, Any]] = set()
+        self._broken = False
+
+    async def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+        # 重试/纠错时重新解析, 已推送过的条目不再重复推送
+        self._parser = JSONStreamParser(depth=2)
+        self._broken = False
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self._broken or not token:
+            return
+        try:
+            items = list(self._parser.feed(token))
+        except ValueError as e:
+            # 输出不是合法JSON时停止增量推送, 最终结果由结构化解析兜底
+            logger.warning(f"Stop streaming final card items: {e}")
+            self._broken = True
+            return
+        for path, value in items:
+            if path[0] not in self.FIELDS:
+                continue
+            if path[0] == "main_character" and len(path) == 1:
+                key = (path[0], None)
+            elif len(path) == 2 and path[0] != "main_character":
+                key = (path[0], path[1])
+            else:
+                continue
+            if key not in self._sent:
+                self._sent.add(key)
+                self._write({"field": key[0], "index": key[1], "value": value})
+
+
 async def play_complete(
     state: AgentState, config: RunnableConfig
 ) -> Command[Literal["__end__"]]:
     configurable = Configuration.from_runnable_config(config)
-    model_config = modelSet.models[configurable.common_model]
-    if model_config is None:
-        raise ValueError("model not found")
-    model = ChatOpenAI(
-        openai_api_key=model_config.model_provider.api_key,
-        openai_api_base=model_config.model_provider.base_url,
-        model_name=model_config.model,
-    )
     final = state.get("final", None)
     if final is None:
         raise ValueError("final not found")
-    final_model = model.with_structured_output(FinalResp).with_retry(
-        stop_after_attempt=2
+    final_model = model_registry.structured(
+        configurable.model_for("play_complete"),
+        FinalResp,
+        cache=_cache(configurable, "play_complete"),
+        stream=True,
     )
     prompt_content = final_output_prompt.format(text=final)
     logger.info("llm call", extra={"stage": "play_complete", "history": final})
-    final_card = await final_model.ainvoke(prompt_content)
+    item_stream = _CardItemStream(get_stream_writer())
+    final_card = await final_model.ainvoke(
+        prompt_content, merge_configs(config, {"callbacks": [item_stream]})
+    )
     return Command(
         goto=END,
         update={
@@ -247,11 +403,17 @@ card_flow_builder = StateGraph(
 
 card_flow_builder.add_node("clarify_intension", clarify_intension)
 card_flow_builder.add_node("play_core", play_core)
+card_flow_builder.add_node("expand_event", expand_event)
+card_flow_builder.add_node("merge_events", merge_events)
 card_flow_builder.add_node("writer", writer)
 card_flow_builder.add_node("supervisor", supervisor)
 card_flow_builder.add_node("play_complete", play_complete)
 
 card_flow_builder.add_edge(START, "clarify_intension")
+card_flow_builder.add_edge("expand_event", "merge_events")
 card_flow_builder.add_edge("play_complete", END)
 
-card_flow = card_flow_builder.compile()
+# thread_id 为 session_id, 后续轮次从保存的状态继续
+card_flow = card_flow_builder.compile(
+    checkpointer=checkpoint_saver if settings.graph_checkpoint else None
+)
@@ -43,6 +43,24 @@ For the verification message when no clarification is needed:
 
 """
 
+history_summary_prompt = """
+你是跑团剧本策划助手的记录员，负责把较早的澄清对话压缩成摘要，供后续判断是否还需要向用户提问。
+请把此前的摘要和新增的对话合并成一份新的摘要：
+保留用户提出的全部剧本需求和设定细节（时代、地点、世界观、人物、冲突、风格、禁忌等）
+保留助手已经问过的问题以及用户的回答，避免重复提问
+用户前后说法矛盾时以后面的为准
+只输出摘要正文，不超过500字
+
+此前的摘要：
+<Summary>
+{summary}
+</Summary>
+新增的对话：
+<Messages>
+{dialogue}
+</Messages>
+"""
+
 play_core_prompt = """
 你是一名社会洞察型跑团设计师，了解古今中外各种历史性事件，擅长将抽象社会规则转化为可操作的跑团游戏系统。
 基于用户提供的核心文本，设计具象化社会矛盾的沉浸式跑团剧本。
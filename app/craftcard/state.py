@@ -1,5 +1,5 @@
 import operator
-from typing import Annotated
+from typing import Annotated, TypedDict
 
 from langchain_core.messages import MessageLikeRepresentation
 from langgraph.graph import MessagesState
@@ -22,16 +22,27 @@ class AgentState(MessagesState):
     """Main agent state containing messages and research data."""
 
     query: str
+    history_summary: str  # messages[:summarized_count] 的滚动摘要
+    summarized_count: int
     playname: str
     background: str
     eventChain: dict[str, str]
     loop_count: int = 0
     should_continue: bool = True
     writer_messages: Annotated[list[MessageLikeRepresentation], override_reducer]
+    expanded_events: Annotated[list[dict], override_reducer]
     final: str
     final_card: "FinalResp"
 
 
+class ExpandEventState(TypedDict):
+    """Payload sent to a single ``expand_event`` task."""
+
+    index: int
+    event: dict[str, str]
+    background: str
+
+
 class ClarifyIntension(BaseModel):
     """Model for user clarification requests."""
 
@@ -60,6 +71,14 @@ class PlayCoreResp(BaseModel):
     )
 
 
+class ExpandResp(BaseModel):
+    """Model for event expansion response."""
+
+    text: str = Field(
+        description="事件文本的扩写",
+    )
+
+
 class SupervisorResp(BaseModel):
     """Model for supervisor response."""
 
@@ -2,9 +2,10 @@
 FastAPI application setup and configuration.
 """
 
+import asyncio
 import os
 import traceback
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
 
 import uvicorn
@@ -15,10 +16,22 @@ from fastapi.responses import FileResponse, JSONResponse
 from app.api.agents import router as agents_router
 from app.api.store import router as stores_router
 from app.models.schemas import BaseResponse, HealthCheck
+from app.services.history_compaction import history_compactor
+from app.services.job_queue import job_queue
+from app.services.llm_cache import llm_cache
+from app.services.maintenance import (
+    card_reaper,
+    checkpoint_pruner,
+    job_pruner,
+    vacuum_scheduler,
+)
+from app.services.node_usage import node_usage
 from app.services.store_service import store_service
 from app.utils.http_client import close_http_client, init_http_client
 from app.utils.logger import logger
 from app.utils.middleware import RequestIDMiddleware
+from app.utils.model_config import model_registry
+from app.utils.structured_output import structured_output
 from config.settings import settings
 
 
@@ -28,9 +41,47 @@ async def lifespan(app: FastAPI):
     logger.info("Starting AI Learning Assistant RPG application")
 
     # Initialize services
+    background: list[asyncio.Task] = []
     try:
         init_http_client()
         await store_service.init()
+        recovered = await store_service.recover_chunks()
+        if recovered:
+            logger.info("Recovered interrupted turns", extra={"count": recovered})
+        card_reaper.start()
+        await job_queue.start()
+        if settings.content_compression:
+            # 后台压缩已有的大文本行
+            background.append(asyncio.create_task(store_service.compress_existing()))
+        if settings.db_incremental_vacuum:
+            background.append(
+                asyncio.create_task(
+                    vacuum_scheduler(
+                        store_service,
+                        interval=settings.db_vacuum_interval_seconds,
+                        pages_per_step=settings.db_vacuum_pages_per_step,
+                    )
+                )
+            )
+        if settings.graph_checkpoint:
+            background.append(
+                asyncio.create_task(
+                    checkpoint_pruner(
+                        store_service,
+                        interval=settings.checkpoint_prune_interval_seconds,
+                        ttl_days=settings.checkpoint_ttl_days,
+                    )
+                )
+            )
+        background.append(
+            asyncio.create_task(
+                job_pruner(
+                    store_service,
+                    interval=settings.job_prune_interval_seconds,
+                    ttl_days=settings.job_ttl_days,
+                )
+            )
+        )
         logger.info("LLM service is available")
         os.makedirs(settings.card_folder, exist_ok=True)
 
@@ -38,7 +89,16 @@ async def lifespan(app: FastAPI):
         logger.error(f"Error during service initialization: {e}")
 
     yield
+    for task in background:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await job_queue.stop()
+    await card_reaper.stop()
+    await store_service.close()
     await close_http_client()
+    await model_registry.aclose()
+    await llm_cache.close()
     logger.info("Shutting down AI Learning Assistant RPG application")
 
 
@@ -95,6 +155,29 @@ async def health_check():
     )
 
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for internal services."""
+    return {
+        "store": [m.model_dump() for m in store_service.pool_metrics()],
+        "history_cache": store_service.history_cache_metrics().model_dump(),
+        "compression": store_service.compression_metrics().model_dump(),
+        "card_reaper": card_reaper.metrics().model_dump(),
+        "jobs": job_queue.metrics().model_dump(),
+        "llm_cache": llm_cache.metrics().model_dump(),
+        "providers": {
+            name: m.model_dump()
+            for name, m in model_registry.provider_metrics().items()
+        },
+        "structured_output": structured_output.metrics().model_dump(),
+        "history_compaction": history_compactor.metrics().model_dump(),
+        "nodes": {name: m.model_dump() for name, m in node_usage.metrics().items()},
+        "routing": {
+            name: m.model_dump() for name, m in model_registry.routing_metrics().items()
+        },
+    }
+
+
 # Include API routers
 app.include_router(agents_router, prefix="/api/agents", tags=["agents"])
 app.include_router(stores_router, prefix="/api/store", tags=["store"])
@@ -16,6 +16,7 @@ class ResearchStage(str, Enum):
     INITIALIZATION = "initialization"
     CLARIFICATION = "clarification"
     PLAY_CORE = "outline"
+    EXPANSION = "expanding"
     WRITER = "writing"
     SUPERVISOR = "reActing"
     PLAY_COMPLETE = "complete"
@@ -27,6 +28,10 @@ class CraftStreamingEvent(BaseModel):
 
     stage: Optional[ResearchStage] = Field(None, description="Current research stage")
     content: str = Field(..., description="Event content or message")
+    delta: str = Field(default="", description="Incremental token text")
+    item: dict = Field(
+        default_factory=dict, description="Completed item of the final card"
+    )
     FinalResp: dict = Field(default_factory=dict, description="Final response data")
     timestamp: str = Field(
         default_factory=datetime.now().isoformat,
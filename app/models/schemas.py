@@ -4,11 +4,11 @@ Pydantic schemas for request and response models.
 
 from datetime import datetime
 from functools import wraps
-from typing import Any, Callable, Generic, Optional, TypeVar
+from typing import Any, Callable, Generic, Literal, Optional, TypeVar
 
 from pydantic import BaseModel, Field
 
-from .store import Conversation, Session
+from .store import Conversation, Session, SessionType
 
 T = TypeVar("T")
 
@@ -70,6 +70,13 @@ class CraftCardRequest(BaseModel):
     session_id: str = Field(default="", description="The session ID")
     parent_cid: str = Field(default="", description="Parent conversation ID")
     model: str = Field(default="default", description="The model to use")
+    node_models: dict[str, str] = Field(
+        default_factory=dict, description="Per graph node model overrides"
+    )
+    stream_tokens: bool = Field(
+        default=False,
+        description="Also send delta (writer tokens) and item (closed card items) events",
+    )
 
 
 class StreamEvent(BaseModel):
@@ -82,15 +89,28 @@ class StreamEvent(BaseModel):
 
 class SessionListRequest(BaseModel):
     limit: int = Field(50, gt=0, le=100, description="Number of sessions to return")
-    offset: int = Field(0, ge=0, description="Number of sessions to skip")
+    offset: int = Field(
+        0, ge=0, description="Number of sessions to skip (deprecated, use cursor)"
+    )
+    cursor: str = Field(
+        default="", description="Opaque cursor returned by the previous page"
+    )
+    type: Optional[SessionType] = Field(
+        default=None, description="Only return sessions of this type"
+    )
 
 
 class SessionListResponse(BaseModel):
     sessions: list[Session] = Field(default=[], description="List of sessions")
+    next_cursor: str = Field(default="", description="Cursor of the next page")
+    has_more: bool = Field(default=False, description="Whether more sessions exist")
 
 
 class ConversationListRequest(BaseModel):
     session_id: str = Field(..., description="The session ID to list conversations for")
+    leaf_cid: str = Field(
+        default="", description="Only return the branch ending at this conversation"
+    )
 
 
 class ConversationListResponse(BaseModel):
@@ -109,7 +129,46 @@ class DeleteSessionResponse(BaseModel):
     )
 
 
+class BulkDeleteSessionRequest(BaseModel):
+    session_ids: list[str] = Field(
+        default_factory=list, max_length=10000, description="Session IDs to delete"
+    )
+    older_than_days: Optional[float] = Field(
+        default=None, gt=0, description="Delete sessions created more than N days ago"
+    )
+
+
+class BulkDeleteSessionResponse(BaseModel):
+    deleted: int = Field(..., description="Number of sessions deleted")
+
+
 class CardImportRequest(BaseModel):
     session_id: str = Field(
         ..., description="The session ID to associate the card with"
     )
+
+
+class SearchRequest(BaseModel):
+    query: str = Field(
+        ...,
+        min_length=1,
+        description="Search text, terms shorter than 3 characters only match recent rows",
+    )
+    kinds: list[Literal["session", "conversation", "card"]] = Field(
+        default_factory=list, description="Restrict to these kinds, empty for all"
+    )
+    limit: int = Field(20, gt=0, le=100, description="Number of results to return")
+    offset: int = Field(0, ge=0, description="Number of results to skip")
+
+
+class SearchHit(BaseModel):
+    kind: str = Field(..., description="session / conversation / card")
+    id: str = Field(..., description="Identifier of the matched row")
+    session_id: str = Field(..., description="Session the matched row belongs to")
+    snippet: str = Field(..., description="Matched text with <mark> highlights")
+    score: float = Field(..., description="bm25 score, lower is better")
+
+
+class SearchResponse(BaseModel):
+    results: list[SearchHit] = Field(default=[], description="Ranked search hits")
+    has_more: bool = Field(default=False, description="Whether more hits exist")
@@ -14,6 +14,21 @@ class ConversationType(str, Enum):
     AI = "ai"
 
 
+class ConversationStatus(str, Enum):
+    NORMAL = ""
+    CANCELLED = "cancelled"  # 客户端断开或主动取消, 内容为已输出的部分
+    FAILED = "failed"  # 制作过程中出错, 内容为出错前已输出的部分
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    INTERRUPTED = "interrupted"  # 运行中进程退出
+    CANCELLED = "cancelled"
+
+
 class Session(BaseModel):
     id: str = Field(..., description="Unique identifier for the session")
     title: str = Field(..., description="Title of the session")
@@ -25,11 +40,17 @@ class Session(BaseModel):
 
 class Conversation(BaseModel):
     id: str = Field(..., description="Unique identifier for the conversation")
+    parent_cid: str = Field(
+        default="", description="Identifier of the parent conversation"
+    )
     session_id: str = Field(
         ..., description="Identifier of the session this conversation belongs to"
     )
     content: str = Field(..., description="Content of the conversation")
     type: str = Field(..., description="Type of the conversation")
+    status: str = Field(
+        default="", description="Empty when complete, 'cancelled' if cut short"
+    )
     created_at: str = Field(
         ..., description="ISO timestamp when the conversation was created"
     )
@@ -0,0 +1,201 @@
+"""
+LangGraph checkpoint saver backed by the session SQLite store.
+
+checkpoint与会话数据写在同一个(分片)数据库中, thread_id 使用 session_id,
+删除会话时一并删除; 后续轮次从保存的状态继续, 而不是重放全部历史。
+"""
+
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from app.services.store_service import StoreService, store_service
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver[str]):
+    """Async-only checkpoint saver on top of :class:`StoreService`."""
+
+    def __init__(self, store: StoreService):
+        super().__init__()
+        self._store = store
+
+    def _tuple(self, thread_id: str, ns: str, row: dict[str, Any]) -> CheckpointTuple:
+        def config(checkpoint_id: str) -> RunnableConfig:
+            return {
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            }
+
+        parent = row["parent_checkpoint_id"]
+        return CheckpointTuple(
+            config=config(row["checkpoint_id"]),
+            checkpoint=self.serde.loads_typed((row["type"], row["checkpoint"])),
+            metadata=self.serde.loads_typed((row["metadata_type"], row["metadata"])),
+            parent_config=config(parent) if parent else None,
+            pending_writes=[
+                (
+                    w["task_id"],
+                    w["channel"],
+                    self.serde.loads_typed((w["type"], w["value"])),
+                )
+                for w in row["writes"]
+            ],
+        )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        row = await self._store.get_checkpoint(
+            thread_id, ns, get_checkpoint_id(config) or ""
+        )
+        return self._tuple(thread_id, ns, row) if row else None
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        if config is None:
+            # 按session分片存储, 不支持跨thread遍历
+            return
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns")
+        rows = await self._store.list_checkpoints(
+            thread_id,
+            ns=ns,
+            before=get_checkpoint_id(before) if before else "",
+            limit=None if filter else limit,
+        )
+        count = 0
+        for row in rows:
+            item = self._tuple(thread_id, row["checkpoint_ns"], row)
+            if filter and any(item.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            yield item
+            count += 1
+            if limit and count >= limit:
+                return
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        await self._store.put_checkpoint(
+            thread_id,
+            ns,
+            checkpoint["id"],
+            config["configurable"].get("checkpoint_id"),
+            self.serde.dumps_typed(checkpoint),
+            self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+        )
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append(
+                (
+                    task_id,
+                    WRITES_IDX_MAP.get(channel, idx),
+                    channel,
+                    type_,
+                    blob,
+                    task_path,
+                )
+            )
+        await self._store.put_checkpoint_writes(
+            config["configurable"]["thread_id"],
+            config["configurable"].get("checkpoint_ns", ""),
+            config["configurable"]["checkpoint_id"],
+            rows,
+            # 特殊channel(错误/中断等)可覆盖, 普通写入保持首次结果
+            replace=all(channel in WRITES_IDX_MAP for channel, _ in writes),
+        )
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self._store.delete_checkpoints(thread_id)
+
+    async def prepare_thread(self, thread_id: str, conversation_id: str) -> bool:
+        """
+        判断保存的状态是否以 ``conversation_id`` 这一轮结束, 是则可以直接续跑;
+        否则 (编辑/分支旧消息, 或没有checkpoint) 清空该thread, 由调用方重放历史。
+        """
+        latest = await self.aget_tuple({"configurable": {"thread_id": thread_id}})
+        if latest is None:
+            return False
+        if (
+            conversation_id
+            and latest.metadata.get("conversation_id") == conversation_id
+        ):
+            return True
+        await self.adelete_thread(thread_id)
+        return False
+
+    # 仅支持异步接口
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        raise NotImplementedError("SQLiteCheckpointSaver only supports async methods")
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        raise NotImplementedError("SQLiteCheckpointSaver only supports async methods")
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        raise NotImplementedError("SQLiteCheckpointSaver only supports async methods")
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        raise NotImplementedError("SQLiteCheckpointSaver only supports async methods")
+
+
+checkpoint_saver = SQLiteCheckpointSaver(store_service)
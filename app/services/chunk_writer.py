@@ -0,0 +1,93 @@
+"""
+Batched writer for streamed AI message chunks.
+
+流式输出的事件先缓存在内存中, 每累计 ``max_events`` 个或距首个未落盘事件超过
+``max_delay_ms`` 毫秒时批量追加到 ``conversation_chunk``; 结束时由
+``finish_turn`` 合并为最终内容。
+"""
+
+import asyncio
+from contextlib import suppress
+from typing import Any, Dict, List, Optional
+
+from app.models.store import ConversationStatus
+from app.services.store_service import StoreService
+from app.utils.logger import logger
+
+
+class ChunkWriter:
+    """Buffer chunks of one AI message and flush them in batches."""
+
+    def __init__(
+        self,
+        store: StoreService,
+        conversation_id: str,
+        session_id: str = "",
+        max_events: int = 8,
+        max_delay_ms: int = 500,
+    ):
+        self._store = store
+        self._conversation_id = conversation_id
+        self._session_id = session_id
+        self._max_events = max(1, max_events)
+        self._max_delay = max_delay_ms / 1000
+        self._pending: List[str] = []
+        self._seq = 0
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def add(self, chunk: str) -> None:
+        self._pending.append(chunk)
+        if len(self._pending) >= self._max_events:
+            await self.flush()
+        elif self._timer is None:
+            # 事件间隔可能很长 (等待LLM), 用定时器保证延迟上限
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._max_delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"Failed to flush conversation chunks: {e}")
+
+    async def flush(self) -> None:
+        """Write buffered chunks now."""
+        async with self._lock:
+            if not self._pending:
+                return
+            chunks, self._pending = self._pending, []
+            await self._write(self._seq, chunks)
+            self._seq += len(chunks)
+
+    async def _write(self, seq: int, chunks: List[str]) -> None:
+        await self._store.append_chunks(
+            self._conversation_id, seq, chunks, session_id=self._session_id
+        )
+
+    async def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            timer, self._timer = self._timer, None
+            timer.cancel()
+            with suppress(asyncio.CancelledError):
+                await timer
+
+    async def close(self) -> None:
+        """Flush what is left without compacting (interrupted turn)."""
+        await self._cancel_timer()
+        await self.flush()
+
+    async def finish(
+        self,
+        card: Optional[Dict[str, Any]] = None,
+        status: str = ConversationStatus.NORMAL.value,
+    ) -> bool:
+        """Flush and compact the chunks into the conversation row."""
+        await self.close()
+        return await self._store.finish_turn(
+            conversation_id=self._conversation_id,
+            card=card,
+            session_id=self._session_id,
+            status=status,
+        )
@@ -0,0 +1,91 @@
+"""
+Transparent compression for large text columns.
+
+大文本 (AI输出、剧本全文、角色卡背景) 以带版本头的 zlib BLOB 存储,
+普通 TEXT 行保持不变; 读取时根据头部自动解压。
+"""
+
+import time
+import zlib
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+# 预置字典: 覆盖剧本输出与流式事件中的高频片段, 对短文本压缩率提升明显。
+# 注意: 字典内容一旦发布不可修改, 否则旧数据无法解压; 需要调整时新增版本。
+_ZDICT_V1 = (
+    "🚀 开始制作剧本\n🔍 \n1️⃣ 核心内容生成中...\n剧本名称: \n背景: \n"
+    "✍️ 剧本撰写中...\n剧本内容预览:\n剧本内容正在生成中...\n🛡️ 反思检查中...\n"
+    "✅ 角色卡制作完成!\n"
+    "跑团剧本 故事背景 核心冲突 待解决的目标 事件链 事件名称 事件文本 事件描述 "
+    "角色背景 角色简介 主角 其他角色 第一幕 备选的第一幕文本 决策点 分支 选择 线索 "
+    "玩家 扮演 世界观 时代 社会矛盾 危机 任务 动机 职业 性格 目标 结局 启示 "
+    "你是 你的 我们 他们 这个 一个 没有 已经 因为 所以 但是 如果 然后 于是 "
+    "时间 地点 人物 冲突 高潮 发展 情节 剧情 故事 现实 历史 社会 经济 心理 "
+    '"title": "first_msg": "alternate_msgs": ["main_character": {"name": '
+    '"description": "others": [{"name": "events": [{"name": "eventChain": '
+    '"need_clarification": "question": "verification": "should_continue": '
+    '"advice": "background": "text": '
+    "，。！？、；：“”‘’（）《》……——\n\n"
+).encode("utf-8")
+
+_HEADER_V1 = b"\x1fz1"
+
+
+class CompressionMetrics(BaseModel):
+    """Compression counters."""
+
+    encoded: int = Field(0, description="Values stored compressed")
+    skipped: int = Field(0, description="Values stored as plain text")
+    raw_bytes: int = Field(0, description="UTF-8 size of compressed values")
+    stored_bytes: int = Field(0, description="Stored size of compressed values")
+    encode_ms: float = Field(0.0, description="Total compression time")
+    decoded: int = Field(0, description="Values decompressed on read")
+    decode_ms: float = Field(0.0, description="Total decompression time")
+
+
+class ContentCodec:
+    """Encode large strings to compressed BLOBs and decode them back."""
+
+    def __init__(self, enabled: bool = False, min_bytes: int = 1024, level: int = 6):
+        self.enabled = enabled
+        self._min_bytes = min_bytes
+        self._level = level
+        self._metrics = CompressionMetrics()
+
+    def encode(self, text: str) -> str | bytes:
+        """Return a compressed BLOB for large text, the text itself otherwise."""
+        if not self.enabled:
+            return text
+        raw = text.encode("utf-8")
+        if len(raw) < self._min_bytes:
+            self._metrics.skipped += 1
+            return text
+        start = time.perf_counter()
+        compressor = zlib.compressobj(self._level, zdict=_ZDICT_V1)
+        packed = _HEADER_V1 + compressor.compress(raw) + compressor.flush()
+        self._metrics.encode_ms += (time.perf_counter() - start) * 1000
+        if len(packed) >= len(raw):
+            self._metrics.skipped += 1
+            return text
+        self._metrics.encoded += 1
+        self._metrics.raw_bytes += len(raw)
+        self._metrics.stored_bytes += len(packed)
+        return packed
+
+    def decode(self, value: Any) -> Any:
+        """Decode a stored value; non-bytes values are returned unchanged."""
+        if not isinstance(value, (bytes, bytearray)):
+            return value
+        if not value.startswith(_HEADER_V1):
+            return bytes(value).decode("utf-8")
+        start = time.perf_counter()
+        decompressor = zlib.decompressobj(zdict=_ZDICT_V1)
+        raw = decompressor.decompress(value[len(_HEADER_V1) :])
+        raw += decompressor.flush()
+        self._metrics.decoded += 1
+        self._metrics.decode_ms += (time.perf_counter() - start) * 1000
+        return raw.decode("utf-8")
+
+    def metrics(self) -> CompressionMetrics:
+        return self._metrics.model_copy()
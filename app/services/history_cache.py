@@ -0,0 +1,124 @@
+"""
+In-process LRU cache of per-session conversation trees.
+
+缓存已解码的对话行 (id -> row)，由 StoreService 在写入提交后增量更新，
+读历史时直接在内存中沿 parent_cid 回溯分支，避免重复查询数据库。
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class HistoryCacheMetrics(BaseModel):
+    """History cache counters."""
+
+    sessions: int = Field(0, description="Sessions currently cached")
+    capacity: int = Field(0, description="Maximum number of cached sessions")
+    hits: int = Field(0, description="Lookups served from memory")
+    misses: int = Field(0, description="Lookups that had to load from SQLite")
+    evictions: int = Field(0, description="Sessions evicted by the LRU policy")
+
+
+class HistoryCache:
+    """Size-bounded LRU of ``session_id -> {conversation_id: row}``."""
+
+    def __init__(self, capacity: int = 256):
+        self._capacity = capacity
+        # 每个session内的行按写入顺序排列, 最后一行即最新消息
+        self._sessions: OrderedDict[str, Dict[str, Dict[str, Any]]] = OrderedDict()
+        self._metrics = HistoryCacheMetrics(capacity=capacity)
+
+    @property
+    def enabled(self) -> bool:
+        return self._capacity > 0
+
+    def get(self, session_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Cached ``{conversation_id: row}`` of a session, None on a miss."""
+        nodes = self._sessions.get(session_id)
+        if nodes is None:
+            self._metrics.misses += 1
+            return None
+        self._sessions.move_to_end(session_id)
+        self._metrics.hits += 1
+        return nodes
+
+    def load(
+        self, session_id: str, rows: List[Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Populate a session from rows ordered oldest first.
+
+        只能在持有写连接时调用, 否则并发提交的新行可能被旧快照覆盖。
+        """
+        nodes = {row["id"]: row for row in rows}
+        if not self.enabled:
+            return nodes
+        self._sessions[session_id] = nodes
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self._capacity:
+            self._sessions.popitem(last=False)
+            self._metrics.evictions += 1
+        return nodes
+
+    def append(self, session_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Add newly committed rows to a cached session (no-op when not cached)."""
+        nodes = self._sessions.get(session_id)
+        if nodes is None:
+            return
+        for row in rows:
+            nodes[row["id"]] = row
+
+    def update(
+        self, conversation_id: str, content: str, status: Optional[str] = None
+    ) -> None:
+        """Replace the content (and status) of a cached conversation."""
+        for nodes in self._sessions.values():
+            row = nodes.get(conversation_id)
+            if row is not None:
+                row["content"] = content
+                if status is not None:
+                    row["status"] = status
+                return
+
+    def owner(self, conversation_id: str) -> Optional[str]:
+        """Session id of a cached conversation, None when not cached."""
+        for session_id, nodes in self._sessions.items():
+            if conversation_id in nodes:
+                return session_id
+        return None
+
+    def remove(self, conversation_id: str) -> None:
+        for nodes in self._sessions.values():
+            if nodes.pop(conversation_id, None) is not None:
+                return
+
+    def invalidate(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def metrics(self) -> HistoryCacheMetrics:
+        metrics = self._metrics.model_copy()
+        metrics.sessions = len(self._sessions)
+        return metrics
+
+
+def latest_cid(nodes: Dict[str, Dict[str, Any]]) -> str:
+    """Id of the newest conversation in a cached session, "" if empty."""
+    return next(reversed(nodes), "")
+
+
+def walk_branch(
+    nodes: Dict[str, Dict[str, Any]], leaf_cid: str, max_depth: int
+) -> List[Dict[str, Any]]:
+    """Rows from the root to ``leaf_cid`` following ``parent_cid``."""
+    result: List[Dict[str, Any]] = []
+    cid = leaf_cid
+    while cid and len(result) < max_depth:
+        row = nodes.get(cid)
+        if row is None:
+            break
+        result.append(dict(row))
+        cid = row.get("parent_cid", "")
+    result.reverse()
+    return result
@@ -0,0 +1,160 @@
+"""
+Token-budgeted compaction of a conversation history.
+
+只保留最近 ``keep_turns`` 轮原文, 更早的轮次滚动合并进一份摘要; 摘要与已合并的
+消息数由调用方保存在会话状态中, 之后每次只需把新滚出窗口的轮次并入摘要。
+压缩后仍超过模型的输入token预算时, 继续把最旧的轮次并入摘要, 直到只剩本轮用户消息。
+"""
+
+from typing import Optional
+
+from langchain_core.messages import (
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    get_buffer_string,
+)
+from langchain_core.runnables import Runnable
+from pydantic import BaseModel, Field
+
+from app.utils.logger import logger
+from app.utils.rate_limit import estimate_tokens
+
+# 每条消息的角色等格式开销
+_MESSAGE_OVERHEAD = 4
+
+_SUMMARY_SECTION = "\n\n此前对话的摘要 (更早的轮次已省略):\n{summary}"
+
+
+class HistoryCompactionMetrics(BaseModel):
+    """History compaction counters, token counts are local estimates."""
+
+    turns: int = Field(
+        0, description="Model calls whose history went through compaction"
+    )
+    compacted: int = Field(
+        0, description="Calls that sent a summary instead of older turns"
+    )
+    summaries: int = Field(0, description="Summary model calls")
+    summary_tokens: int = Field(0, description="Prompt tokens spent on summary calls")
+    tokens_before: int = Field(0, description="Prompt tokens with the full history")
+    tokens_after: int = Field(0, description="Prompt tokens actually sent")
+    tokens_saved: int = Field(0, description="tokens_before - tokens_after")
+    avg_tokens_saved: Optional[float] = Field(None, description="tokens_saved / turns")
+    over_budget: int = Field(0, description="Calls still over budget after compaction")
+
+
+def message_tokens(messages: list[BaseMessage]) -> int:
+    return sum(estimate_tokens(m.text()) + _MESSAGE_OVERHEAD for m in messages)
+
+
+class HistoryCompactor:
+    """Rolling-summary compaction of a ``[human, ai, ..., human]`` history."""
+
+    def __init__(self):
+        self._metrics = HistoryCompactionMetrics()
+
+    def _cut(
+        self,
+        messages: list[BaseMessage],
+        system: str,
+        summary: str,
+        summarized: int,
+        keep_turns: int,
+        budget: Optional[int],
+    ) -> int:
+        """Index of the first message kept verbatim."""
+        last = len(messages) - 1
+        # 最近 keep_turns 轮 (AI提问 + 用户回答) 与本轮用户消息保留原文
+        cut = max(summarized, last - 2 * keep_turns)
+        # 滚出窗口的轮次攒够 keep_turns 轮再合并, 避免每轮都调用一次摘要
+        if cut - summarized < 2 * max(1, keep_turns):
+            cut = summarized
+        fixed = estimate_tokens(system + summary) + _MESSAGE_OVERHEAD
+        while budget and cut < last and fixed + message_tokens(messages[cut:]) > budget:
+            cut = min(cut + 2, last)
+        return cut
+
+    async def _summarize(
+        self,
+        summarizer: Runnable,
+        prompt: str,
+        summary: str,
+        messages: list[BaseMessage],
+    ) -> str:
+        content = prompt.format(
+            summary=summary or "无",
+            dialogue=get_buffer_string(messages, human_prefix="用户", ai_prefix="助手"),
+        )
+        self._metrics.summaries += 1
+        self._metrics.summary_tokens += estimate_tokens(content)
+        resp = await summarizer.ainvoke([HumanMessage(content=content)])
+        return resp.text().strip()
+
+    async def compact(
+        self,
+        messages: list[BaseMessage],
+        system: str,
+        *,
+        summary: str,
+        summarized: int,
+        keep_turns: int,
+        budget: Optional[int],
+        summarizer: Runnable,
+        summary_prompt: str,
+        stage: str = "",
+    ) -> tuple[list[BaseMessage], str, int]:
+        """
+        Messages to send (system prompt first) for ``messages``.
+
+        ``summary`` 概括了 ``messages[:summarized]``; 返回发送的消息列表,
+        以及更新后的摘要与已合并的消息数, 由调用方写回会话状态。
+        """
+        if summarized > len(messages):
+            # 历史被改写 (分支/编辑), 旧摘要作废
+            summary, summarized = "", 0
+        before = estimate_tokens(system) + _MESSAGE_OVERHEAD + message_tokens(messages)
+        cut = self._cut(messages, system, summary, summarized, keep_turns, budget)
+        if cut > summarized:
+            summary = await self._summarize(
+                summarizer, summary_prompt, summary, messages[summarized:cut]
+            )
+            summarized = cut
+        if summary:
+            system += _SUMMARY_SECTION.format(summary=summary)
+        compacted = [SystemMessage(content=system), *messages[summarized:]]
+        after = message_tokens(compacted)
+        metrics = self._metrics
+        metrics.turns += 1
+        metrics.tokens_before += before
+        metrics.tokens_after += after
+        metrics.tokens_saved += before - after
+        if summary:
+            metrics.compacted += 1
+        if budget and after > budget:
+            metrics.over_budget += 1
+            logger.warning(
+                f"Prompt still over budget after compaction: {after} > {budget}",
+                extra={"stage": stage},
+            )
+        logger.info(
+            "history compacted",
+            extra={
+                "stage": stage,
+                "messages": len(messages),
+                "summarized": summarized,
+                "tokens_before": before,
+                "tokens_after": after,
+                "tokens_saved": before - after,
+            },
+        )
+        return compacted, summary, summarized
+
+    def metrics(self) -> HistoryCompactionMetrics:
+        metrics = self._metrics.model_copy()
+        if metrics.turns:
+            metrics.avg_tokens_saved = metrics.tokens_saved / metrics.turns
+        return metrics
+
+
+history_compactor = HistoryCompactor()
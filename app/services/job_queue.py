@@ -0,0 +1,501 @@
+"""
+Background job queue with resumable event streams.
+
+制作任务不再运行在HTTP请求的生成器里: 请求只负责入队, 固定数量的worker执行任务,
+任务输出的SSE事件按序号写入内存环形缓冲并批量持久化到 ``job_event``。
+客户端断开不影响任务, 可带 ``Last-Event-ID`` 重新订阅补齐错过的事件,
+已被挤出缓冲或任务已移出内存时从SQLite回放。
+没有任何订阅者超过 ``detach_grace_seconds`` 的任务被取消, 取消沿图的运行任务
+传递到对模型provider的HTTP请求。
+提交时带 ``key`` 且相同key的任务仍在排队或运行时, 新任务作为跟随者 (follower)
+不占用worker, 由注册的follower runner转发领头任务的事件, 不再重复调用LLM。
+"""
+
+import asyncio
+import contextvars
+import json
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from app.models.store import JobStatus
+from app.services.chunk_writer import ChunkWriter
+from app.services.store_service import StoreService, store_service
+from app.utils.logger import logger
+from config.settings import settings
+
+# 发布一个SSE事件的data
+Publish = Callable[[str], Awaitable[None]]
+# (入队时的请求参数, publish)
+Runner = Callable[[Dict[str, Any], Publish], Awaitable[None]]
+# (序号, data), None表示等待超时, 调用方可发送keepalive
+JobEvent = Optional[Tuple[int, str]]
+
+FINISHED = (
+    JobStatus.DONE,
+    JobStatus.FAILED,
+    JobStatus.INTERRUPTED,
+    JobStatus.CANCELLED,
+)
+# 事件流结束标记, 与原SSE接口一致
+DONE_EVENT = "[DONE]"
+
+
+class JobQueueMetrics(BaseModel):
+    """Job queue counters."""
+
+    workers: int = Field(0, description="Worker tasks")
+    capacity: int = Field(0, description="Max jobs waiting for a worker")
+    queued: int = Field(0, description="Jobs waiting for a worker")
+    running: int = Field(0, description="Jobs being run")
+    submitted: int = Field(0, description="Jobs accepted")
+    rejected: int = Field(0, description="Jobs refused because the queue was full")
+    completed: int = Field(0, description="Jobs that finished normally")
+    failed: int = Field(0, description="Jobs that raised")
+    interrupted: int = Field(0, description="Jobs stopped by a shutdown or restart")
+    cancelled: int = Field(0, description="Jobs cancelled before finishing")
+    abandoned: int = Field(
+        0, description="Cancelled jobs whose clients disconnected and never returned"
+    )
+    coalesced: int = Field(
+        0, description="Jobs that followed an identical in-flight job"
+    )
+    subscribers: int = Field(0, description="Event streams currently attached")
+    resumed: int = Field(0, description="Subscriptions with a Last-Event-ID")
+    replayed: int = Field(0, description="Past events sent to subscribers")
+    replayed_from_db: int = Field(0, description="Replayed events read from SQLite")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobEventWriter(ChunkWriter):
+    """Batched writer of a job's SSE payloads into ``job_event``."""
+
+    def __init__(
+        self, store: StoreService, job_id: str, start_seq: int = 0, **kwargs: Any
+    ):
+        super().__init__(store, conversation_id=job_id, **kwargs)
+        self._seq = start_seq
+
+    async def _write(self, seq: int, chunks: list[str]) -> None:
+        await self._store.append_job_events(self._conversation_id, seq, chunks)
+
+
+class Job:
+    """One job: recent events in a ring buffer, all of them in SQLite."""
+
+    def __init__(
+        self,
+        job_id: str,
+        kind: str,
+        request: Dict[str, Any],
+        store: StoreService,
+        metrics: JobQueueMetrics,
+        buffer_size: int,
+        flush_events: int,
+        flush_ms: int,
+        next_seq: int = 0,
+    ):
+        self.id = job_id
+        self.kind = kind
+        self.request = request
+        self.status = JobStatus.QUEUED
+        self.error = ""
+        self.cancel_reason = ""
+        # 可合并的任务的key
+        self.key: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        self.abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._store = store
+        self._metrics = metrics
+        self._writer = JobEventWriter(
+            store,
+            job_id,
+            start_seq=next_seq,
+            max_events=flush_events,
+            max_delay_ms=flush_ms,
+        )
+        self._events: deque[Tuple[int, str]] = deque(maxlen=max(1, buffer_size))
+        self._next_seq = next_seq
+        # 提交时的上下文 (日志中的request_id), worker在其中运行任务
+        self.context = contextvars.copy_context()
+        # 每次发布事件时替换, 订阅者等待发布前取到的那个
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    @property
+    def events_count(self) -> int:
+        return self._next_seq
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def publish(self, data: str) -> None:
+        self._events.append((self._next_seq, data))
+        self._next_seq += 1
+        self._wake()
+        await self._writer.add(data)
+
+    async def finish(self, status: JobStatus, error: str = "") -> None:
+        """Publish the closing events and persist the final status."""
+        self.error = error
+        try:
+            if status != JobStatus.DONE:
+                await self.publish(
+                    json.dumps(
+                        {"job_id": self.id, "status": status.value, "error": error},
+                        ensure_ascii=False,
+                    )
+                )
+            await self.publish(DONE_EVENT)
+            await self._writer.close()
+        finally:
+            self.status = status
+            self._wake()
+            await self._store.update_job(self.id, status.value, error)
+
+    async def events(self, after: int, keepalive: float) -> AsyncIterator[JobEvent]:
+        """Events with ``seq > after`` until the job has finished."""
+        live_from = self._next_seq
+        while True:
+            changed = self._changed
+            buffered = list(self._events)
+            oldest = buffered[0][0] if buffered else self._next_seq
+            if after + 1 < oldest:
+                # 已被挤出环形缓冲, 先从SQLite补齐
+                await self._writer.flush()
+                for seq, data in await self._store.list_job_events(
+                    self.id, after, oldest
+                ):
+                    self._metrics.replayed += 1
+                    self._metrics.replayed_from_db += 1
+                    after = seq
+                    yield seq, data
+            for seq, data in buffered:
+                if seq > after:
+                    if seq < live_from:
+                        self._metrics.replayed += 1
+                    after = seq
+                    yield seq, data
+            if self.finished and after >= self._next_seq - 1:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class JobQueue:
+    """Bounded FIFO of jobs run by a fixed pool of workers."""
+
+    def __init__(
+        self,
+        store: StoreService,
+        workers: int = 4,
+        max_queued: int = 100,
+        buffer_size: int = 512,
+        retention_seconds: float = 600,
+        flush_events: int = 8,
+        flush_ms: int = 500,
+        detach_grace_seconds: Optional[float] = 30,
+    ):
+        self._store = store
+        self._workers_count = max(1, workers)
+        self._max_queued = max_queued
+        self._buffer_size = buffer_size
+        self._retention = retention_seconds
+        self._flush = (flush_events, flush_ms)
+        # None表示客户端断开后任务继续运行
+        self._detach_grace = detach_grace_seconds
+        self._cancelling: set[asyncio.Task] = set()
+        self._runners: Dict[str, Runner] = {}
+        # 任务类型 -> 其跟随者的任务类型
+        self._followers: Dict[str, str] = {}
+        # key -> 排队或运行中的领头任务
+        self._flights: Dict[str, Job] = {}
+        # 不经过worker、直接运行的跟随者任务
+        self._following: set[asyncio.Task] = set()
+        # 排队、运行中以及刚结束 (retention_seconds内) 的任务
+        self._jobs: Dict[str, Job] = {}
+        self._queue: asyncio.Queue[Job] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._metrics = JobQueueMetrics(
+            workers=self._workers_count, capacity=max_queued
+        )
+
+    def register(
+        self, kind: str, runner: Runner, follower: Optional[Runner] = None
+    ) -> None:
+        """
+        Register the runner of a job kind.
+
+        ``follower`` 运行合并到同key任务上的请求, 请求参数中的 ``leader_id``
+        为领头任务的id。
+        """
+        self._runners[kind] = runner
+        if follower is not None:
+            self._followers[kind] = f"{kind}.follower"
+            self._runners[f"{kind}.follower"] = follower
+
+    def _job(
+        self, job_id: str, kind: str, request: Dict[str, Any], next_seq: int = 0
+    ) -> Job:
+        job = Job(
+            job_id,
+            kind,
+            request,
+            self._store,
+            self._metrics,
+            self._buffer_size,
+            *self._flush,
+            next_seq=next_seq,
+        )
+        self._jobs[job_id] = job
+        return job
+
+    async def start(self) -> None:
+        """
+        Start the workers.
+
+        上次退出时仍在排队的任务重新入队; 运行到一半的任务 (进程被杀) 标记为中断,
+        已输出的部分由 ``recover_chunks`` 合并, 不重复调用LLM。
+        """
+        for row in await self._store.list_jobs(
+            [JobStatus.QUEUED.value, JobStatus.RUNNING.value]
+        ):
+            if row["status"] == JobStatus.QUEUED.value and row["kind"] in self._runners:
+                job = self._job(row["id"], row["kind"], json.loads(row["request"]))
+                self._enqueue(job)
+                # 客户端需要在宽限时间内重新订阅
+                self._detached(job)
+                continue
+            # 续接已持久化的事件序号
+            job = self._job(row["id"], row["kind"], {}, next_seq=row["events"])
+            await job.finish(JobStatus.INTERRUPTED, "server restarted")
+            self._metrics.interrupted += 1
+            self._forget_later(job)
+        if self._queue.qsize():
+            logger.info("Re-queued jobs", extra={"count": self._queue.qsize()})
+        for _ in range(self._workers_count - len(self._workers)):
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def stop(self) -> None:
+        """Cancel the workers, running jobs are marked interrupted."""
+        tasks = [*self._workers, *self._following]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers.clear()
+
+    def _enqueue(self, job: Job) -> None:
+        if job.kind in self._followers.values():
+            # 跟随者只转发事件, 不占用worker, 也避免排在领头任务前面
+            task = asyncio.create_task(self._run(job))
+            self._following.add(task)
+            task.add_done_callback(self._following.discard)
+        else:
+            self._queue.put_nowait(job)
+
+    def _flight(self, key: Optional[str]) -> Optional[Job]:
+        leader = self._flights.get(key) if key else None
+        if leader is None or leader.finished or leader.cancel_reason:
+            return None
+        return leader
+
+    async def submit(
+        self, kind: str, request: Dict[str, Any], key: Optional[str] = None
+    ) -> Job:
+        """
+        Queue a job.
+
+        ``key`` 相同的任务正在排队或运行时, 改为提交跟随该任务的follower。
+        """
+        if kind not in self._runners:
+            raise ValueError(f"Unknown job kind {kind}")
+        leader = self._flight(key) if kind in self._followers else None
+        if leader is not None:
+            kind = self._followers[kind]
+            request = {**request, "leader_id": leader.id}
+        elif self._queue.qsize() >= self._max_queued:
+            self._metrics.rejected += 1
+            raise QueueFullError(f"{self._queue.qsize()} jobs already queued")
+        job = self._job(uuid.uuid4().hex, kind, request)
+        await self._store.create_job(
+            job.id, kind, json.dumps(request, ensure_ascii=False), job.status.value
+        )
+        if leader is not None:
+            self._metrics.coalesced += 1
+            logger.info(
+                "Coalesced job", extra={"job_id": job.id, "leader_id": leader.id}
+            )
+        elif key:
+            job.key = key
+            self._flights[key] = job
+        self._enqueue(job)
+        self._metrics.submitted += 1
+        self._detached(job)
+        return job
+
+    async def cancel(self, job_id: str, reason: str = "cancelled by client") -> bool:
+        """Cancel a queued or running job, False if it is unknown or finished."""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished or job.cancel_reason:
+            return False
+        job.cancel_reason = reason
+        logger.info("Cancelling job", extra={"job_id": job_id, "reason": reason})
+        if job.status == JobStatus.QUEUED:
+            # worker取出时跳过
+            self._metrics.cancelled += 1
+            await job.finish(JobStatus.CANCELLED, reason)
+            self._forget_later(job)
+        elif job.task is not None:
+            job.task.cancel()
+        return True
+
+    def _detached(self, job: Job) -> None:
+        """No subscriber left: cancel the job unless one attaches within the grace time."""
+        if self._detach_grace is None or job.finished or job.abandon_timer:
+            return
+        job.abandon_timer = asyncio.get_running_loop().call_later(
+            self._detach_grace, self._abandon, job
+        )
+
+    def _attached(self, job: Job) -> None:
+        if job.abandon_timer is not None:
+            job.abandon_timer.cancel()
+            job.abandon_timer = None
+
+    def _abandon(self, job: Job) -> None:
+        job.abandon_timer = None
+        if job.subscribers or job.finished:
+            return
+        self._metrics.abandoned += 1
+        task = asyncio.create_task(self.cancel(job.id, "client disconnected"))
+        self._cancelling.add(task)
+        task.add_done_callback(self._cancelling.discard)
+
+    def _forget_later(self, job: Job) -> None:
+        if job.key and self._flights.get(job.key) is job:
+            # 之后相同的请求重新执行
+            del self._flights[job.key]
+        # 之后的订阅从SQLite回放
+        asyncio.get_running_loop().call_later(
+            self._retention, self._jobs.pop, job.id, None
+        )
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        if job.cancel_reason:
+            # 排队时已取消
+            return
+        job.status = JobStatus.RUNNING
+        self._metrics.running += 1
+        status, error = JobStatus.DONE, ""
+        try:
+            await self._store.update_job(job.id, job.status.value)
+            job.task = asyncio.create_task(
+                self._runners[job.kind](job.request, job.publish), context=job.context
+            )
+            if job.cancel_reason:
+                job.task.cancel()
+            await job.task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                status, error = JobStatus.INTERRUPTED, "server shutting down"
+                raise
+            status, error = JobStatus.CANCELLED, job.cancel_reason
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", extra={"kind": job.kind})
+            status, error = JobStatus.FAILED, str(e)
+        finally:
+            self._metrics.running -= 1
+            counter = {
+                JobStatus.DONE: "completed",
+                JobStatus.FAILED: "failed",
+                JobStatus.INTERRUPTED: "interrupted",
+                JobStatus.CANCELLED: "cancelled",
+            }[status]
+            setattr(self._metrics, counter, getattr(self._metrics, counter) + 1)
+            try:
+                await job.finish(status, error)
+            except Exception as e:
+                logger.error(f"Failed to finish job {job.id}: {e}")
+            job.task = None
+            self._attached(job)
+            self._forget_later(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job, from memory or SQLite."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return {
+                "id": job.id,
+                "kind": job.kind,
+                "status": job.status.value,
+                "error": job.error,
+                "events": job.events_count,
+            }
+        row = await self._store.get_job(job_id)
+        if row is None:
+            return None
+        return {k: row[k] for k in ("id", "kind", "status", "error", "events")}
+
+    async def subscribe(
+        self, job_id: str, after: int = -1, keepalive: float = 15
+    ) -> AsyncIterator[JobEvent]:
+        """Events of a job with ``seq > after``, live until the job finishes."""
+        job = self._jobs.get(job_id)
+        self._metrics.subscribers += 1
+        if after >= 0:
+            self._metrics.resumed += 1
+        if job is not None:
+            job.subscribers += 1
+            self._attached(job)
+        try:
+            if job is not None:
+                async for event in job.events(after, keepalive):
+                    yield event
+                return
+            # 已移出内存的任务整体从SQLite回放
+            for event in await self._store.list_job_events(job_id, after):
+                self._metrics.replayed += 1
+                self._metrics.replayed_from_db += 1
+                yield event
+        finally:
+            self._metrics.subscribers -= 1
+            if job is not None:
+                job.subscribers -= 1
+                if not job.subscribers:
+                    self._detached(job)
+
+    def metrics(self) -> JobQueueMetrics:
+        metrics = self._metrics.model_copy()
+        metrics.queued = self._queue.qsize()
+        return metrics
+
+
+job_queue = JobQueue(
+    store_service,
+    workers=settings.job_workers,
+    max_queued=settings.job_queue_size,
+    buffer_size=settings.job_event_buffer,
+    retention_seconds=settings.job_retention_seconds,
+    flush_events=settings.stream_chunk_flush_events,
+    flush_ms=settings.stream_chunk_flush_ms,
+    detach_grace_seconds=(
+        settings.job_detach_grace_seconds if settings.job_cancel_on_disconnect else None
+    ),
+)
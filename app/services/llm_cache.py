@@ -0,0 +1,288 @@
+"""
+On-disk cache of LLM responses.
+
+按 (模型与生成参数, 结构化输出schema, 归一化后的消息) 缓存模型返回结果,
+存放在独立的SQLite文件中, 支持TTL过期与按总大小的LRU淘汰。
+只对开启了缓存的节点生效 (见 ``Configuration.llm_cache_nodes``)。
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import ChatGeneration
+from pydantic import BaseModel, Field
+
+from app.services.sqlite_pool import SQLitePool
+from app.utils.logger import logger
+from config.settings import settings
+
+
+class LLMCacheMetrics(BaseModel):
+    """LLM response cache counters."""
+
+    hits: int = Field(0, description="Lookups served from the cache")
+    misses: int = Field(0, description="Lookups that went to the provider")
+    expired: int = Field(0, description="Entries dropped because of the TTL")
+    writes: int = Field(0, description="Responses written to the cache")
+    evictions: int = Field(0, description="Entries evicted by the size limit")
+    entries: int = Field(0, description="Entries currently stored")
+    bytes: int = Field(0, description="Total size of stored responses")
+    hit_rate: Optional[float] = Field(None, description="hits / (hits + misses)")
+
+
+def _normalize(prompt: str) -> str:
+    """只保留消息类型与内容, 去掉每次运行都会变化的id等字段。"""
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    if not isinstance(messages, list):
+        return prompt
+    normalized = []
+    for message in messages:
+        if isinstance(message, dict) and "kwargs" in message:
+            kwargs = message["kwargs"]
+            normalized.append(
+                [
+                    message.get("id", [""])[-1],
+                    kwargs.get("content"),
+                    kwargs.get("tool_calls"),
+                ]
+            )
+        else:
+            normalized.append(message)
+    return json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed_at ON llm_cache (accessed_at);
+"""
+
+_EVICT_SQL = """
+DELETE FROM llm_cache WHERE key IN (
+    SELECT key FROM llm_cache ORDER BY accessed_at LIMIT 16
+) RETURNING size
+"""
+
+
+def _key(prompt: str, llm_string: str) -> str:
+    raw = f"{llm_string}\x00{_normalize(prompt)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _storable(generation: Any) -> Any:
+    """结构化输出的解析结果以dict形式保存, 读取时由解析器重新构造。"""
+    if not isinstance(generation, ChatGeneration):
+        return generation
+    parsed = generation.message.additional_kwargs.get("parsed")
+    if not isinstance(parsed, BaseModel):
+        return generation
+    message = generation.message.model_copy(deep=True)
+    message.additional_kwargs["parsed"] = parsed.model_dump()
+    return ChatGeneration(message=message, generation_info=generation.generation_info)
+
+
+class SQLiteLLMCache(BaseCache):
+    """LangChain ``BaseCache`` backed by a SQLite file."""
+
+    def __init__(self, db_path: str, ttl_seconds: float, max_bytes: int):
+        self._db_path = db_path
+        self._ttl = ttl_seconds
+        self._max_bytes = max_bytes
+        self._pool: Optional[SQLitePool] = None
+        self._open_lock = asyncio.Lock()
+        self._metrics = LLMCacheMetrics()
+
+    async def _open(self) -> SQLitePool:
+        async with self._open_lock:
+            if self._pool is not None:
+                return self._pool
+            pool = SQLitePool(self._db_path, readers=2)
+            await pool.open()
+            async with pool.writer() as db:
+                await db.executescript(_SCHEMA)
+                cursor = await db.execute(
+                    "SELECT count(*), coalesce(sum(size), 0) FROM llm_cache"
+                )
+                self._metrics.entries, self._metrics.bytes = await cursor.fetchone()
+            self._pool = pool
+            return pool
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        pool = await self._open()
+        key = _key(prompt, llm_string)
+        async with pool.reader() as db:
+            cursor = await db.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            )
+            row = await cursor.fetchone()
+        now = time.time()
+        if row is not None and now - row["created_at"] > self._ttl:
+            async with pool.writer() as db:
+                cursor = await db.execute(
+                    "DELETE FROM llm_cache WHERE key = ? RETURNING size", (key,)
+                )
+                self._evict(await cursor.fetchall(), "expired")
+            row = None
+        if row is None:
+            self._metrics.misses += 1
+            return None
+        value = self._decode(row["value"])
+        if value is None:
+            return None
+        async with pool.writer() as db:
+            await db.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        self._metrics.hits += 1
+        return value
+
+    async def aupdate(
+        self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE
+    ) -> None:
+        pool = await self._open()
+        value = json.dumps([dumps(_storable(g)) for g in return_val])
+        size = len(value.encode("utf-8"))
+        if size > self._max_bytes:
+            return
+        now = time.time()
+        async with pool.writer() as db:
+            cursor = await db.execute(
+                "DELETE FROM llm_cache WHERE key = ? RETURNING size",
+                (_key(prompt, llm_string),),
+            )
+            for r in await cursor.fetchall():
+                self._metrics.entries -= 1
+                self._metrics.bytes -= r["size"]
+            await db.execute(
+                "INSERT INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (_key(prompt, llm_string), value, size, now, now),
+            )
+            self._metrics.writes += 1
+            self._metrics.entries += 1
+            self._metrics.bytes += size
+            # 超过大小上限时按最近访问时间淘汰
+            while self._metrics.bytes > self._max_bytes:
+                cursor = await db.execute(_EVICT_SQL)
+                evicted = await cursor.fetchall()
+                if not evicted:
+                    break
+                self._evict(evicted, "evictions")
+
+    async def aclear(self, **kwargs: Any) -> None:
+        pool = await self._open()
+        async with pool.writer() as db:
+            await db.execute("DELETE FROM llm_cache")
+        self._metrics.entries = 0
+        self._metrics.bytes = 0
+
+    def metrics(self) -> LLMCacheMetrics:
+        metrics = self._metrics.model_copy()
+        total = metrics.hits + metrics.misses
+        metrics.hit_rate = metrics.hits / total if total else None
+        return metrics
+
+    def _decode(self, value: str) -> Optional[RETURN_VAL_TYPE]:
+        try:
+            return [loads(v, allowed_objects="core") for v in json.loads(value)]
+        except Exception as e:
+            logger.warning(f"Failed to decode cached LLM response: {e}")
+            self._metrics.misses += 1
+            return None
+
+    def _evict(self, deleted: list[Any], counter: str) -> None:
+        setattr(self._metrics, counter, getattr(self._metrics, counter) + len(deleted))
+        self._metrics.entries -= len(deleted)
+        self._metrics.bytes -= sum(r["size"] for r in deleted)
+
+    # 同步接口 (invoke/stream) 使用独立的短连接, 不经过异步连接池
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self._db_path, timeout=5)
+        db.row_factory = sqlite3.Row
+        db.executescript(_SCHEMA)
+        if self._pool is None:
+            self._metrics.entries, self._metrics.bytes = db.execute(
+                "SELECT count(*), coalesce(sum(size), 0) FROM llm_cache"
+            ).fetchone()
+        return db
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = _key(prompt, llm_string)
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            row = db.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row["created_at"] > self._ttl:
+                deleted = db.execute(
+                    "DELETE FROM llm_cache WHERE key = ? RETURNING size", (key,)
+                ).fetchall()
+                self._evict(deleted, "expired")
+                row = None
+            if row is None:
+                self._metrics.misses += 1
+                return None
+            value = self._decode(row["value"])
+            if value is None:
+                return None
+            db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self._metrics.hits += 1
+        return value
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        value = json.dumps([dumps(_storable(g)) for g in return_val])
+        size = len(value.encode("utf-8"))
+        if size > self._max_bytes:
+            return
+        key = _key(prompt, llm_string)
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            deleted = db.execute(
+                "DELETE FROM llm_cache WHERE key = ? RETURNING size", (key,)
+            ).fetchall()
+            self._metrics.entries -= len(deleted)
+            self._metrics.bytes -= sum(r["size"] for r in deleted)
+            db.execute(
+                "INSERT INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._metrics.writes += 1
+            self._metrics.entries += 1
+            self._metrics.bytes += size
+            while self._metrics.bytes > self._max_bytes:
+                evicted = db.execute(_EVICT_SQL).fetchall()
+                if not evicted:
+                    break
+                self._evict(evicted, "evictions")
+
+    def clear(self, **kwargs: Any) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM llm_cache")
+        self._metrics.entries = 0
+        self._metrics.bytes = 0
+
+
+llm_cache = SQLiteLLMCache(
+    settings.llm_cache_path,
+    ttl_seconds=settings.llm_cache_ttl_seconds,
+    max_bytes=settings.llm_cache_max_mb * 1024 * 1024,
+)
@@ -0,0 +1,169 @@
+"""
+Background maintenance tasks: card file reaper, incremental vacuum and pruning.
+
+删除数据后的文件清理与空间回收放到后台执行, 避免夜间批量清理阻塞在线请求。
+
+离线切换到增量VACUUM (需完整VACUUM一次, 请先停止服务):
+python -m app.services.maintenance --enable-incremental-vacuum [--source ./app.db]
+"""
+
+import argparse
+import asyncio
+import os
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from pydantic import BaseModel, Field
+
+from app.services.job_queue import FINISHED
+from app.services.store_service import StoreService
+from app.utils.logger import logger
+from config.settings import settings
+
+
+class CardReaperMetrics(BaseModel):
+    """Card reaper counters."""
+
+    pending: int = Field(0, description="Card files waiting to be removed")
+    removed: int = Field(0, description="Card files removed")
+    missing: int = Field(0, description="Card files that were already gone")
+    failed: int = Field(0, description="Card files that could not be removed")
+
+
+class CardReaper:
+    """Remove card files of deleted sessions in a background task."""
+
+    def __init__(self, card_folder: str):
+        self._card_folder = card_folder
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._metrics = CardReaperMetrics()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def enqueue(self, hashes: Iterable[str]) -> None:
+        for hash in hashes:
+            if hash:
+                self._queue.put_nowait(hash)
+
+    def _remove(self, hash: str) -> None:
+        try:
+            os.remove(os.path.join(self._card_folder, f"{hash}.json"))
+            self._metrics.removed += 1
+        except FileNotFoundError:
+            self._metrics.missing += 1
+        except OSError as e:
+            self._metrics.failed += 1
+            logger.warning(f"Failed to remove card file {hash}: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            hash = await self._queue.get()
+            await asyncio.to_thread(self._remove, hash)
+
+    def metrics(self) -> CardReaperMetrics:
+        metrics = self._metrics.model_copy()
+        metrics.pending = self._queue.qsize()
+        return metrics
+
+
+card_reaper = CardReaper(settings.card_folder)
+
+
+async def vacuum_scheduler(
+    store: StoreService,
+    interval: float,
+    pages_per_step: int,
+    step_pause: float = 0.05,
+) -> None:
+    """
+    周期性执行 ``PRAGMA incremental_vacuum``。
+    每一步只回收少量页并立即释放写锁, 直到空闲页清空。
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            freed = 0
+            while True:
+                step = await store.incremental_vacuum(pages_per_step)
+                if step == 0:
+                    break
+                freed += step
+                await asyncio.sleep(step_pause)
+            if freed:
+                logger.info("Incremental vacuum finished", extra={"pages": freed})
+        except Exception as e:
+            logger.error(f"Incremental vacuum failed: {e}")
+
+
+async def checkpoint_pruner(
+    store: StoreService, interval: float, ttl_days: int
+) -> None:
+    """
+    周期性清理LangGraph checkpoint:
+    每个会话只保留最新一份, 超过 ``ttl_days`` 未更新的会话整体删除。
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=ttl_days)
+            deleted = await store.prune_checkpoints(
+                older_than=cutoff.strftime("%Y-%m-%d %H:%M:%S")
+            )
+            if deleted:
+                logger.info("Checkpoints pruned", extra={"checkpoints": deleted})
+        except Exception as e:
+            logger.error(f"Checkpoint pruning failed: {e}")
+
+
+async def job_pruner(store: StoreService, interval: float, ttl_days: float) -> None:
+    """周期性删除结束超过 ``ttl_days`` 的后台任务及其事件日志。"""
+    finished = [status.value for status in FINISHED]
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=ttl_days)
+            deleted = await store.prune_jobs(
+                finished, older_than=cutoff.strftime("%Y-%m-%d %H:%M:%S")
+            )
+            if deleted:
+                logger.info("Jobs pruned", extra={"jobs": deleted})
+        except Exception as e:
+            logger.error(f"Job pruning failed: {e}")
+
+
+async def enable_incremental_vacuum(source: str, shards: int) -> None:
+    store = StoreService(database_path=source, shards=shards)
+    try:
+        await store.enable_incremental_vacuum()
+    finally:
+        await store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="Switch the database to incremental auto_vacuum with a full VACUUM",
+    )
+    parser.add_argument("--source", default=settings.database_path)
+    parser.add_argument("--shards", type=int, default=settings.db_shards)
+    args = parser.parse_args()
+    if not args.enable_incremental_vacuum:
+        parser.error("nothing to do")
+    asyncio.run(enable_incremental_vacuum(args.source, args.shards))
+
+
+if __name__ == "__main__":
+    main()
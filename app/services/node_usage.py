@@ -0,0 +1,139 @@
+"""
+Per-node LLM latency and token usage.
+
+作为LangChain回调挂在图的运行配置上, 按 ``langgraph_node`` 汇总每个节点的
+调用次数、耗时与token用量, 每次调用结束时记录一条日志。
+"""
+
+import asyncio
+import time
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+from pydantic import BaseModel, Field
+
+from app.utils.logger import logger
+
+
+class NodeUsageMetrics(BaseModel):
+    """LLM usage counters of one graph node."""
+
+    calls: int = Field(0, description="Finished LLM calls")
+    errors: int = Field(0, description="LLM calls that raised")
+    cancelled: int = Field(0, description="LLM calls cancelled before finishing")
+    latency_ms: float = Field(0.0, description="Total LLM latency")
+    max_latency_ms: float = Field(0.0, description="Slowest LLM call")
+    avg_latency_ms: Optional[float] = Field(None, description="latency_ms / calls")
+    input_tokens: int = Field(0, description="Prompt tokens reported by the provider")
+    output_tokens: int = Field(
+        0, description="Completion tokens reported by the provider"
+    )
+
+
+def _usage(response: LLMResult) -> tuple[int, int]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(
+                getattr(generation, "message", None), "usage_metadata", None
+            )
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class NodeUsageTracker(AsyncCallbackHandler):
+    """Callback handler aggregating LLM calls by graph node."""
+
+    def __init__(self):
+        # run_id -> (节点, 模型, 开始时间, conversation_id)
+        self._runs: dict[UUID, tuple[str, str, float, str]] = {}
+        self._metrics: dict[str, NodeUsageMetrics] = {}
+
+    async def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        metadata: Optional[dict[str, Any]] = None,
+        invocation_params: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node")
+        if not node:
+            return
+        model = str(
+            (invocation_params or {}).get("model")
+            or metadata.get("ls_model_name")
+            or ""
+        )
+        self._runs[run_id] = (
+            node,
+            model,
+            time.monotonic(),
+            metadata.get("conversation_id", ""),
+        )
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        node, model, started, _ = run
+        latency = (time.monotonic() - started) * 1000
+        input_tokens, output_tokens = _usage(response)
+        metrics = self._metrics.setdefault(node, NodeUsageMetrics())
+        metrics.calls += 1
+        metrics.latency_ms += latency
+        metrics.max_latency_ms = max(metrics.max_latency_ms, latency)
+        metrics.input_tokens += input_tokens
+        metrics.output_tokens += output_tokens
+        logger.info(
+            "llm usage",
+            extra={
+                "stage": node,
+                "model": model,
+                "latency_ms": round(latency, 1),
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+            },
+        )
+
+    async def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs
+    ) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        metrics = self._metrics.setdefault(run[0], NodeUsageMetrics())
+        if isinstance(error, asyncio.CancelledError):
+            metrics.cancelled += 1
+        else:
+            metrics.errors += 1
+
+    def cancel_runs(self, conversation_id: str) -> None:
+        """
+        Settle the unfinished calls of a cancelled graph run.
+
+        非流式调用被取消时LangChain不会触发on_llm_error, 由调用方在取消时结算。
+        """
+        for run_id, run in list(self._runs.items()):
+            if run[3] == conversation_id:
+                del self._runs[run_id]
+                self._metrics.setdefault(run[0], NodeUsageMetrics()).cancelled += 1
+
+    def metrics(self) -> dict[str, NodeUsageMetrics]:
+        result = {}
+        for node, metrics in self._metrics.items():
+            metrics = metrics.model_copy()
+            if metrics.calls:
+                metrics.avg_latency_ms = metrics.latency_ms / metrics.calls
+            result[node] = metrics
+        return result
+
+
+node_usage = NodeUsageTracker()
@@ -0,0 +1,132 @@
+"""
+Copy a single-file database into session shards.
+
+用法: python -m app.services.shard_migrate --shards 4 [--source ./app.db]
+
+按session分批读取源库, 连同其消息分片与checkpoint写入对应分片, 后台任务及事件日志
+按job id分片 (INSERT OR IGNORE, 可重复执行);
+源文件保持不变, 迁移完成后将 DB_SHARDS 设置为相同的分片数即可。
+"""
+
+import argparse
+import asyncio
+from typing import Any, Dict, List
+
+import aiosqlite
+
+from app.services.store_service import StoreService
+from app.utils.logger import logger
+from config.settings import settings
+
+# 原样复制存储值 (压缩BLOB不解码)
+_COPY_SQL = {
+    "conversation": (
+        "SELECT id, parent_cid, session_id, content, type, status, created_at "
+        "FROM conversation WHERE session_id IN ({marks}) ORDER BY rowid"
+    ),
+    "card": (
+        "SELECT id, session_id, name, hash, background "
+        "FROM card WHERE session_id IN ({marks}) ORDER BY rowid"
+    ),
+    # 进行中 (或中断未合并) 的AI消息分片
+    "conversation_chunk": (
+        "SELECT ch.conversation_id, ch.seq, ch.content, ch.created_at, c.session_id "
+        "FROM conversation_chunk ch JOIN conversation c ON c.id = ch.conversation_id "
+        "WHERE c.session_id IN ({marks})"
+    ),
+    # LangGraph checkpoint 的 thread_id 即 session_id
+    "checkpoint": (
+        "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, "
+        "checkpoint, metadata_type, metadata, created_at "
+        "FROM checkpoint WHERE thread_id IN ({marks})"
+    ),
+    "checkpoint_write": (
+        "SELECT thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, "
+        "value, task_path FROM checkpoint_write WHERE thread_id IN ({marks})"
+    ),
+}
+# 后台任务按job id分片, 单独分批复制
+_JOB_EVENT_SQL = "SELECT job_id, seq, data FROM job_event WHERE job_id IN ({marks})"
+
+
+async def _copy_jobs(
+    src: aiosqlite.Connection,
+    target: StoreService,
+    totals: Dict[str, int],
+    batch_size: int,
+) -> None:
+    last_rowid = 0
+    while True:
+        cursor = await src.execute(
+            "SELECT rowid, id, kind, request, status, error, created_at, updated_at "
+            "FROM job WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, batch_size),
+        )
+        jobs = await cursor.fetchall()
+        if not jobs:
+            break
+        last_rowid = jobs[-1]["rowid"]
+        ids = [r["id"] for r in jobs]
+        marks = ", ".join("?" for _ in ids)
+        cursor = await src.execute(_JOB_EVENT_SQL.format(marks=marks), ids)
+        rows = {"job": list(jobs), "job_event": list(await cursor.fetchall())}
+        for table, count in (await target.import_rows(rows)).items():
+            totals[table] += count
+        logger.info("Shard migration progress", extra=dict(totals))
+
+
+async def migrate(source: str, shards: int, batch_size: int = 200) -> Dict[str, int]:
+    """
+    Copy every session with its conversations, cards, unfinished message chunks
+    and graph checkpoints, then every job with its events, into ``shards`` files.
+    """
+    totals = dict.fromkeys(["session", *_COPY_SQL, "job", "job_event"], 0)
+    # 源库先按当前版本补齐表结构 (如conversation.status列, 后加入的表)
+    upgraded = StoreService(database_path=source, shards=1)
+    await upgraded.init()
+    await upgraded.close()
+    target = StoreService(database_path=source, shards=shards)
+    await target.init()
+    try:
+        async with aiosqlite.connect(source) as src:
+            src.row_factory = aiosqlite.Row
+            last_rowid = 0
+            while True:
+                cursor = await src.execute(
+                    "SELECT rowid, id, title, type, created_at FROM session "
+                    "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size),
+                )
+                sessions = await cursor.fetchall()
+                if not sessions:
+                    break
+                last_rowid = sessions[-1]["rowid"]
+                ids = [r["id"] for r in sessions]
+                marks = ", ".join("?" for _ in ids)
+                rows: Dict[str, List[Any]] = {"session": list(sessions)}
+                for table, sql in _COPY_SQL.items():
+                    cursor = await src.execute(sql.format(marks=marks), ids)
+                    rows[table] = list(await cursor.fetchall())
+                for table, count in (await target.import_rows(rows)).items():
+                    totals[table] += count
+                logger.info("Shard migration progress", extra=dict(totals))
+            await _copy_jobs(src, target, totals, batch_size)
+    finally:
+        await target.close()
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--source", default=settings.database_path)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    if args.shards < 2:
+        parser.error("--shards must be at least 2")
+    totals = asyncio.run(migrate(args.source, args.shards, args.batch_size))
+    print(totals)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Long-lived aiosqlite connection pool.
+
+一个写连接 + N 个读连接，全部运行在 WAL 模式下：
+读连接之间以及读写之间互不阻塞，写操作在唯一的写连接上串行执行。
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import aiosqlite
+from pydantic import BaseModel, Field
+
+
+class PoolMetrics(BaseModel):
+    """Connection pool counters."""
+
+    readers: int = Field(0, description="Number of reader connections")
+    readers_idle: int = Field(0, description="Reader connections currently idle")
+    reader_acquisitions: int = Field(0, description="Total reader checkouts")
+    reader_wait_ms: float = Field(
+        0.0, description="Total time spent waiting for a reader"
+    )
+    writer_busy: bool = Field(False, description="Whether the writer is checked out")
+    writer_acquisitions: int = Field(0, description="Total writer checkouts")
+    writer_wait_ms: float = Field(
+        0.0, description="Total time spent waiting for the writer"
+    )
+    commits: int = Field(0, description="Committed write transactions")
+    rollbacks: int = Field(0, description="Rolled back write transactions")
+
+
+class SQLitePool:
+    """One writer and N readers over a single SQLite file."""
+
+    def __init__(
+        self,
+        db_path: str,
+        readers: int = 4,
+        synchronous: str = "NORMAL",
+        cache_size_kb: int = 16384,
+        mmap_size: int = 268435456,
+        busy_timeout_ms: int = 5000,
+        functions: Optional[Dict[str, Callable[..., Any]]] = None,
+    ):
+        self._db_path = db_path
+        self._reader_count = max(1, readers)
+        self._pragmas = [
+            "PRAGMA journal_mode = WAL;",
+            f"PRAGMA synchronous = {synchronous};",
+            # 负数表示以KiB为单位
+            f"PRAGMA cache_size = -{cache_size_kb};",
+            f"PRAGMA mmap_size = {mmap_size};",
+            f"PRAGMA busy_timeout = {busy_timeout_ms};",
+            "PRAGMA temp_store = MEMORY;",
+            "PRAGMA foreign_keys = ON;",
+        ]
+        # 注册到每个连接上的单参数SQL函数 (触发器/视图中使用)
+        self._functions = functions or {}
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: list[aiosqlite.Connection] = []
+        self._idle: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+        self._metrics = PoolMetrics()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # isolation_level=None: 由连接池显式控制事务边界
+        db = await aiosqlite.connect(self._db_path, isolation_level=None)
+        db.row_factory = aiosqlite.Row
+        for name, func in self._functions.items():
+            await db.create_function(name, 1, func, deterministic=True)
+        for pragma in self._pragmas:
+            await db.execute(pragma)
+        return db
+
+    async def open(self) -> None:
+        """Open the writer and all reader connections. Idempotent."""
+        if self.is_open:
+            return
+        # 先打开写连接，确保WAL模式在读连接打开前已生效
+        self._writer = await self._connect()
+        self._idle = asyncio.Queue()
+        for _ in range(self._reader_count):
+            db = await self._connect()
+            await db.execute("PRAGMA query_only = ON;")
+            self._readers.append(db)
+            self._idle.put_nowait(db)
+        self._metrics.readers = self._reader_count
+
+    async def close(self) -> None:
+        """Close every connection. Waits for the in-flight write to finish."""
+        if not self.is_open:
+            return
+        async with self._writer_lock:
+            for db in self._readers:
+                await db.close()
+            self._readers = []
+            self._idle = None
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                # 关闭前合并WAL，避免遗留大的-wal文件
+                await writer.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+                await writer.close()
+
+    def _ensure_open(self) -> None:
+        if not self.is_open:
+            raise RuntimeError("SQLite pool not initialized. Call open() first.")
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Check out a read-only connection."""
+        self._ensure_open()
+        assert self._idle is not None
+        start = time.perf_counter()
+        db = await self._idle.get()
+        self._metrics.reader_acquisitions += 1
+        self._metrics.reader_wait_ms += (time.perf_counter() - start) * 1000
+        try:
+            yield db
+        finally:
+            if self._idle is not None:
+                self._idle.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Check out the writer inside a single ``BEGIN IMMEDIATE`` transaction.
+
+        Commits on normal exit and rolls back if the block raises.
+        """
+        self._ensure_open()
+        start = time.perf_counter()
+        async with self._writer_lock:
+            self._ensure_open()
+            assert self._writer is not None
+            db = self._writer
+            self._metrics.writer_acquisitions += 1
+            self._metrics.writer_wait_ms += (time.perf_counter() - start) * 1000
+            self._metrics.writer_busy = True
+            try:
+                await db.execute("BEGIN IMMEDIATE;")
+                try:
+                    yield db
+                except BaseException:
+                    await db.execute("ROLLBACK;")
+                    self._metrics.rollbacks += 1
+                    raise
+                await db.execute("COMMIT;")
+                self._metrics.commits += 1
+            finally:
+                self._metrics.writer_busy = False
+
+    @asynccontextmanager
+    async def raw_writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Check out the writer without opening a transaction (DDL, VACUUM, pragmas)."""
+        self._ensure_open()
+        async with self._writer_lock:
+            self._ensure_open()
+            assert self._writer is not None
+            self._metrics.writer_busy = True
+            try:
+                yield self._writer
+            finally:
+                self._metrics.writer_busy = False
+
+    def metrics(self) -> PoolMetrics:
+        metrics = self._metrics.model_copy()
+        metrics.readers_idle = self._idle.qsize() if self._idle is not None else 0
+        return metrics
@@ -1,25 +1,307 @@
+# 可能会放一些第三方服务
+import asyncio
+import base64
+import json
+import re
 import uuid
+import zlib
 from contextlib import suppress
+from datetime import datetime, timezone
+from itertools import product
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiosqlite
 
+from app.models.store import ConversationStatus, ConversationType
+from app.services.content_codec import CompressionMetrics, ContentCodec
+from app.services.history_cache import (
+    HistoryCache,
+    HistoryCacheMetrics,
+    latest_cid,
+    walk_branch,
+)
+from app.services.sqlite_pool import PoolMetrics, SQLitePool
+from app.utils.logger import logger
 from config.settings import settings
 
+# 从叶子节点沿parent_cid回溯到根, 每一步都是主键查找, 代价只与分支深度相关
+_BRANCH_SQL = """
+WITH RECURSIVE branch(id, parent_cid, session_id, content, type, status, created_at, depth) AS (
+    SELECT id, parent_cid, session_id, content, type, status, created_at, 0
+    FROM conversation
+    WHERE id = :leaf_cid AND (:session_id = '' OR session_id = :session_id)
+    UNION ALL
+    SELECT c.id, c.parent_cid, c.session_id, c.content, c.type, c.status, c.created_at, b.depth + 1
+    FROM conversation c
+    JOIN branch b ON c.id = b.parent_cid
+    WHERE b.parent_cid != '' AND b.depth + 1 < :max_depth
+)
+SELECT id, parent_cid, session_id, content, type, status, created_at
+FROM branch
+ORDER BY depth DESC
+"""
+
+# 需要全文检索的表及列
+_FTS_TABLES: Dict[str, List[str]] = {
+    "session": ["title"],
+    "conversation": ["content"],
+    "card": ["name", "background"],
+}
+
+# 可能以压缩形式存储的大文本列
+_PACKED_COLUMNS: List[Tuple[str, str]] = [
+    ("conversation", "content"),
+    ("card", "background"),
+]
+
+_SEARCH_SQL: Dict[str, str] = {
+    "session": """
+        SELECT 'session' AS kind, t.id AS id, t.id AS session_id,
+               highlight(session_fts, 0, '<mark>', '</mark>') AS snippet,
+               bm25(session_fts) AS score
+        FROM session_fts JOIN session t ON t.rowid = session_fts.rowid
+        WHERE session_fts MATCH :match{filter}
+        ORDER BY score LIMIT :n
+    """,
+    "conversation": """
+        SELECT 'conversation' AS kind, t.id AS id, t.session_id AS session_id,
+               snippet(conversation_fts, 0, '<mark>', '</mark>', '...', 32) AS snippet,
+               bm25(conversation_fts) AS score
+        FROM conversation_fts JOIN conversation t ON t.rowid = conversation_fts.rowid
+        WHERE conversation_fts MATCH :match{filter}
+        ORDER BY score LIMIT :n
+    """,
+    "card": """
+        SELECT 'card' AS kind, t.id AS id, t.session_id AS session_id,
+               snippet(card_fts, -1, '<mark>', '</mark>', '...', 32) AS snippet,
+               bm25(card_fts) AS score
+        FROM card_fts JOIN card t ON t.rowid = card_fts.rowid
+        WHERE card_fts MATCH :match{filter}
+        ORDER BY score LIMIT :n
+    """,
+}
+
+
+# 少于3个字符的词 (如两字中文词) 无法使用trigram索引, 在解压视图上用LIKE检索,
+# 只扫描每张表最新的 :window 行
+_LIKE_SEARCH_SQL: Dict[str, str] = {
+    table: f"""
+        SELECT '{table}' AS kind, t.id AS id,
+               {"t.id" if table == "session" else "t.session_id"} AS session_id,
+               {" || char(10) || ".join(f"s.{c}" for c in columns)} AS text,
+               0.0 AS score
+        FROM {table}_fts_src s JOIN {table} t ON t.rowid = s.rid
+        WHERE s.rid > (SELECT coalesce(max(rowid), 0) FROM {table}) - :window
+              {{filter}}
+        ORDER BY s.rid DESC LIMIT :n
+    """
+    for table, columns in _FTS_TABLES.items()
+}
+
+
+def _like_filter(alias: str, columns: List[str], count: int) -> str:
+    """``AND`` 连接的LIKE条件, 每个词匹配任一列即可。"""
+    return "".join(
+        " AND ("
+        + " OR ".join(f"{alias}.{c} LIKE :like{i} ESCAPE '\\'" for c in columns)
+        + ")"
+        for i in range(count)
+    )
+
+
+def _like_snippet(text: str, terms: List[str], width: int = 32) -> str:
+    """LIKE命中的片段, 与FTS的snippet()格式一致。"""
+    pattern = re.compile(
+        "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)),
+        re.IGNORECASE,
+    )
+    found = pattern.search(text)
+    pos = found.start() if found else 0
+    start, end = max(0, pos - width), min(len(text), pos + width)
+    snippet = pattern.sub(lambda m: f"<mark>{m.group(0)}</mark>", text[start:end])
+    return ("..." if start else "") + snippet + ("..." if end < len(text) else "")
+
+
+def _new_row(
+    conv_id: str, parent_cid: str, session_id: str, content: str, type: str
+) -> Dict[str, Any]:
+    """Row dict of a freshly inserted conversation, for the history cache."""
+    return {
+        "id": conv_id,
+        "parent_cid": parent_cid,
+        "session_id": session_id,
+        "content": content,
+        "type": type,
+        "status": ConversationStatus.NORMAL.value,
+        # 与SQLite的CURRENT_TIMESTAMP格式一致 (UTC)
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def shard_paths(database_path: str, shards: int) -> List[str]:
+    """SQLite files used for ``shards`` shards (the file itself when not sharded)."""
+    if shards <= 1:
+        return [database_path]
+    path = Path(database_path)
+    return [
+        str(path.with_name(f"{path.stem}.shard{i}{path.suffix}")) for i in range(shards)
+    ]
+
+
+def shard_index(session_id: str, shards: int) -> int:
+    """Stable shard number of a session."""
+    return zlib.crc32(session_id.encode("utf-8")) % shards if shards > 1 else 0
+
+
+def _session_key(row: Dict[str, Any]) -> Tuple[str, str]:
+    return (row["created_at"], row["id"])
+
+
+def _encode_cursor(created_at: str, session_id: str) -> str:
+    raw = json.dumps([created_at, session_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+    return str(created_at), str(session_id)
+
+
+class SessionNotFoundError(LookupError):
+    """The session a turn continues does not exist (deleted or never created)."""
+
+
+# 分片迁移时逐表复制的列, 以及决定所属分片的列 (session id / job id)
+_IMPORT_COLUMNS: Dict[str, Tuple[List[str], str]] = {
+    "session": (["id", "title", "type", "created_at"], "id"),
+    "conversation": (
+        ["id", "parent_cid", "session_id", "content", "type", "status", "created_at"],
+        "session_id",
+    ),
+    "card": (["id", "session_id", "name", "hash", "background"], "session_id"),
+    "conversation_chunk": (
+        ["conversation_id", "seq", "content", "created_at"],
+        "session_id",
+    ),
+    "checkpoint": (
+        [
+            "thread_id",
+            "checkpoint_ns",
+            "checkpoint_id",
+            "parent_checkpoint_id",
+            "type",
+            "checkpoint",
+            "metadata_type",
+            "metadata",
+            "created_at",
+        ],
+        "thread_id",
+    ),
+    "checkpoint_write": (
+        [
+            "thread_id",
+            "checkpoint_ns",
+            "checkpoint_id",
+            "task_id",
+            "idx",
+            "channel",
+            "type",
+            "value",
+            "task_path",
+        ],
+        "thread_id",
+    ),
+    "job": (
+        ["id", "kind", "request", "status", "error", "created_at", "updated_at"],
+        "id",
+    ),
+    "job_event": (["job_id", "seq", "data"], "job_id"),
+}
+
 
 class StoreService:
 
-    def __init__(self):
-        """Initialize the store service."""
-        file_path = Path(settings.database_path)
-        file_path.touch(exist_ok=True)
-        self._db_path = settings.database_path
+    def __init__(
+        self, database_path: Optional[str] = None, shards: Optional[int] = None
+    ):
+        """
+        Initialize the store service.
+
+        ``shards`` > 1 开启分片模式: session按id哈希分布到多个SQLite文件,
+        每个分片拥有独立的连接池和写锁。
+        """
+        self._db_path = database_path or settings.database_path
+        self._codec = ContentCodec(
+            enabled=settings.content_compression,
+            min_bytes=settings.content_compression_min_bytes,
+        )
+        self._pools: List[SQLitePool] = []
+        for path in shard_paths(self._db_path, shards or settings.db_shards):
+            Path(path).touch(exist_ok=True)
+            self._pools.append(
+                SQLitePool(
+                    path,
+                    readers=settings.db_pool_readers,
+                    synchronous=settings.db_synchronous,
+                    cache_size_kb=settings.db_cache_size_kb,
+                    mmap_size=settings.db_mmap_size,
+                    busy_timeout_ms=settings.db_busy_timeout_ms,
+                    functions={"unpack_text": self._codec.decode},
+                )
+            )
+        self._history = HistoryCache(capacity=settings.history_cache_sessions)
+
+    # ------------------------- shard routing -------------------------
+    def _shard(self, session_id: str) -> SQLitePool:
+        return self._pools[shard_index(session_id, len(self._pools))]
+
+    async def _fan_out(
+        self, sql: str, params: Any
+    ) -> List[Tuple[SQLitePool, List[Any]]]:
+        """Run a read query on every shard concurrently."""
+
+        async def run(pool: SQLitePool) -> Tuple[SQLitePool, List[Any]]:
+            async with pool.reader() as db:
+                return pool, list(await (await db.execute(sql, params)).fetchall())
+
+        return list(await asyncio.gather(*(run(pool) for pool in self._pools)))
+
+    async def _find_one(
+        self, sql: str, params: Any
+    ) -> Optional[Tuple[SQLitePool, Any]]:
+        """Point lookup by a non-session key: the first shard that has the row."""
+        for pool, rows in await self._fan_out(sql, params):
+            if rows:
+                return pool, rows[0]
+        return None
+
+    async def _conversation_shard(
+        self, conversation_id: str, session_id: str = ""
+    ) -> Optional[SQLitePool]:
+        if len(self._pools) == 1:
+            return self._pools[0]
+        session_id = session_id or self._history.owner(conversation_id) or ""
+        if session_id:
+            return self._shard(session_id)
+        found = await self._find_one(
+            "SELECT 1 FROM conversation WHERE id = ?", (conversation_id,)
+        )
+        return found[0] if found else None
 
     async def init(self) -> None:
-        """Idempotently创建表: 如果不存在则创建 (使用32位UUID主键)。不进行迁移或删除。"""
-        async with aiosqlite.connect(self._db_path) as db:
-            await db.execute("PRAGMA foreign_keys = ON;")
+        """打开连接池并Idempotently创建表: 如果不存在则创建 (使用32位UUID主键)。不进行迁移或删除。"""
+        for pool in self._pools:
+            await pool.open()
+            if settings.db_incremental_vacuum:
+                await self._enable_incremental_vacuum(pool, vacuum=False)
+            await self._init_schema(pool)
+
+    async def _init_schema(self, pool: SQLitePool) -> None:
+        async with pool.writer() as db:
             await db.execute(
                 """
                 CREATE TABLE IF NOT EXISTS session (
@@ -38,11 +320,18 @@ class StoreService:
                     session_id TEXT NOT NULL,
                     content TEXT NOT NULL,
                     type TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT '',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY(session_id) REFERENCES session(id) ON DELETE CASCADE
                 );
                 """
             )
+            # 旧库的conversation表没有status列
+            cursor = await db.execute("PRAGMA table_info(conversation)")
+            if "status" not in {r["name"] for r in await cursor.fetchall()}:
+                await db.execute(
+                    "ALTER TABLE conversation ADD COLUMN status TEXT NOT NULL DEFAULT ''"
+                )
 
             await db.execute(
                 """
@@ -57,30 +346,256 @@ class StoreService:
                 """
             )
 
+            # 进行中AI消息的追加式分片, 结束时合并回conversation.content
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversation_chunk (
+                    conversation_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (conversation_id, seq),
+                    FOREIGN KEY(conversation_id) REFERENCES conversation(id) ON DELETE CASCADE
+                ) WITHOUT ROWID;
+                """
+            )
+
             await db.execute(
                 """
                 CREATE INDEX IF NOT EXISTS idx_conversation_session_id
                 ON conversation (session_id);
                 """
             )
-            await db.commit()
+            # 按parent_cid查找子节点(分支/编辑)
+            await db.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_conversation_parent_cid
+                ON conversation (parent_cid);
+                """
+            )
+            # keyset分页: (created_at, id) 复合索引, 以及按类型过滤的版本
+            await db.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_session_created_at_id
+                ON session (created_at DESC, id DESC);
+                """
+            )
+            await db.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_session_type_created_at_id
+                ON session (type, created_at DESC, id DESC);
+                """
+            )
+            # LangGraph checkpoint, thread_id即session_id, 与会话数据放在同一分片
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoint (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL DEFAULT '',
+                    checkpoint_id TEXT NOT NULL,
+                    parent_checkpoint_id TEXT,
+                    type TEXT NOT NULL,
+                    checkpoint BLOB NOT NULL,
+                    metadata_type TEXT NOT NULL,
+                    metadata BLOB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+                );
+                """
+            )
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoint_write (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL DEFAULT '',
+                    checkpoint_id TEXT NOT NULL,
+                    task_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    channel TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    task_path TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+                );
+                """
+            )
+            # 后台制作任务及其SSE事件日志, 按job id分片 (任务开始时session可能还不存在)
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT NOT NULL DEFAULT '',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                """
+            )
+            await db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_event (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq),
+                    FOREIGN KEY(job_id) REFERENCES job(id) ON DELETE CASCADE
+                ) WITHOUT ROWID;
+                """
+            )
+            await db.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_job_status_updated_at
+                ON job (status, updated_at);
+                """
+            )
+            await self._init_search(db)
+
+    async def _init_search(self, db: aiosqlite.Connection) -> None:
+        """
+        创建FTS5全文索引以及保持同步的触发器。
+        索引内容来自 ``{table}_fts_src`` 视图, 其中 unpack_text() 负责解压压缩存储的列;
+        使用trigram分词, 以支持中文子串检索。索引首次创建或定义变化时对已有数据重建。
+        """
+        for table, columns in _FTS_TABLES.items():
+            fts = f"{table}_fts"
+            src = f"{table}_fts_src"
+            cols = ", ".join(columns)
+            src_cols = ", ".join(f"unpack_text({c}) AS {c}" for c in columns)
+            new_cols = ", ".join(f"unpack_text(new.{c})" for c in columns)
+            old_cols = ", ".join(f"unpack_text(old.{c})" for c in columns)
+
+            cursor = await db.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (fts,),
+            )
+            row = await cursor.fetchone()
+            rebuild = row is None or f"content='{src}'" not in row["sql"]
+            if row is not None and rebuild:
+                # 旧版本直接以原表为content, 无法读取压缩列, 需要重建
+                await db.execute(f"DROP TABLE {fts};")
+
+            await db.execute(
+                f"""
+                CREATE VIEW IF NOT EXISTS {src} AS
+                SELECT rowid AS rid, {src_cols} FROM {table};
+                """
+            )
+            await db.execute(
+                f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                    {cols}, content='{src}', content_rowid='rid',
+                    tokenize='trigram'
+                );
+                """
+            )
+            for trigger in ("ai", "ad", "au"):
+                await db.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger};")
+            await db.execute(
+                f"""
+                CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+                END;
+                """
+            )
+            await db.execute(
+                f"""
+                CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, {cols})
+                    VALUES ('delete', old.rowid, {old_cols});
+                END;
+                """
+            )
+            await db.execute(
+                f"""
+                CREATE TRIGGER {table}_fts_au
+                AFTER UPDATE OF {cols} ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, {cols})
+                    VALUES ('delete', old.rowid, {old_cols});
+                    INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_cols});
+                END;
+                """
+            )
+            if rebuild:
+                await db.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild');")
+
+    async def _enable_incremental_vacuum(self, pool: SQLitePool, vacuum: bool) -> None:
+        async with pool.raw_writer() as db:
+            row = await (await db.execute("PRAGMA auto_vacuum;")).fetchone()
+            if row[0] == 2:
+                return
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            cursor = await db.execute("SELECT count(*) FROM sqlite_master;")
+            # 新建的空库VACUUM瞬间完成
+            if not vacuum and (await cursor.fetchone())[0]:
+                # 已有数据的库需要一次完整VACUUM才能切换模式, 耗时与库大小成正比,
+                # 不在启动时执行
+                logger.warning(
+                    "Database is not in incremental auto_vacuum mode, run "
+                    "`python -m app.services.maintenance --enable-incremental-vacuum` "
+                    "while the service is stopped"
+                )
+                return
+            logger.info("Switching database to incremental auto_vacuum")
+            await db.execute("VACUUM;")
+
+    async def enable_incremental_vacuum(self) -> None:
+        """Switch every shard to incremental auto_vacuum (full VACUUM, offline)."""
+        for pool in self._pools:
+            await pool.open()
+            await self._enable_incremental_vacuum(pool, vacuum=True)
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """
+        Reclaim up to ``pages`` free pages on each shard.
+        Returns the number of pages freed.
+        """
+        freed = 0
+        for pool in self._pools:
+            async with pool.raw_writer() as db:
+                cursor = await db.execute("PRAGMA freelist_count;")
+                before = (await cursor.fetchone())[0]
+                if before == 0:
+                    continue
+                await (
+                    await db.execute(f"PRAGMA incremental_vacuum({int(pages)});")
+                ).fetchall()
+                cursor = await db.execute("PRAGMA freelist_count;")
+                freed += before - (await cursor.fetchone())[0]
+        return freed
+
+    async def close(self) -> None:
+        """Close the connection pools."""
+        for pool in self._pools:
+            await pool.close()
+
+    def pool_metrics(self) -> List[PoolMetrics]:
+        """Connection pool counters, one entry per shard."""
+        return [pool.metrics() for pool in self._pools]
+
+    def history_cache_metrics(self) -> HistoryCacheMetrics:
+        """History cache hit/miss counters."""
+        return self._history.metrics()
+
+    def compression_metrics(self) -> CompressionMetrics:
+        """Content compression counters."""
+        return self._codec.metrics()
 
     # ------------------------- Session CRUD -------------------------
     async def create_session(self, title: str, type: str) -> str:
         """Insert a new session and return its UUID (hex)."""
         session_id = uuid.uuid4().hex
-        async with aiosqlite.connect(self._db_path) as db:
+        async with self._shard(session_id).writer() as db:
             await db.execute(
                 "INSERT INTO session (id, title, type) VALUES (?, ?, ?)",
                 (session_id, title, type),
             )
-            await db.commit()
             return session_id
 
     async def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Fetch a single session by id."""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._shard(session_id).reader() as db:
             cursor = await db.execute(
                 "SELECT id, title, type, created_at FROM session WHERE id = ?",
                 (session_id,),
@@ -92,85 +607,200 @@ class StoreService:
         self, limit: int = 50, offset: int = 0
     ) -> List[Dict[str, Any]]:
         """List sessions with pagination."""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                "SELECT id, title, type, created_at FROM session ORDER BY created_at DESC LIMIT ? OFFSET ?",
-                (limit, offset),
-            )
-            rows = await cursor.fetchall()
-            return [dict(r) for r in rows]
+        if len(self._pools) == 1:
+            async with self._pools[0].reader() as db:
+                cursor = await db.execute(
+                    "SELECT id, title, type, created_at FROM session ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                    (limit, offset),
+                )
+                rows = await cursor.fetchall()
+                return [dict(r) for r in rows]
+        # 分片模式: 每个分片取前offset+limit行后归并
+        shard_rows = await self._fan_out(
+            "SELECT id, title, type, created_at FROM session ORDER BY created_at DESC, id DESC LIMIT ?",
+            (offset + limit,),
+        )
+        merged = sorted(
+            (dict(r) for _, rows in shard_rows for r in rows),
+            key=_session_key,
+            reverse=True,
+        )
+        return merged[offset : offset + limit]
+
+    async def page_sessions(
+        self, limit: int = 50, cursor: str = "", type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Keyset pagination over sessions, newest first.
+
+        ``cursor`` is the opaque ``next_cursor`` of the previous page ("" for the
+        first page). Raises ValueError if the cursor cannot be decoded.
+        """
+        where: List[str] = []
+        params: List[Any] = []
+        if type:
+            where.append("type = ?")
+            params.append(type)
+        if cursor:
+            created_at, last_id = _decode_cursor(cursor)
+            where.append("(created_at, id) < (?, ?)")
+            params.extend([created_at, last_id])
+        sql = "SELECT id, title, type, created_at FROM session"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # 多取一行用于判断是否还有下一页, 避免额外的COUNT全表扫描
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        # 各分片独立做keyset查询, 再按 (created_at, id) 归并
+        shard_rows = await self._fan_out(sql, params)
+        rows = sorted(
+            (dict(r) for _, part in shard_rows for r in part),
+            key=_session_key,
+            reverse=True,
+        )
+        sessions = rows[:limit]
+        has_more = len(rows) > limit
+        next_cursor = ""
+        if has_more and sessions:
+            last = sessions[-1]
+            next_cursor = _encode_cursor(last["created_at"], last["id"])
+        return {"sessions": sessions, "next_cursor": next_cursor, "has_more": has_more}
 
     async def update_session(self, session_id: str, title: str) -> bool:
         """Update session title. Returns True if a row was updated."""
-        async with aiosqlite.connect(self._db_path) as db:
+        async with self._shard(session_id).writer() as db:
             cursor = await db.execute(
                 "UPDATE session SET title = ? WHERE id = ?", (title, session_id)
             )
-            await db.commit()
             return cursor.rowcount > 0
 
     async def delete_session(self, session_id: str) -> bool:
-        """Delete a session (cascades to conversations)."""
-        async with aiosqlite.connect(self._db_path) as db:
-            cursor = await db.execute("DELETE FROM session WHERE id = ?", (session_id,))
+        """Delete a session together with its conversations and cards."""
+        async with self._shard(session_id).writer() as db:
+            await db.execute("DELETE FROM card WHERE session_id = ?", (session_id,))
             await db.execute(
                 "DELETE FROM conversation WHERE session_id = ?", (session_id,)
             )
-            await db.commit()
-            return cursor.rowcount > 0
+            await self._delete_checkpoints(db, [session_id])
+            cursor = await db.execute("DELETE FROM session WHERE id = ?", (session_id,))
+        self._history.invalidate(session_id)
+        return cursor.rowcount > 0
+
+    async def delete_sessions(
+        self,
+        session_ids: Optional[List[str]] = None,
+        before: Optional[str] = None,
+        batch_size: int = 200,
+    ) -> Dict[str, Any]:
+        """
+        批量删除session (按id列表或创建时间早于 ``before``), 每批一个写事务。
+
+        Returns ``{"deleted": int, "card_hashes": [...]}``; 角色卡文件由调用方异步清理。
+        """
+        deleted = 0
+        card_hashes: List[str] = []
+        by_shard: Dict[int, List[str]] = {}
+        for session_id in dict.fromkeys(session_ids or []):
+            by_shard.setdefault(shard_index(session_id, len(self._pools)), []).append(
+                session_id
+            )
+        for index, pool in enumerate(self._pools):
+            pending = by_shard.get(index, [])
+            while True:
+                if before is not None:
+                    async with pool.reader() as db:
+                        cursor = await db.execute(
+                            "SELECT id FROM session WHERE created_at < ? LIMIT ?",
+                            (before, batch_size),
+                        )
+                        batch = [r["id"] for r in await cursor.fetchall()]
+                else:
+                    batch, pending = pending[:batch_size], pending[batch_size:]
+                if not batch:
+                    break
+
+                marks = ", ".join("?" for _ in batch)
+                async with pool.writer() as db:
+                    cursor = await db.execute(
+                        f"SELECT hash FROM card WHERE session_id IN ({marks})", batch
+                    )
+                    card_hashes.extend(r["hash"] for r in await cursor.fetchall())
+                    await db.execute(
+                        f"DELETE FROM card WHERE session_id IN ({marks})", batch
+                    )
+                    await db.execute(
+                        f"DELETE FROM conversation WHERE session_id IN ({marks})",
+                        batch,
+                    )
+                    await self._delete_checkpoints(db, batch)
+                    cursor = await db.execute(
+                        f"DELETE FROM session WHERE id IN ({marks})", batch
+                    )
+                    deleted += cursor.rowcount
+                for session_id in batch:
+                    self._history.invalidate(session_id)
+                # 批次之间让出写锁
+                await asyncio.sleep(0)
+        return {"deleted": deleted, "card_hashes": card_hashes}
 
     # ---------------------- Conversation CRUD ----------------------
+    def _decode_row(self, row: Any) -> Dict[str, Any]:
+        """Convert a conversation row to a dict, decoding bytes content."""
+        data = dict(row)
+        # Decode bytes (plain or compressed) back to string for convenience
+        if isinstance(data.get("content"), (bytes, bytearray)):
+            with suppress(KeyError):
+                data["content"] = self._codec.decode(data["content"])
+        return data
+
     async def create_conversation(
         self, session_id: str, content: str, type: str, parent_cid: str = ""
     ) -> str:
         """Add a conversation entry for a session and return its UUID."""
         conv_id = uuid.uuid4().hex
-        async with aiosqlite.connect(self._db_path) as db:
+        async with self._shard(session_id).writer() as db:
             await db.execute(
                 "INSERT INTO conversation (id, parent_cid, session_id, content, type) VALUES (?, ?, ?, ?, ?)",
-                (conv_id, parent_cid, session_id, content, type),
+                (conv_id, parent_cid, session_id, self._codec.encode(content), type),
             )
-            await db.commit()
-            return conv_id
+        self._history.append(
+            session_id,
+            [_new_row(conv_id, parent_cid, session_id, content, type)],
+        )
+        return conv_id
 
     async def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
         """Fetch a single conversation by id."""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                "SELECT id, session_id, content, type, created_at FROM conversation WHERE id = ?",
-                (conversation_id,),
-            )
-            row = await cursor.fetchone()
-            if not row:
-                return None
-            data = dict(row)
-            # Decode bytes back to string for convenience
-            if isinstance(data["content"], (bytes, bytearray)):
-                with suppress(KeyError):
-                    data["content"] = data["content"].decode("utf-8")
-            return data
-
-    async def update_conversation(self, conversation_id: str, content: str) -> bool:
+        found = await self._find_one(
+            "SELECT id, parent_cid, session_id, content, type, status, created_at FROM conversation WHERE id = ?",
+            (conversation_id,),
+        )
+        return self._decode_row(found[1]) if found else None
+
+    async def update_conversation(
+        self, conversation_id: str, content: str, session_id: str = ""
+    ) -> bool:
         """Update conversation content. Returns True if a row was updated."""
-        async with aiosqlite.connect(self._db_path) as db:
+        pool = await self._conversation_shard(conversation_id, session_id)
+        if pool is None:
+            return False
+        async with pool.writer() as db:
             cursor = await db.execute(
                 "UPDATE conversation SET content = ? WHERE id = ?",
-                (content, conversation_id),
+                (self._codec.encode(content), conversation_id),
             )
-            await db.commit()
-            return cursor.rowcount > 0
+        self._history.update(conversation_id, content)
+        return cursor.rowcount > 0
 
     async def list_conversations(
         self, session_id: str, limit: int = 100, offset: int = 0
     ) -> List[Dict[str, Any]]:
         """List conversations for a given session."""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._shard(session_id).reader() as db:
             cursor = await db.execute(
                 """
-                SELECT id, session_id, content, type, created_at
+                SELECT id, parent_cid, session_id, content, type, status, created_at
                 FROM conversation
                 WHERE session_id = ?
                 ORDER BY created_at ASC
@@ -179,60 +809,712 @@ class StoreService:
                 (session_id, limit, offset),
             )
             rows = await cursor.fetchall()
-            result: List[Dict[str, Any]] = []
-            for r in rows:
-                item = dict(r)
-                if isinstance(item["content"], (bytes, bytearray)):
-                    with suppress(KeyError):
-                        item["content"] = item["content"].decode("utf-8")
-                result.append(item)
-            return result
+            return [self._decode_row(r) for r in rows]
+
+    async def get_branch(
+        self, leaf_cid: str, max_depth: int = 100, session_id: str = ""
+    ) -> List[Dict[str, Any]]:
+        """
+        沿 ``parent_cid`` 向上回溯, 返回从根到 ``leaf_cid`` 的分支 (最多 ``max_depth`` 条)。
+
+        If ``session_id`` is given the leaf must belong to that session.
+        """
+        if session_id:
+            nodes = self._history.get(session_id)
+            if nodes is not None:
+                return walk_branch(nodes, leaf_cid, max_depth)
+        params = {
+            "leaf_cid": leaf_cid,
+            "session_id": session_id,
+            "max_depth": max_depth,
+        }
+        rows: List[Any] = []
+        if session_id:
+            async with self._shard(session_id).reader() as db:
+                rows = await (await db.execute(_BRANCH_SQL, params)).fetchall()
+        else:
+            # 叶子只存在于一个分片, 直接使用该分片返回的分支
+            for _, shard_rows in await self._fan_out(_BRANCH_SQL, params):
+                if shard_rows:
+                    rows = shard_rows
+                    break
+        return [self._decode_row(r) for r in rows]
 
     async def delete_conversation(self, conversation_id: str) -> bool:
         """Delete a conversation by id."""
-        async with aiosqlite.connect(self._db_path) as db:
+        pool = await self._conversation_shard(conversation_id)
+        if pool is None:
+            return False
+        async with pool.writer() as db:
             cursor = await db.execute(
                 "DELETE FROM conversation WHERE id = ?", (conversation_id,)
             )
-            await db.commit()
-            return cursor.rowcount > 0
+        self._history.remove(conversation_id)
+        return cursor.rowcount > 0
 
     # ------------------------ store card -----------------------
+    def _decode_card(self, row: Any) -> Dict[str, Any]:
+        data = dict(row)
+        data["background"] = self._codec.decode(data["background"])
+        return data
 
     async def create_card(
         self, session_id: str, name: str, hash: str, background: str
     ) -> str:
         """Create a card file and return its filename."""
         card_id = uuid.uuid4().hex
-        async with aiosqlite.connect(self._db_path) as db:
+        async with self._shard(session_id).writer() as db:
             await db.execute(
                 "INSERT INTO card (id, session_id, name, hash, background) VALUES (?, ?, ?, ?, ?)",
-                (card_id, session_id, name, hash, background),
+                (card_id, session_id, name, hash, self._codec.encode(background)),
             )
-            await db.commit()
             return card_id
 
     async def get_card(self, card_id: str) -> Optional[Dict[str, Any]]:
         """Fetch a single card by id."""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                "SELECT id, session_id, name, hash, background FROM card WHERE id = ?",
-                (card_id,),
-            )
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+        found = await self._find_one(
+            "SELECT id, session_id, name, hash, background FROM card WHERE id = ?",
+            (card_id,),
+        )
+        return self._decode_card(found[1]) if found else None
 
     async def get_cards_by_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Fetch all cards for a given session."""
-        async with aiosqlite.connect(self._db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._shard(session_id).reader() as db:
             cursor = await db.execute(
                 "SELECT id, session_id, name, hash, background FROM card WHERE session_id = ?",
                 (session_id,),
             )
             row = await cursor.fetchone()
+            return self._decode_card(row) if row else None
+
+    # ------------------------- compression -------------------------
+
+    async def compress_existing(
+        self, batch_size: int = 200, pause: float = 0.05
+    ) -> Dict[str, int]:
+        """
+        后台迁移: 分批压缩已有的大文本行。
+        每批一个短写事务, 批次之间让出写锁, 不阻塞在线请求。
+        """
+        totals = {"rows": 0, "raw_bytes": 0, "stored_bytes": 0}
+        if not self._codec.enabled:
+            return totals
+        min_bytes = settings.content_compression_min_bytes
+        for pool, (table, column) in product(self._pools, _PACKED_COLUMNS):
+            last_rowid = 0
+            while True:
+                async with pool.reader() as db:
+                    cursor = await db.execute(
+                        f"""
+                        SELECT rowid, {column} AS value FROM {table}
+                        WHERE rowid > ? AND typeof({column}) = 'text'
+                          AND length(CAST({column} AS BLOB)) >= ?
+                        ORDER BY rowid LIMIT ?
+                        """,
+                        (last_rowid, min_bytes, batch_size),
+                    )
+                    rows = await cursor.fetchall()
+                if not rows:
+                    break
+                last_rowid = rows[-1]["rowid"]
+                updates = []
+                for r in rows:
+                    packed = self._codec.encode(r["value"])
+                    if isinstance(packed, bytes):
+                        updates.append((packed, r["rowid"], r["value"]))
+                        totals["raw_bytes"] += len(r["value"].encode("utf-8"))
+                        totals["stored_bytes"] += len(packed)
+                if updates:
+                    async with pool.writer() as db:
+                        # 仅在内容未被并发修改时替换
+                        await db.executemany(
+                            f"UPDATE {table} SET {column} = ? WHERE rowid = ? AND {column} = ?",
+                            updates,
+                        )
+                    totals["rows"] += len(updates)
+                await asyncio.sleep(pause)
+        logger.info("Content compression migration finished", extra=totals)
+        return totals
+
+    async def storage_report(self) -> List[Dict[str, Any]]:
+        """统计各压缩列的行数、存储大小与解压后大小 (全表扫描, 仅用于运维)。"""
+        report: List[Dict[str, Any]] = []
+        for table, column in _PACKED_COLUMNS:
+            shard_rows = await self._fan_out(
+                f"""
+                SELECT count(*) AS rows,
+                       coalesce(sum(typeof({column}) = 'blob'), 0) AS packed_rows,
+                       coalesce(sum(length(CAST({column} AS BLOB))), 0) AS stored_bytes,
+                       coalesce(
+                           sum(length(CAST(unpack_text({column}) AS BLOB))), 0
+                       ) AS plain_bytes
+                FROM {table}
+                """,
+                (),
+            )
+            row: Dict[str, Any] = {}
+            for _, rows in shard_rows:
+                for key, value in dict(rows[0]).items():
+                    row[key] = row.get(key, 0) + value
+            plain = row["plain_bytes"]
+            row["ratio"] = round(row["stored_bytes"] / plain, 4) if plain else None
+            report.append({"table": table, "column": column, **row})
+        return report
+
+    # ------------------------- search -------------------------
+
+    async def import_rows(self, rows: Dict[str, List[Any]]) -> Dict[str, int]:
+        """
+        将已有行原样写入所属分片 (用于分片迁移, 已存在的主键跳过)。
+        ``rows`` 为 ``{表名: [row, ...]}``, 表名见 ``_IMPORT_COLUMNS``;
+        conversation_chunk 的行需额外带上所属的 ``session_id`` 用于分片。
+        """
+        counts = dict.fromkeys(_IMPORT_COLUMNS, 0)
+        by_shard: Dict[int, Dict[str, List[Tuple[Any, ...]]]] = {}
+        for table, (cols, key) in _IMPORT_COLUMNS.items():
+            for row in rows.get(table, []):
+                index = shard_index(row[key], len(self._pools))
+                by_shard.setdefault(index, {}).setdefault(table, []).append(
+                    tuple(row[c] for c in cols)
+                )
+        for index, tables in by_shard.items():
+            async with self._pools[index].writer() as db:
+                # 按 _IMPORT_COLUMNS 的顺序写入, 满足外键约束
+                for table, (cols, _) in _IMPORT_COLUMNS.items():
+                    values = tables.get(table, [])
+                    if not values:
+                        continue
+                    marks = ", ".join("?" for _ in cols)
+                    cursor = await db.executemany(
+                        f"INSERT OR IGNORE INTO {table} ({', '.join(cols)}) VALUES ({marks})",
+                        values,
+                    )
+                    counts[table] += cursor.rowcount
+        return counts
+
+    async def search(
+        self,
+        query: str,
+        limit: int = 20,
+        offset: int = 0,
+        kinds: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        全文检索session标题、对话内容和角色卡, 按bm25排序并高亮命中片段。
+
+        ``kinds`` 限定检索范围 (session / conversation / card), 默认全部。
+        trigram索引只能检索至少3个字符的词; 较短的词 (如两字中文词) 用LIKE过滤,
+        全部是短词时只在每张表最新的 ``search_like_window`` 行中检索, 按时间倒序返回。
+        Returns ``{"results": [...], "has_more": bool}``.
+        """
+        kinds = [k for k in (kinds or list(_SEARCH_SQL)) if k in _SEARCH_SQL]
+        terms = query.split()
+        if not terms or not kinds:
+            return {"results": [], "has_more": False}
+
+        long_terms = [t for t in terms if len(t) >= 3]
+        short_terms = [t for t in terms if len(t) < 3]
+        # 每个子查询(以及每个分片)先各自取top N, 避免对全部命中结果排序
+        params: Dict[str, Any] = {"n": offset + limit + 1}
+        for i, term in enumerate(short_terms):
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params[f"like{i}"] = f"%{escaped}%"
+        if long_terms:
+            params["match"] = " ".join(
+                '"' + t.replace('"', '""') + '"' for t in long_terms
+            )
+            parts = [
+                _SEARCH_SQL[k].format(
+                    filter=_like_filter(f"{k}_fts", _FTS_TABLES[k], len(short_terms))
+                )
+                for k in kinds
+            ]
+        else:
+            params["window"] = settings.search_like_window
+            parts = [
+                _LIKE_SEARCH_SQL[k].format(
+                    filter=_like_filter("s", _FTS_TABLES[k], len(short_terms))
+                )
+                for k in kinds
+            ]
+        sql = " UNION ALL ".join(f"SELECT * FROM ({p})" for p in parts)
+        sql += " ORDER BY score LIMIT :n"
+
+        shard_rows = await self._fan_out(sql, params)
+        rows = sorted(
+            (dict(r) for _, part in shard_rows for r in part),
+            key=lambda r: r["score"],
+        )[offset : offset + limit + 1]
+        for row in rows:
+            if "text" in row:
+                row["snippet"] = _like_snippet(row.pop("text"), short_terms)
+        return {"results": rows[:limit], "has_more": len(rows) > limit}
+
+    # ------------------------- checkpoint -------------------------
+    async def _delete_checkpoints(
+        self, db: aiosqlite.Connection, thread_ids: List[str]
+    ) -> None:
+        marks = ", ".join("?" for _ in thread_ids)
+        for table in ("checkpoint_write", "checkpoint"):
+            await db.execute(
+                f"DELETE FROM {table} WHERE thread_id IN ({marks})", thread_ids
+            )
+
+    async def _checkpoint_writes(
+        self, db: aiosqlite.Connection, thread_id: str, ns: str, checkpoint_id: str
+    ) -> List[Dict[str, Any]]:
+        cursor = await db.execute(
+            """
+            SELECT task_id, idx, channel, type, value, task_path
+            FROM checkpoint_write
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_path, task_id, idx
+            """,
+            (thread_id, ns, checkpoint_id),
+        )
+        return [dict(r) for r in await cursor.fetchall()]
+
+    async def get_checkpoint(
+        self, thread_id: str, ns: str = "", checkpoint_id: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """指定id的checkpoint (未指定时取最新一个), 附带其 ``writes``。"""
+        sql = """
+            SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint,
+                   metadata_type, metadata
+            FROM checkpoint
+            WHERE thread_id = ? AND checkpoint_ns = ?
+        """
+        params: List[Any] = [thread_id, ns]
+        if checkpoint_id:
+            sql += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        sql += " ORDER BY checkpoint_id DESC LIMIT 1"
+        async with self._shard(thread_id).reader() as db:
+            row = await (await db.execute(sql, params)).fetchone()
+            if row is None:
+                return None
+            result = dict(row)
+            result["writes"] = await self._checkpoint_writes(
+                db, thread_id, ns, result["checkpoint_id"]
+            )
+            return result
+
+    async def list_checkpoints(
+        self,
+        thread_id: str,
+        ns: Optional[str] = None,
+        before: str = "",
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Checkpoints of a thread, newest first, with their ``writes``."""
+        sql = """
+            SELECT checkpoint_ns, checkpoint_id, parent_checkpoint_id, type,
+                   checkpoint, metadata_type, metadata
+            FROM checkpoint
+            WHERE thread_id = ?
+        """
+        params: List[Any] = [thread_id]
+        if ns is not None:
+            sql += " AND checkpoint_ns = ?"
+            params.append(ns)
+        if before:
+            sql += " AND checkpoint_id < ?"
+            params.append(before)
+        sql += " ORDER BY checkpoint_id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        async with self._shard(thread_id).reader() as db:
+            rows = [dict(r) for r in await (await db.execute(sql, params)).fetchall()]
+            for row in rows:
+                row["writes"] = await self._checkpoint_writes(
+                    db, thread_id, row["checkpoint_ns"], row["checkpoint_id"]
+                )
+        return rows
+
+    async def put_checkpoint(
+        self,
+        thread_id: str,
+        ns: str,
+        checkpoint_id: str,
+        parent_checkpoint_id: Optional[str],
+        checkpoint: Tuple[str, bytes],
+        metadata: Tuple[str, bytes],
+    ) -> None:
+        async with self._shard(thread_id).writer() as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO checkpoint (
+                    thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                    type, checkpoint, metadata_type, metadata
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    thread_id,
+                    ns,
+                    checkpoint_id,
+                    parent_checkpoint_id,
+                    *checkpoint,
+                    *metadata,
+                ),
+            )
+
+    async def put_checkpoint_writes(
+        self,
+        thread_id: str,
+        ns: str,
+        checkpoint_id: str,
+        writes: List[Tuple[str, int, str, str, bytes, str]],
+        replace: bool = True,
+    ) -> None:
+        """``writes`` 为 ``(task_id, idx, channel, type, value, task_path)``。"""
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        async with self._shard(thread_id).writer() as db:
+            await db.executemany(
+                f"""
+                {verb} INTO checkpoint_write (
+                    thread_id, checkpoint_ns, checkpoint_id,
+                    task_id, idx, channel, type, value, task_path
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(thread_id, ns, checkpoint_id, *w) for w in writes],
+            )
+
+    async def delete_checkpoints(self, thread_id: str) -> None:
+        async with self._shard(thread_id).writer() as db:
+            await self._delete_checkpoints(db, [thread_id])
+
+    async def prune_checkpoints(
+        self, older_than: Optional[str] = None, batch_size: int = 500
+    ) -> int:
+        """
+        每个thread只保留最新的checkpoint; ``older_than`` (UTC时间) 之前不再更新的
+        thread整体删除。分批执行, 批次之间让出写锁。Returns the number of deleted
+        checkpoints.
+        """
+        deleted = 0
+        for pool in self._pools:
+            while True:
+                async with pool.writer() as db:
+                    cursor = await db.execute(
+                        """
+                        DELETE FROM checkpoint WHERE rowid IN (
+                            SELECT c.rowid FROM checkpoint c
+                            JOIN (
+                                SELECT thread_id, checkpoint_ns,
+                                       max(checkpoint_id) AS latest,
+                                       max(created_at) AS touched
+                                FROM checkpoint
+                                GROUP BY thread_id, checkpoint_ns
+                            ) t USING (thread_id, checkpoint_ns)
+                            WHERE c.checkpoint_id < t.latest
+                               OR (:older_than IS NOT NULL AND t.touched < :older_than)
+                            LIMIT :n
+                        )
+                        """,
+                        {"older_than": older_than, "n": batch_size},
+                    )
+                    count = cursor.rowcount
+                    await db.execute(
+                        """
+                        DELETE FROM checkpoint_write WHERE NOT EXISTS (
+                            SELECT 1 FROM checkpoint c
+                            WHERE c.thread_id = checkpoint_write.thread_id
+                              AND c.checkpoint_ns = checkpoint_write.checkpoint_ns
+                              AND c.checkpoint_id = checkpoint_write.checkpoint_id
+                        )
+                        """
+                    )
+                deleted += count
+                if count < batch_size:
+                    break
+                await asyncio.sleep(0)
+        return deleted
+
+    # ------------------------- jobs -------------------------
+    async def create_job(
+        self, job_id: str, kind: str, request: str, status: str
+    ) -> None:
+        async with self._shard(job_id).writer() as db:
+            await db.execute(
+                "INSERT INTO job (id, kind, request, status) VALUES (?, ?, ?, ?)",
+                (job_id, kind, request, status),
+            )
+
+    async def update_job(self, job_id: str, status: str, error: str = "") -> None:
+        async with self._shard(job_id).writer() as db:
+            await db.execute(
+                "UPDATE job SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (status, error, job_id),
+            )
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        async with self._shard(job_id).reader() as db:
+            cursor = await db.execute(
+                """
+                SELECT id, kind, request, status, error, created_at, updated_at,
+                       (SELECT count(*) FROM job_event WHERE job_id = job.id) AS events
+                FROM job WHERE id = ?
+                """,
+                (job_id,),
+            )
+            row = await cursor.fetchone()
             return dict(row) if row else None
 
+    async def list_jobs(self, statuses: List[str]) -> List[Dict[str, Any]]:
+        """Jobs in one of ``statuses`` across all shards, oldest first."""
+        marks = ", ".join("?" for _ in statuses)
+        rows = [
+            dict(r)
+            for _, shard_rows in await self._fan_out(
+                f"""
+                SELECT id, kind, request, status, created_at,
+                       (SELECT count(*) FROM job_event WHERE job_id = job.id) AS events
+                FROM job WHERE status IN ({marks})
+                """,
+                statuses,
+            )
+            for r in shard_rows
+        ]
+        return sorted(rows, key=lambda r: r["created_at"])
+
+    async def append_job_events(
+        self, job_id: str, start_seq: int, events: List[str]
+    ) -> None:
+        """Append SSE payloads ``start_seq, start_seq + 1, ...`` of a job."""
+        if not events:
+            return
+        async with self._shard(job_id).writer() as db:
+            await db.executemany(
+                "INSERT OR IGNORE INTO job_event (job_id, seq, data) VALUES (?, ?, ?)",
+                [(job_id, start_seq + i, data) for i, data in enumerate(events)],
+            )
+
+    async def list_job_events(
+        self, job_id: str, after: int = -1, before: Optional[int] = None
+    ) -> List[Tuple[int, str]]:
+        """``(seq, data)`` of a job with ``after < seq < before``."""
+        sql = "SELECT seq, data FROM job_event WHERE job_id = ? AND seq > ?"
+        params: List[Any] = [job_id, after]
+        if before is not None:
+            sql += " AND seq < ?"
+            params.append(before)
+        async with self._shard(job_id).reader() as db:
+            cursor = await db.execute(sql + " ORDER BY seq", params)
+            return [(r["seq"], r["data"]) for r in await cursor.fetchall()]
+
+    async def prune_jobs(
+        self, statuses: List[str], older_than: str, batch_size: int = 200
+    ) -> int:
+        """删除 ``older_than`` (UTC时间) 之前结束的任务及其事件, 分批执行。"""
+        deleted = 0
+        marks = ", ".join("?" for _ in statuses)
+        for pool in self._pools:
+            while True:
+                async with pool.writer() as db:
+                    cursor = await db.execute(
+                        f"""
+                        DELETE FROM job WHERE id IN (
+                            SELECT id FROM job
+                            WHERE status IN ({marks}) AND updated_at < ?
+                            LIMIT ?
+                        )
+                        """,
+                        [*statuses, older_than, batch_size],
+                    )
+                    count = cursor.rowcount
+                deleted += count
+                if count < batch_size:
+                    break
+                await asyncio.sleep(0)
+        return deleted
+
+    # ------------------------- turn helpers -------------------------
+
+    async def begin_turn(
+        self,
+        query: str,
+        session_type: str,
+        session_id: str = "",
+        parent_cid: str = "",
+        max_depth: int = 100,
+    ) -> Dict[str, Any]:
+        """
+        在一个事务中完成一轮对话的准备工作:
+        按需创建session, 读取历史, 写入用户消息和AI占位消息。
+
+        ``history`` 只包含 ``parent_cid`` 所在分支(根到叶子); 未指定 ``parent_cid``
+        时以该session最新的一条消息作为叶子。
+
+        Returns a dict with ``session_id``, ``history`` (conversation rows before
+        this turn), ``human_id`` and ``ai_id``.
+        """
+        human_id = uuid.uuid4().hex
+        ai_id = uuid.uuid4().hex
+        history: List[Dict[str, Any]] = []
+        is_new = not session_id
+        session_id = session_id or uuid.uuid4().hex
+        async with self._shard(session_id).writer() as db:
+            if is_new:
+                await db.execute(
+                    "INSERT INTO session (id, title, type) VALUES (?, ?, ?)",
+                    (session_id, query, session_type),
+                )
+            else:
+                # 与插入在同一事务内检查, 避免外键错误 (session可能刚被删除)
+                cursor = await db.execute(
+                    "SELECT 1 FROM session WHERE id = ?", (session_id,)
+                )
+                if await cursor.fetchone() is None:
+                    self._history.invalidate(session_id)
+                    raise SessionNotFoundError(f"Session {session_id} not found")
+                nodes = self._history.get(session_id)
+                if nodes is None:
+                    # 缓存未命中: 在写锁内加载整个session, 之后的轮次只做增量更新
+                    cursor = await db.execute(
+                        """
+                        SELECT id, parent_cid, session_id, content, type, status, created_at
+                        FROM conversation
+                        WHERE session_id = ?
+                        ORDER BY rowid ASC
+                        """,
+                        (session_id,),
+                    )
+                    rows = [self._decode_row(r) for r in await cursor.fetchall()]
+                    nodes = self._history.load(session_id, rows)
+                if not parent_cid:
+                    parent_cid = latest_cid(nodes)
+                history = walk_branch(nodes, parent_cid, max_depth)
+            await db.executemany(
+                "INSERT INTO conversation (id, parent_cid, session_id, content, type) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        human_id,
+                        parent_cid,
+                        session_id,
+                        self._codec.encode(query),
+                        ConversationType.HUMAN,
+                    ),
+                    (ai_id, human_id, session_id, "", ConversationType.AI),
+                ],
+            )
+        self._history.append(
+            session_id,
+            [
+                _new_row(
+                    human_id, parent_cid, session_id, query, ConversationType.HUMAN
+                ),
+                _new_row(ai_id, human_id, session_id, "", ConversationType.AI),
+            ],
+        )
+        return {
+            "session_id": session_id,
+            "history": history,
+            "human_id": human_id,
+            "ai_id": ai_id,
+        }
+
+    async def append_chunks(
+        self,
+        conversation_id: str,
+        start_seq: int,
+        chunks: List[str],
+        session_id: str = "",
+    ) -> None:
+        """Append streamed chunks ``start_seq, start_seq + 1, ...`` of an AI message."""
+        if not chunks:
+            return
+        pool = await self._conversation_shard(conversation_id, session_id)
+        if pool is None:
+            raise ValueError(f"Conversation {conversation_id} not found")
+        async with pool.writer() as db:
+            await db.executemany(
+                "INSERT OR IGNORE INTO conversation_chunk (conversation_id, seq, content) VALUES (?, ?, ?)",
+                [
+                    (conversation_id, start_seq + i, chunk)
+                    for i, chunk in enumerate(chunks)
+                ],
+            )
+
+    async def _compact_chunks(
+        self, db: aiosqlite.Connection, conversation_id: str
+    ) -> str:
+        """在写事务内把分片追加到消息内容之后并删除分片, 返回合并后的内容。"""
+        cursor = await db.execute(
+            "SELECT content FROM conversation WHERE id = ?", (conversation_id,)
+        )
+        row = await cursor.fetchone()
+        cursor = await db.execute(
+            "SELECT content FROM conversation_chunk WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,),
+        )
+        chunks = [r["content"] for r in await cursor.fetchall()]
+        content = "".join([self._codec.decode(row["content"]) if row else ""] + chunks)
+        await db.execute(
+            "DELETE FROM conversation_chunk WHERE conversation_id = ?",
+            (conversation_id,),
+        )
+        return content
+
+    async def recover_chunks(self) -> int:
+        """
+        启动时合并异常中断的轮次遗留的分片, 使部分输出可见。
+        Returns the number of recovered conversations.
+        """
+        recovered = 0
+        for pool, rows in await self._fan_out(
+            "SELECT DISTINCT conversation_id FROM conversation_chunk", ()
+        ):
+            for r in rows:
+                async with pool.writer() as db:
+                    content = await self._compact_chunks(db, r["conversation_id"])
+                    await db.execute(
+                        "UPDATE conversation SET content = ? WHERE id = ?",
+                        (self._codec.encode(content), r["conversation_id"]),
+                    )
+                self._history.update(r["conversation_id"], content)
+                recovered += 1
+        return recovered
+
+    async def finish_turn(
+        self,
+        conversation_id: str,
+        content: Optional[str] = None,
+        card: Optional[Dict[str, Any]] = None,
+        session_id: str = "",
+        status: str = ConversationStatus.NORMAL.value,
+    ) -> bool:
+        """
+        在一个事务中写入AI消息的最终内容、状态以及生成的角色卡(如果有)。
+        ``content`` 为None时由已写入的分片合并得到。
+        """
+        if card is not None:
+            session_id = session_id or card["session_id"]
+        pool = await self._conversation_shard(conversation_id, session_id)
+        if pool is None:
+            return False
+        async with pool.writer() as db:
+            compacted = await self._compact_chunks(db, conversation_id)
+            if content is None:
+                content = compacted
+            cursor = await db.execute(
+                "UPDATE conversation SET content = ?, status = ? WHERE id = ?",
+                (self._codec.encode(content), status, conversation_id),
+            )
+            if card is not None:
+                await db.execute(
+                    "INSERT INTO card (id, session_id, name, hash, background) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        card["id"],
+                        card["session_id"],
+                        card["name"],
+                        card["hash"],
+                        self._codec.encode(card["background"]),
+                    ),
+                )
+        self._history.update(conversation_id, content, status)
+        return cursor.rowcount > 0
+
 
 store_service = StoreService()
@@ -0,0 +1,158 @@
+"""
+Hedged requests across model providers.
+
+主模型在截止时间 (由provider延迟分位数得出) 内没有响应时, 向下一个备选模型
+发送对冲请求, 先返回者胜出, 其余请求取消; 某个请求出错时立即切换到下一个。
+流式调用以首个chunk为"响应", 只有胜出者的token会被推送。
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable
+from pydantic import BaseModel, Field
+
+from app.utils.logger import logger
+
+T = TypeVar("T")
+
+# (首个chunk, 剩余的流)
+_Stream = tuple[Optional[ChatGenerationChunk], AsyncIterator[ChatGenerationChunk]]
+
+
+class HedgeMetrics(BaseModel):
+    """Routing counters of one hedged model."""
+
+    calls: int = Field(0, description="Calls routed through the policy")
+    hedges: int = Field(0, description="Hedged requests sent after a deadline")
+    failovers: int = Field(0, description="Fallbacks started after an error")
+    fallback_wins: int = Field(0, description="Calls answered by a fallback")
+
+
+async def _first_chunk(stream: AsyncIterator[ChatGenerationChunk]) -> _Stream:
+    try:
+        return await anext(stream, None), stream
+    except BaseException:
+        await stream.aclose()
+        raise
+
+
+async def _close_stream(result: _Stream) -> None:
+    await result[1].aclose()
+
+
+class HedgedChatModel(BaseChatModel):
+    """Race ``models[0]`` against its fallbacks, first answer wins."""
+
+    models: list[BaseChatModel]
+    # (最近发出的请求序号, 是否流式) -> 再等待多少秒后发出下一个请求
+    hedge_after: Callable[[int, bool], float]
+    stats: HedgeMetrics = Field(default_factory=HedgeMetrics)
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"models": [m._identifying_params for m in self.models]}
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> Runnable:
+        # 复用主模型的结构化输出参数 (response_format) 与解析器, 备选模型同为OpenAI兼容接口
+        sequence = self.models[0].with_structured_output(schema, **kwargs)
+        return self.bind(**sequence.first.kwargs) | sequence.last
+
+    async def _race(
+        self,
+        start: Callable[[BaseChatModel], Awaitable[T]],
+        stream: bool,
+        discard: Optional[Callable[[T], Awaitable[None]]] = None,
+    ) -> T:
+        self.stats.calls += 1
+        tasks: dict[asyncio.Task, int] = {}
+        started = 0
+        error: Optional[BaseException] = None
+
+        def launch() -> None:
+            nonlocal started
+            tasks[asyncio.create_task(start(self.models[started]))] = started
+            started += 1
+
+        launch()
+        try:
+            while tasks:
+                timeout = None
+                if started < len(self.models):
+                    timeout = self.hedge_after(started - 1, stream)
+                done, _ = await asyncio.wait(
+                    tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self.stats.hedges += 1
+                    launch()
+                    continue
+                winner: Optional[tuple[int, T]] = None
+                for task in done:
+                    index = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        logger.warning(f"Model attempt {index} failed: {error}")
+                    elif winner is None:
+                        winner = (index, task.result())
+                    elif discard is not None:
+                        await discard(task.result())
+                if winner is not None:
+                    if winner[0]:
+                        self.stats.fallback_wins += 1
+                    return winner[1]
+                if started < len(self.models):
+                    self.stats.failovers += 1
+                    launch()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                # 取消前恰好完成的请求
+                if discard is not None and not isinstance(result, BaseException):
+                    await discard(result)
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await self._race(
+            lambda model: model._agenerate(messages, stop=stop, **kwargs),
+            stream=False,
+        )
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # 子模型不带run_manager调用, token回调由外层统一触发
+        first, stream = await self._race(
+            lambda model: _first_chunk(model._astream(messages, stop=stop, **kwargs)),
+            stream=True,
+            discard=_close_stream,
+        )
+        try:
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    def _generate(self, *args: Any, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError("HedgedChatModel only supports async methods")
@@ -0,0 +1,47 @@
+"""
+Latency histogram used to derive hedging deadlines.
+
+按对数分桶计数, 每累计 ``decay_every`` 个样本将所有计数减半,
+使分位数跟随provider最近的表现变化, 内存占用固定。
+"""
+
+import bisect
+from typing import Optional
+
+# 50ms 起每档 ×1.25, 最大约 6 分钟
+_BOUNDS = [0.05 * 1.25**i for i in range(40)]
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with periodic decay."""
+
+    def __init__(self, decay_every: int = 500):
+        self._counts = [0.0] * (len(_BOUNDS) + 1)
+        self._total = 0.0
+        self._since_decay = 0
+        self._decay_every = decay_every
+
+    @property
+    def count(self) -> int:
+        return int(self._total)
+
+    def observe(self, seconds: float) -> None:
+        self._counts[bisect.bisect_left(_BOUNDS, seconds)] += 1
+        self._total += 1
+        self._since_decay += 1
+        if self._since_decay >= self._decay_every:
+            self._since_decay = 0
+            self._counts = [c / 2 for c in self._counts]
+            self._total /= 2
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """Upper bound (seconds) of the bucket holding quantile ``q``."""
+        if self._total < max(1, min_samples):
+            return None
+        target = q * self._total
+        seen = 0.0
+        for i, c in enumerate(self._counts):
+            seen += c
+            if seen >= target and c:
+                return _BOUNDS[i] if i < len(_BOUNDS) else _BOUNDS[-1]
+        return _BOUNDS[-1]
@@ -1,6 +1,25 @@
+import asyncio
+import os
+from functools import partial
+from typing import Any
+
+import httpx
 import yaml
+from langchain_core.caches import BaseCache
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from langchain_openai import ChatOpenAI
 from pydantic import BaseModel
 
+from app.utils.hedging import HedgedChatModel, HedgeMetrics
+from app.utils.rate_limit import (
+    LimitedTransport,
+    ProviderLimiter,
+    ProviderLimitMetrics,
+    ProviderLimits,
+)
+from app.utils.structured_output import response_format, structured_output
+
 
 class ModelProvider(BaseModel):
     """
@@ -11,6 +30,23 @@ class ModelProvider(BaseModel):
     base_url: str = "http://localhost:1234/v1"
     api_key: str | None = None
     provider: str | None = None
+    # 并发与速率限制, 同一provider下的所有模型共享
+    limits: ProviderLimits = ProviderLimits()
+
+
+class RoutingPolicy(BaseModel):
+    """
+    Hedging / failover policy of a model
+    主模型超过截止时间仍未响应时向备选模型发送对冲请求, 出错时直接切换
+    """
+
+    fallbacks: list[str] = []
+    # 截止时间取主模型provider延迟的该分位数, 并限制在 [min, max] 之间
+    hedge_quantile: float = 0.95
+    hedge_min_ms: int = 500
+    hedge_max_ms: int = 30000
+    # 样本不足时使用 hedge_max_ms
+    min_samples: int = 20
 
 
 class ModelConfig(BaseModel):
@@ -22,6 +58,11 @@ class ModelConfig(BaseModel):
     model: str = ""
     model_provider: ModelProvider = ModelProvider()
     max_tokens: int = 4096
+    temperature: float | None = None
+    top_p: float | None = None
+    routing: RoutingPolicy | None = None
+    # 输入token预算 (本地估算), 超出时压缩历史对话; 为空表示只按保留轮数压缩
+    prompt_token_budget: int | None = None
 
 
 class MCPServerConfig(BaseModel):
@@ -51,6 +92,8 @@ class ConfigError(Exception):
 class Config(BaseModel):
     model_providers: dict[str, ModelProvider] = {}
     models: dict[str, ModelConfig] = {}
+    # 部署级别的 图节点 -> 模型 映射, 未配置的节点使用请求中的模型
+    node_models: dict[str, str] = {}
 
     @classmethod
     def create(cls, *, config_file: str | None = None) -> "Config":
@@ -87,11 +130,223 @@ class Config(BaseModel):
                     model_config["model_provider"]
                 ]
                 config_models[model_name] = ModelConfig(**model_config)
+            for model_name, model_config in config_models.items():
+                for fallback in (model_config.routing or RoutingPolicy()).fallbacks:
+                    if fallback not in config_models or fallback == model_name:
+                        raise ConfigError(
+                            f"Fallback model {fallback} of {model_name} not found"
+                        )
             config.models = config_models
         else:
             raise ConfigError("No models provided")
 
+        node_models = yaml_config.get("node_models") or {}
+        for node, model_name in node_models.items():
+            if model_name not in config.models:
+                raise ConfigError(f"Model {model_name} of node {node} not found")
+        config.node_models = node_models
+
         return config
 
 
-modelSet = Config.create(config_file="./llm_config.yaml")
+# (主模型及备选模型的配置, 模型, 预先包装好的runnable)
+_ModelEntry = tuple[tuple[ModelConfig, ...], BaseChatModel, dict[Any, Runnable]]
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of chat models built from ``llm_config.yaml``.
+
+    每个模型只构建一次并共享同一个keep-alive连接池; 配置文件修改后按需重新加载,
+    只有配置发生变化的模型才会重建。
+    """
+
+    def __init__(self, config_file: str, max_connections: int = 100):
+        self._config_file = config_file
+        self._max_connections = max_connections
+        self._mtime = os.stat(config_file).st_mtime
+        self.config = Config.create(config_file=config_file)
+        self._http_client: httpx.AsyncClient | None = None
+        self._models: dict[str, _ModelEntry] = {}
+        self._limiters: dict[tuple[str, int], asyncio.Semaphore] = {}
+        self._provider_limiters: dict[str, ProviderLimiter] = {}
+        self._routes: list[tuple[str, ProviderLimiter]] = []
+        self._hedge_metrics: dict[str, HedgeMetrics] = {}
+        self._sync_limits()
+
+    def _reload(self) -> None:
+        try:
+            mtime = os.stat(self._config_file).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        self.config = Config.create(config_file=self._config_file)
+        self._sync_limits()
+
+    def _sync_limits(self) -> None:
+        """Create or update one limiter per provider (queues survive reloads)."""
+        routes = []
+        for name, provider in self.config.model_providers.items():
+            limiter = self._provider_limiters.get(name)
+            if limiter is None:
+                limiter = self._provider_limiters[name] = ProviderLimiter(
+                    provider.limits
+                )
+            else:
+                limiter.configure(provider.limits)
+            routes.append((provider.base_url.rstrip("/"), limiter))
+        # 前缀最长的优先匹配
+        self._routes = sorted(routes, key=lambda r: len(r[0]), reverse=True)
+
+    def _route(self, url: httpx.URL | str) -> ProviderLimiter | None:
+        target = str(url)
+        for base_url, limiter in self._routes:
+            if target.startswith(base_url):
+                return limiter
+        return None
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http_client is None or self._http_client.is_closed:
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_connections,
+                    keepalive_expiry=60,
+                )
+            )
+            self._http_client = httpx.AsyncClient(
+                transport=LimitedTransport(transport, self._route),
+                timeout=httpx.Timeout(600, connect=10),
+            )
+        return self._http_client
+
+    def _build(self, model_config: ModelConfig) -> ChatOpenAI:
+        return ChatOpenAI(
+            openai_api_key=model_config.model_provider.api_key,
+            openai_api_base=model_config.model_provider.base_url,
+            model_name=model_config.model,
+            max_tokens=model_config.max_tokens,
+            temperature=model_config.temperature,
+            top_p=model_config.top_p,
+            http_async_client=self._client(),
+        )
+
+    def _hedge_after(
+        self,
+        configs: tuple[ModelConfig, ...],
+        policy: RoutingPolicy,
+        index: int,
+        stream: bool,
+    ) -> float:
+        """Deadline of attempt ``index``: latency quantile of its provider."""
+        limiter = self._route(configs[index].model_provider.base_url)
+        deadline = None
+        if limiter is not None:
+            deadline = limiter.latency(stream).quantile(
+                policy.hedge_quantile, policy.min_samples
+            )
+        if deadline is None:
+            deadline = policy.hedge_max_ms / 1000
+        return min(
+            max(deadline, policy.hedge_min_ms / 1000), policy.hedge_max_ms / 1000
+        )
+
+    def _entry(self, name: str) -> _ModelEntry:
+        self._reload()
+        model_config = self.config.models.get(name)
+        if model_config is None:
+            raise ValueError(f"model {name} not found")
+        policy = model_config.routing
+        configs = (model_config,) + tuple(
+            self.config.models[f] for f in (policy.fallbacks if policy else [])
+        )
+        entry = self._models.get(name)
+        if entry is None or entry[0] != configs:
+            if len(configs) == 1:
+                model = self._build(model_config)
+            else:
+                model = HedgedChatModel(
+                    models=[self._build(c) for c in configs],
+                    hedge_after=partial(self._hedge_after, configs, policy),
+                    stats=self._hedge_metrics.setdefault(name, HedgeMetrics()),
+                )
+            entry = (configs, model, {})
+            self._models[name] = entry
+        return entry
+
+    def get(self, name: str) -> BaseChatModel:
+        """Shared chat model for ``name``."""
+        return self._entry(name)[1]
+
+    def retrying(
+        self, name: str, attempts: int = 2, cache: BaseCache | None = None
+    ) -> Runnable:
+        """``model.with_retry(...)``, built once per model."""
+        _, model, runnables = self._entry(name)
+        key = ("retry", attempts, id(cache))
+        if key not in runnables:
+            if cache is not None:
+                model = model.model_copy(update={"cache": cache})
+            runnables[key] = model.with_retry(stop_after_attempt=attempts)
+        return runnables[key]
+
+    def structured(
+        self,
+        name: str,
+        schema: type[BaseModel],
+        attempts: int = 2,
+        cache: BaseCache | None = None,
+        stream: bool = False,
+    ) -> Runnable:
+        """
+        Model bound to ``schema`` as a JSON response format, built once per model.
+
+        请求失败时重试; 输出不合法时先本地修复, 仍失败再发送简短的纠错请求
+        (最多 ``attempts - 1`` 次), 不重发原始prompt。
+        ``stream`` 为True时走流式接口, 调用方可通过回调逐token增量解析。
+        """
+        _, model, runnables = self._entry(name)
+        key = (schema, attempts, id(cache), stream)
+        if key not in runnables:
+            # 默认整体解析, 即使开启了token流式推送也走非流式接口
+            model = model.model_copy(
+                update={"disable_streaming": not stream, "cache": cache}
+            )
+            kwargs: dict[str, Any] = {"response_format": response_format(schema)}
+            if stream:
+                kwargs["stream"] = True
+            bound = model.bind(**kwargs).with_retry(stop_after_attempt=attempts)
+            runnables[key] = structured_output.runnable(
+                bound, schema, corrections=attempts - 1
+            )
+        return runnables[key]
+
+    def limiter(self, name: str, limit: int) -> asyncio.Semaphore:
+        """Process-wide semaphore shared by all models of the same provider."""
+        key = (self._entry(name)[0][0].model_provider.base_url, max(1, limit))
+        if key not in self._limiters:
+            self._limiters[key] = asyncio.Semaphore(key[1])
+        return self._limiters[key]
+
+    def provider_metrics(self) -> dict[str, ProviderLimitMetrics]:
+        """Queue depth and wait time per provider."""
+        return {
+            name: limiter.metrics() for name, limiter in self._provider_limiters.items()
+        }
+
+    def routing_metrics(self) -> dict[str, HedgeMetrics]:
+        """Hedging / failover counters per routed model."""
+        return {name: m.model_copy() for name, m in self._hedge_metrics.items()}
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP connection pool."""
+        self._models.clear()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+
+model_registry = ModelRegistry(config_file="./llm_config.yaml")
+modelSet = model_registry.config
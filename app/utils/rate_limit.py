@@ -0,0 +1,273 @@
+"""
+Per-provider request throttling for LLM calls.
+
+每个 ``ModelProvider`` 一个限流器: 同时在途请求数上限 + 每分钟请求数/token数令牌桶。
+排队按到达顺序 (FIFO) 放行, 流式响应在body读完或关闭后才释放并发名额;
+收到429时按 Retry-After 暂停该provider, 避免排队请求继续撞上限流。
+同时记录每个provider的响应延迟 (流式为首个chunk的延迟), 供对冲请求计算截止时间。
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Callable, Optional
+
+import httpx
+from pydantic import BaseModel, Field
+
+from app.utils.latency import LatencyHistogram
+
+
+class ProviderLimits(BaseModel):
+    """Limits declared on a model provider, ``None`` means unlimited."""
+
+    max_concurrency: Optional[int] = Field(None, description="Max in-flight requests")
+    requests_per_minute: Optional[float] = Field(None, description="Request bucket")
+    tokens_per_minute: Optional[float] = Field(None, description="Token bucket")
+
+
+class ProviderLimitMetrics(BaseModel):
+    """Throttling counters of one provider."""
+
+    in_flight: int = Field(0, description="Requests currently sent to the provider")
+    queued: int = Field(0, description="Requests waiting for a slot")
+    max_queued: int = Field(0, description="Highest queue depth seen")
+    requests: int = Field(0, description="Requests let through")
+    throttled: int = Field(0, description="Responses with HTTP 429")
+    wait_ms: float = Field(0.0, description="Total time spent queued")
+    max_wait_ms: float = Field(0.0, description="Longest time a request was queued")
+    avg_wait_ms: Optional[float] = Field(None, description="wait_ms / requests")
+    response_p50_ms: Optional[float] = Field(None, description="Non-streaming p50")
+    response_p95_ms: Optional[float] = Field(None, description="Non-streaming p95")
+    first_chunk_p50_ms: Optional[float] = Field(None, description="Streaming p50")
+    first_chunk_p95_ms: Optional[float] = Field(None, description="Streaming p95")
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously, capacity is one minute of budget."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self._rate = self.capacity / 60
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def delay(self, amount: float) -> float:
+        """Seconds until ``amount`` is available (0 when it can be taken now)."""
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+        # 单个请求超过桶容量时按满桶处理, 否则永远无法放行
+        missing = min(amount, self.capacity) - self._tokens
+        return missing / self._rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self._tokens -= min(amount, self.capacity)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算: ASCII约4字符1个token, 其余(中文等)按1字符1个token。"""
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def request_tokens(body: dict[str, Any]) -> int:
+    """
+    Token cost of a chat completion request body.
+
+    与服务端限流的计算方式一致: prompt估算值 + 预留的 max_tokens。
+    """
+    prompt = json.dumps(body.get("messages", ""), ensure_ascii=False)
+    reserved = body.get("max_completion_tokens") or body.get("max_tokens") or 0
+    return estimate_tokens(prompt) + int(reserved)
+
+
+class ProviderLimiter:
+    """Fair FIFO admission for one provider."""
+
+    def __init__(self, limits: ProviderLimits):
+        self._queue = asyncio.Lock()  # asyncio.Lock按等待顺序唤醒, 即FIFO
+        self._slots = asyncio.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._metrics = ProviderLimitMetrics()
+        # 非流式按完整响应计时, 流式按首个chunk计时
+        self._latency = {False: LatencyHistogram(), True: LatencyHistogram()}
+        self._apply(limits)
+
+    def _apply(self, limits: ProviderLimits) -> None:
+        self.limits = limits
+        self._requests = (
+            TokenBucket(limits.requests_per_minute)
+            if limits.requests_per_minute
+            else None
+        )
+        self._tokens = (
+            TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+        )
+
+    def configure(self, limits: ProviderLimits) -> None:
+        """Apply (possibly reloaded) limits, keeping the current queue."""
+        if limits != self.limits:
+            self._apply(limits)
+
+    def _has_slot(self) -> bool:
+        limit = self.limits.max_concurrency
+        return not limit or self._in_flight < limit
+
+    async def acquire(self, tokens: int = 0) -> None:
+        start = time.monotonic()
+        self._metrics.queued += 1
+        self._metrics.max_queued = max(self._metrics.max_queued, self._metrics.queued)
+        try:
+            # 只有队首请求在等待名额/令牌, 后来者在锁上按顺序排队
+            async with self._queue:
+                async with self._slots:
+                    await self._slots.wait_for(self._has_slot)
+                    self._in_flight += 1
+                try:
+                    while True:
+                        delay = self._paused_until - time.monotonic()
+                        for bucket, amount in (
+                            (self._requests, 1),
+                            (self._tokens, tokens),
+                        ):
+                            if bucket is not None:
+                                delay = max(delay, bucket.delay(amount))
+                        if delay <= 0:
+                            break
+                        await asyncio.sleep(delay)
+                except BaseException:
+                    await self.release()
+                    raise
+                if self._requests is not None:
+                    self._requests.take(1)
+                if self._tokens is not None:
+                    self._tokens.take(tokens)
+        finally:
+            self._metrics.queued -= 1
+        waited = (time.monotonic() - start) * 1000
+        self._metrics.requests += 1
+        self._metrics.wait_ms += waited
+        self._metrics.max_wait_ms = max(self._metrics.max_wait_ms, waited)
+
+    async def release(self) -> None:
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify()
+
+    def latency(self, stream: bool) -> LatencyHistogram:
+        return self._latency[stream]
+
+    def throttled(self, retry_after: float) -> None:
+        """Provider answered 429: hold back queued requests for ``retry_after``."""
+        self._metrics.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def metrics(self) -> ProviderLimitMetrics:
+        metrics = self._metrics.model_copy()
+        metrics.in_flight = self._in_flight
+        if metrics.requests:
+            metrics.avg_wait_ms = metrics.wait_ms / metrics.requests
+        for stream, prefix in ((False, "response"), (True, "first_chunk")):
+            for q in (50, 95):
+                value = self._latency[stream].quantile(q / 100)
+                if value is not None:
+                    setattr(metrics, f"{prefix}_p{q}_ms", value * 1000)
+        return metrics
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """
+    Response body that gives the slot back once it is consumed or closed,
+    and records the latency of its first chunk.
+    """
+
+    def __init__(
+        self,
+        stream: httpx.AsyncByteStream,
+        limiter: ProviderLimiter,
+        latency: Optional[LatencyHistogram] = None,
+        started: float = 0.0,
+    ):
+        self._stream = stream
+        self._limiter = limiter
+        self._latency = latency
+        self._started = started
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            if self._latency is not None:
+                self._latency.observe(time.monotonic() - self._started)
+                self._latency = None
+            yield chunk
+
+    async def aclose(self) -> None:
+        if self._latency is not None:
+            # 没收到任何数据就被关闭 (对冲请求的落败方), 已等待的时间作为下限计入
+            self._latency.observe(time.monotonic() - self._started)
+            self._latency = None
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                await self._limiter.release()
+
+
+def _retry_after(response: httpx.Response, default: float = 1.0) -> float:
+    try:
+        return max(0.0, float(response.headers.get("retry-after", default)))
+    except ValueError:
+        return default
+
+
+class LimitedTransport(httpx.AsyncBaseTransport):
+    """httpx transport that routes every request through its provider's limiter."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        limiter_for: Callable[[httpx.URL], Optional[ProviderLimiter]],
+    ):
+        self._transport = transport
+        self._limiter_for = limiter_for
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = self._limiter_for(request.url)
+        if limiter is None:
+            return await self._transport.handle_async_request(request)
+        try:
+            body = json.loads(request.content)
+        except (httpx.RequestNotRead, ValueError):
+            body = {}
+        if not isinstance(body, dict):
+            body = {}
+        await limiter.acquire(request_tokens(body))
+        latency = limiter.latency(bool(body.get("stream")))
+        started = time.monotonic()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            # 被取消的慢请求同样计入, 否则分位数会因幸存者偏差越来越小
+            latency.observe(time.monotonic() - started)
+            await limiter.release()
+            raise
+        except BaseException:
+            await limiter.release()
+            raise
+        if response.status_code == 429:
+            limiter.throttled(_retry_after(response))
+        response.stream = _ReleasingStream(
+            response.stream,
+            limiter,
+            latency if response.status_code < 400 else None,
+            started,
+        )
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,305 @@
+"""
+Structured output parsing with local JSON repair.
+
+模型返回的JSON先在本地解析/修复 (markdown代码块、多余逗号、被截断的数组、
+中文引号), 修复后仍不符合schema时才向模型发送简短的纠错请求,
+而不是重发包含完整剧本的原始prompt。
+"""
+
+import json
+import re
+from typing import Any, Iterator, Optional
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from pydantic import BaseModel, Field, ValidationError
+
+from app.utils.logger import logger
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+# 中文引号后跟这些字符时视为字符串结束
+_CN_STRING_END = re.compile(r"\s*([:：,，}\]]|$)")
+
+_CORRECTION_PROMPT = """上一次的输出不是符合要求的JSON, 错误: {error}
+
+请修正下面的内容, 只输出完整的JSON, 不要任何解释:
+{output}"""
+
+
+class StructuredOutputMetrics(BaseModel):
+    """Structured output parsing counters."""
+
+    parsed: int = Field(0, description="Outputs valid as returned")
+    repaired: int = Field(0, description="Outputs fixed by the local repair pass")
+    reasked: int = Field(
+        0, description="Outputs the local repair could not fix (re-asked if allowed)"
+    )
+    failed: int = Field(0, description="Outputs still invalid after corrections")
+    repair_rate: Optional[float] = Field(
+        None, description="repaired / outputs that were not valid as returned"
+    )
+
+
+def response_format(schema: type[BaseModel]) -> dict[str, Any]:
+    """OpenAI ``json_schema`` response format, returned unparsed."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema.__name__,
+            "description": schema.__doc__ or "",
+            "schema": schema.model_json_schema(),
+        },
+    }
+
+
+def _fix_cn_punctuation(text: str) -> str:
+    """
+    把当作JSON引号使用的中文引号, 以及字符串外的全角冒号/逗号换成ASCII;
+    字符串内容中的中文标点保持不变。
+    """
+    out: list[str] = []
+    quote = ""  # 当前字符串的起始引号, 空表示在字符串外
+    escape = False
+    for i, ch in enumerate(text):
+        if quote == '"':
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                quote = ""
+        elif quote:
+            if ch in "“”" and _CN_STRING_END.match(text, i + 1):
+                out.append('"')
+                quote = ""
+            else:
+                out.append('\\"' if ch == '"' else ch)
+        elif ch in "“”":
+            out.append('"')
+            quote = ch
+        elif ch == '"':
+            out.append(ch)
+            quote = ch
+        else:
+            out.append({"：": ":", "，": ","}.get(ch, ch))
+    return "".join(out)
+
+
+def _close(text: str) -> Iterator[str]:
+    """
+    去掉对象/数组末尾多余的逗号; 文本被截断时补全引号与括号,
+    并额外给出丢弃最后一个不完整字段/数组元素的版本。
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    in_string = escape = False
+    # 最后一个逗号处, 以及最后一个数组元素分隔处的 (位置, 未闭合的括号)
+    cuts: dict[bool, tuple[int, list[str]]] = {}
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            if ch == "[":
+                # 数组的第一个元素就不完整时截成空数组
+                cuts[True] = (len(out) + 1, list(stack))
+        elif ch in "}]":
+            while out and out[-1] in " \t\r\n,":
+                out.pop()
+            if stack:
+                stack.pop()
+        elif ch == "," and stack:
+            cuts[False] = cuts[stack[-1] == "]"] = (len(out), list(stack))
+        out.append(ch)
+    if not stack and not in_string:
+        yield "".join(out)
+        return
+    tail = "".join(out)
+    if in_string:
+        tail += '"'
+    tail = tail.rstrip()
+    if tail.endswith(":"):
+        tail += " null"
+    yield tail.rstrip(",") + "".join(reversed(stack))
+    for pos, opened in dict.fromkeys(
+        (c[0], tuple(c[1])) for c in (cuts.get(False), cuts.get(True)) if c
+    ):
+        yield "".join(out[:pos]) + "".join(reversed(opened))
+
+
+def _candidates(text: str) -> Iterator[str]:
+    # 第一个候选为原文, 之后的都算作修复
+    yield text
+    text = text.strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start > 0:
+        text = text[start:]
+    for candidate in dict.fromkeys([text, _fix_cn_punctuation(text)]):
+        yield from _close(candidate)
+
+
+def repair(text: str, schema: type[BaseModel]) -> tuple[BaseModel, bool]:
+    """
+    Parse ``text`` into ``schema``, trying local repairs when needed.
+
+    Returns the object and whether a repair was necessary; raises
+    ``OutputParserException`` with the first error if nothing validates.
+    """
+    if not isinstance(text, str):
+        raise OutputParserException(
+            f"Expected text output, got {type(text).__name__}", llm_output=str(text)
+        )
+    error: Optional[Exception] = None
+    for i, candidate in enumerate(_candidates(text)):
+        try:
+            return schema.model_validate(json.loads(candidate)), i > 0
+        except (TypeError, ValueError, ValidationError) as e:
+            error = error or e
+    raise OutputParserException(str(error), llm_output=text)
+
+
+class JSONStreamParser:
+    """
+    Incrementally scan streamed JSON and report values as soon as they close.
+
+    只报告路径深度不超过 ``depth`` 的值, 如 ``("others", 0)`` 表示顶层
+    ``others`` 数组的第一个元素; 已扫描的位置不会重复扫描。
+    顶层必须是对象或数组, 其前后的文本 (如markdown代码块标记) 被忽略。
+    """
+
+    def __init__(self, depth: int = 2):
+        self._depth = depth
+        self._text = ""
+        self._pos = 0
+        # 每层: [括号, 当前key或下标, 对象中是否在等待key, 当前值的起始位置]
+        self._stack: list[list[Any]] = []
+        self._string_start: Optional[int] = None
+        self._escape = False
+        self._literal_start: Optional[int] = None
+        self._root_start = 0
+        self.result: Any = None
+
+    def _path(self) -> tuple[Any, ...]:
+        return tuple(frame[1] for frame in self._stack)
+
+    def _done(self, start: int, end: int) -> Iterator[tuple[tuple[Any, ...], Any]]:
+        path = self._path()
+        if not path:
+            self.result = json.loads(self._text[start:end])
+        elif len(path) <= self._depth:
+            yield path, json.loads(self._text[start:end])
+
+    def feed(self, chunk: str) -> Iterator[tuple[tuple[Any, ...], Any]]:
+        """Append ``chunk`` and yield ``(path, value)`` for every value it closes."""
+        self._text += chunk
+        text = self._text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._string_start is not None:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    start, self._string_start = self._string_start, None
+                    frame = self._stack[-1] if self._stack else None
+                    if frame is not None and frame[0] == "{" and frame[2]:
+                        frame[1] = json.loads(text[start : i + 1])
+                        frame[2] = False
+                    else:
+                        yield from self._done(start, i + 1)
+                continue
+            if self._literal_start is not None and ch in ",}] \t\r\n":
+                start, self._literal_start = self._literal_start, None
+                yield from self._done(start, i)
+            if not self._stack and ch not in "{[":
+                continue
+            if ch in " \t\r\n:":
+                continue
+            if ch == '"':
+                self._string_start = i
+            elif ch in "{[":
+                if self._stack:
+                    self._stack[-1][3] = i
+                else:
+                    self._root_start = i
+                self._stack.append([ch, 0 if ch == "[" else None, ch == "{", i])
+            elif ch in "}]":
+                self._stack.pop()
+                start = self._stack[-1][3] if self._stack else self._root_start
+                yield from self._done(start, i + 1)
+            elif ch == ",":
+                if self._stack and self._stack[-1][0] == "[":
+                    self._stack[-1][1] += 1
+                elif self._stack:
+                    self._stack[-1][2] = True
+            elif self._literal_start is None:
+                self._literal_start = i
+        self._pos = len(text)
+
+
+class StructuredOutput:
+    """Parse chat model replies into Pydantic schemas."""
+
+    def __init__(self):
+        self._metrics = StructuredOutputMetrics()
+
+    def runnable(
+        self, model: Runnable, schema: type[BaseModel], corrections: int = 1
+    ) -> Runnable:
+        """``model`` (bound to :func:`response_format`) followed by parsing."""
+
+        async def invoke(input: Any, config: RunnableConfig) -> BaseModel:
+            message: BaseMessage = await model.ainvoke(input, config)
+            text = message.text()
+            try:
+                result, repaired = repair(text, schema)
+            except OutputParserException as e:
+                error = e
+            else:
+                if repaired:
+                    self._metrics.repaired += 1
+                else:
+                    self._metrics.parsed += 1
+                return result
+            self._metrics.reasked += 1
+            for _ in range(corrections):
+                logger.warning(
+                    f"Invalid {schema.__name__} output, asking for a correction: {error}"
+                )
+                prompt = _CORRECTION_PROMPT.format(error=str(error)[:500], output=text)
+                text = (
+                    await model.ainvoke([HumanMessage(content=prompt)], config)
+                ).text()
+                try:
+                    return repair(text, schema)[0]
+                except OutputParserException as e:
+                    error = e
+            self._metrics.failed += 1
+            raise error
+
+        return RunnableLambda(invoke, name=f"structured_{schema.__name__}")
+
+    def metrics(self) -> StructuredOutputMetrics:
+        metrics = self._metrics.model_copy()
+        malformed = metrics.repaired + metrics.reasked
+        if malformed:
+            metrics.repair_rate = metrics.repaired / malformed
+        return metrics
+
+
+structured_output = StructuredOutput()
@@ -21,6 +21,58 @@ class Settings(BaseSettings):
 
     # SQLite
     database_path: str = Field(default="./app.db")
+    # 连接池: 1个写连接 + N个读连接 (WAL)
+    db_pool_readers: int = Field(default=4)
+    db_synchronous: str = Field(default="NORMAL")
+    db_cache_size_kb: int = Field(default=16384)
+    db_mmap_size: int = Field(default=268435456)
+    db_busy_timeout_ms: int = Field(default=5000)
+    # 按session哈希分片到多个SQLite文件 (app.shard0.db ...), 1表示不分片
+    # 修改分片数后需运行 python -m app.services.shard_migrate 迁移数据
+    db_shards: int = Field(default=1)
+    # 会话历史LRU缓存的session数量, 0表示关闭
+    history_cache_sessions: int = Field(default=256)
+    # 全文检索中少于3个字符的词用LIKE检索, 只扫描每张表最新的N行
+    search_like_window: int = Field(default=5000)
+    # 大文本列(对话内容/角色卡背景)压缩存储, 超过min_bytes才压缩
+    content_compression: bool = Field(default=False)
+    content_compression_min_bytes: int = Field(default=1024)
+    # 流式AI消息每累计N个事件或M毫秒写入一次conversation_chunk
+    stream_chunk_flush_events: int = Field(default=8)
+    stream_chunk_flush_ms: int = Field(default=500)
+    # token增量事件的合并间隔
+    stream_delta_interval_ms: int = Field(default=50)
+    # LangGraph状态checkpoint: 后续轮次从保存的状态继续, 定期只保留每个会话最新的一份
+    graph_checkpoint: bool = Field(default=True)
+    checkpoint_prune_interval_seconds: float = Field(default=600)
+    checkpoint_ttl_days: int = Field(default=30)
+    # LLM响应缓存 (独立SQLite文件), 只对llm_cache_nodes中的节点生效, 默认关闭
+    llm_cache_path: str = Field(default="./llm_cache.db")
+    llm_cache_ttl_seconds: float = Field(default=7 * 24 * 3600)
+    llm_cache_max_mb: int = Field(default=256)
+    llm_cache_nodes: list[str] = Field(default=[])
+    # 增量VACUUM: 开启后定期回收删除数据留下的空闲页; 已有数据的库需先停服执行
+    # python -m app.services.maintenance --enable-incremental-vacuum 切换模式
+    db_incremental_vacuum: bool = Field(default=False)
+    db_vacuum_interval_seconds: float = Field(default=300)
+    db_vacuum_pages_per_step: int = Field(default=256)
+
+    # 后台制作任务: worker数即同时运行的任务数上限, 排队超过job_queue_size时拒绝
+    job_workers: int = Field(default=4)
+    job_queue_size: int = Field(default=100)
+    # 每个任务在内存中保留的最近事件数, 更早的事件重连时从SQLite回放
+    job_event_buffer: int = Field(default=512)
+    # 结束的任务在内存中保留的秒数, SSE空闲时发送keepalive注释的间隔
+    job_retention_seconds: float = Field(default=600)
+    job_keepalive_seconds: float = Field(default=15)
+    # 所有客户端断开超过宽限时间且未重新订阅的任务被取消 (包括进行中的LLM请求)
+    job_cancel_on_disconnect: bool = Field(default=True)
+    job_detach_grace_seconds: float = Field(default=30)
+    # 首轮请求 (无session_id) 的query/模型/配置相同且已有任务在运行时, 合并到该任务
+    craftcard_coalesce: bool = Field(default=True)
+    # 结束超过N天的任务及其事件日志定期删除
+    job_ttl_days: float = Field(default=3)
+    job_prune_interval_seconds: float = Field(default=3600)
 
     # 卡片存放路径
     card_folder: str = Field(default="./cards")
@@ -0,0 +1,20 @@
+"""
+模块导入时会读取 ``./llm_config.yaml`` 并在当前目录创建数据库,
+测试在临时目录中使用示例配置运行。
+"""
+
+import os
+import shutil
+import tempfile
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_sessionstart(session):
+    # 在收集 (导入测试模块) 之前切换目录
+    workdir = tempfile.mkdtemp(prefix="craftcard-tests-")
+    shutil.copy(
+        os.path.join(_ROOT, "llm_config.yaml.example"),
+        os.path.join(workdir, "llm_config.yaml"),
+    )
+    os.chdir(workdir)
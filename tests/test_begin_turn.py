@@ -0,0 +1,42 @@
+"""begin_turn 在同一事务内检查session是否存在。"""
+
+import pytest
+import pytest_asyncio
+
+from app.models.store import SessionType
+from app.services.store_service import SessionNotFoundError, StoreService
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path):
+    store = StoreService(database_path=str(tmp_path / "app.db"), shards=1)
+    await store.init()
+    yield store
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_unknown_session_is_not_found(store):
+    with pytest.raises(SessionNotFoundError):
+        await store.begin_turn(
+            query="继续", session_type=SessionType.CRAFTCARD, session_id="missing"
+        )
+    assert await store.get_session("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_deleted_session_is_not_found(store):
+    turn = await store.begin_turn(
+        query="写一个剧本", session_type=SessionType.CRAFTCARD
+    )
+    # 第二轮读过历史, 会话缓存中已有该session
+    await store.begin_turn(
+        query="上海", session_type=SessionType.CRAFTCARD, session_id=turn["session_id"]
+    )
+    await store.delete_session(turn["session_id"])
+    with pytest.raises(SessionNotFoundError):
+        await store.begin_turn(
+            query="继续",
+            session_type=SessionType.CRAFTCARD,
+            session_id=turn["session_id"],
+        )
@@ -0,0 +1,97 @@
+"""get_branch 沿parent_cid回溯, 代价只与分支深度相关 (每一步都是主键查找)。"""
+
+import sqlite3
+
+import pytest
+import pytest_asyncio
+
+from app.models.store import SessionType
+from app.services.store_service import _BRANCH_SQL, StoreService
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path):
+    store = StoreService(database_path=str(tmp_path / "app.db"), shards=3)
+    await store.init()
+    yield store
+    await store.close()
+
+
+async def _chain(store: StoreService, session_id: str, length: int) -> list[str]:
+    ids = [f"{session_id}-{i}" for i in range(length)]
+    await store.import_rows(
+        {
+            "session": [
+                {"id": session_id, "title": "t", "type": "c", "created_at": "2026"}
+            ],
+            "conversation": [
+                {
+                    "id": cid,
+                    "parent_cid": ids[i - 1] if i else "",
+                    "session_id": session_id,
+                    "content": f"m{i}",
+                    "type": "human" if i % 2 == 0 else "ai",
+                    "status": "",
+                    "created_at": "2026",
+                }
+                for i, cid in enumerate(ids)
+            ],
+        }
+    )
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_branch_without_session_id(store):
+    turn = await store.begin_turn(
+        query="写一个剧本", session_type=SessionType.CRAFTCARD
+    )
+    second = await store.begin_turn(
+        query="上海",
+        session_type=SessionType.CRAFTCARD,
+        session_id=turn["session_id"],
+    )
+    # 从第一轮的AI消息分叉
+    fork = await store.begin_turn(
+        query="北平",
+        session_type=SessionType.CRAFTCARD,
+        session_id=turn["session_id"],
+        parent_cid=turn["ai_id"],
+    )
+    for leaf, query in ((second["human_id"], "上海"), (fork["human_id"], "北平")):
+        branch = await store.get_branch(leaf)
+        assert [r["content"] for r in branch] == ["写一个剧本", "", query]
+        assert branch == await store.get_branch(leaf, session_id=turn["session_id"])
+    assert await store.get_branch("missing") == []
+
+    ids = await _chain(store, "long", 500)
+    branch = await store.get_branch(ids[-1], max_depth=20)
+    assert [r["id"] for r in branch] == ids[-20:]
+
+
+def test_branch_plan_uses_primary_key(tmp_path):
+    """Benchmark stand-in: the recursive CTE never scans the conversation table."""
+    db = sqlite3.connect(tmp_path / "plan.db")
+    db.execute(
+        "CREATE TABLE conversation (id TEXT PRIMARY KEY, parent_cid TEXT, "
+        "session_id TEXT, content TEXT, type TEXT, status TEXT, created_at TEXT)"
+    )
+    db.executemany(
+        "INSERT INTO conversation VALUES (?, ?, 's', 'x', 'ai', '', '')",
+        [(str(i), str(i - 1) if i else "") for i in range(20000)],
+    )
+    db.execute("ANALYZE")
+    plan = [
+        row[-1]
+        for row in db.execute(
+            "EXPLAIN QUERY PLAN " + _BRANCH_SQL,
+            {"leaf_cid": "19999", "session_id": "", "max_depth": 20},
+        )
+    ]
+    conversation_steps = [p for p in plan if "conversation" in p or " c " in p]
+    assert conversation_steps
+    # 主键索引上的点查, 而不是全表扫描或临时自动索引
+    assert all(
+        p.startswith("SEARCH") and "sqlite_autoindex_conversation_1" in p
+        for p in conversation_steps
+    ), plan
@@ -0,0 +1,83 @@
+"""达到最大澄清轮数时, 快速路径与调用模型得到的结果一致。"""
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.craftcard import graph
+from app.craftcard.state import ClarifyIntension
+from app.utils.model_config import model_registry
+
+HISTORY: list[BaseMessage] = [
+    HumanMessage(content="写一个谍战剧本"),
+    AIMessage(content="故事发生在哪个城市, 什么年代?"),
+    HumanMessage(content="上海, 1940年代"),
+    AIMessage(content="主角是什么身份?"),
+    HumanMessage(content="潜伏在76号的双面间谍"),
+]
+
+
+@pytest.fixture
+def clarify_model(monkeypatch):
+    """Stub clarification model that records its prompts."""
+    prompts: list[list[BaseMessage]] = []
+
+    def reply(prompt: list[BaseMessage]) -> ClarifyIntension:
+        prompts.append(prompt)
+        if "force 当前值为: true" not in prompt[0].text():
+            return ClarifyIntension(
+                need_clarification=True, question="主角是男是女?", verification=""
+            )
+        # 被要求结束澄清时, 模型复述整段对话作为剧本需求
+        return ClarifyIntension(
+            need_clarification=False,
+            question=graph._FORCE_CLARIFY_REPLY,
+            verification=graph._history_query(prompt[1:]),
+        )
+
+    monkeypatch.setattr(
+        model_registry,
+        "structured",
+        lambda *args, **kwargs: RunnableLambda(reply),
+    )
+    monkeypatch.setattr(
+        model_registry,
+        "retrying",
+        lambda *args, **kwargs: RunnableLambda(lambda _: AIMessage(content="")),
+    )
+    return prompts
+
+
+async def _clarify(messages: list[BaseMessage], fast_path: bool):
+    return await graph.clarify_intension(
+        {"messages": messages},
+        {"configurable": {"clarify_force_fast_path": fast_path}},
+    )
+
+
+@pytest.mark.asyncio
+async def test_forced_turn_matches_model_path(clarify_model):
+    slow = await _clarify(HISTORY, fast_path=False)
+    assert len(clarify_model) == 1
+    fast = await _clarify(HISTORY, fast_path=True)
+    # 快速路径不调用模型
+    assert len(clarify_model) == 1
+
+    assert fast.goto == slow.goto == "play_core"
+    assert fast.update["query"] == slow.update["query"]
+    assert [m.text() for m in fast.update["messages"]] == [
+        m.text() for m in slow.update["messages"]
+    ]
+    for message in HISTORY:
+        assert message.text() in fast.update["query"]
+    assert "<bound method" not in fast.update["query"]
+
+
+@pytest.mark.asyncio
+async def test_unforced_turn_still_calls_model(clarify_model):
+    fast = await _clarify(HISTORY[:1], fast_path=True)
+    slow = await _clarify(HISTORY[:1], fast_path=False)
+    assert len(clarify_model) == 2
+    assert fast.goto == slow.goto
+    assert fast.update == slow.update
+    assert fast.update["messages"][0].text() == "主角是男是女?"
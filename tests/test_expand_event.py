@@ -0,0 +1,64 @@
+"""事件扩写的结果进入 merge_events 交给writer; 模型出错时保留原文。"""
+
+import asyncio
+
+import pytest
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnableLambda
+
+from app.craftcard import graph
+from app.craftcard.state import ExpandResp
+from app.utils.model_config import model_registry
+
+EVENTS = [
+    {"name": "接头", "description": "主角在百乐门接头"},
+    {"name": "暴露", "description": "上线被捕"},
+]
+
+
+@pytest.fixture
+def expand_model(monkeypatch):
+    """Stub expansion model, ``fail`` lists the event texts it errors on."""
+    fail: set[str] = set()
+
+    def expand(prompt: str) -> ExpandResp:
+        for event in EVENTS:
+            if event["description"] in prompt:
+                if event["description"] in fail:
+                    raise OutputParserException("invalid json")
+                return ExpandResp(text=f"扩写: {event['description']}")
+        raise AssertionError(prompt)
+
+    monkeypatch.setattr(
+        model_registry, "structured", lambda *args, **kwargs: RunnableLambda(expand)
+    )
+    monkeypatch.setattr(
+        model_registry, "limiter", lambda *args, **kwargs: asyncio.Semaphore(2)
+    )
+    return fail
+
+
+async def _expand_and_merge() -> str:
+    expanded = []
+    for index, event in enumerate(EVENTS):
+        update = await graph.expand_event(
+            {"index": index, "event": event, "background": "1940年代上海"}, {}
+        )
+        expanded += update["expanded_events"]
+    command = await graph.merge_events({"expanded_events": expanded[::-1]}, {})
+    assert command.goto == "writer"
+    return command.update["writer_messages"][0].text()
+
+
+@pytest.mark.asyncio
+async def test_expanded_text_reaches_writer(expand_model):
+    note = await _expand_and_merge()
+    assert note.index("扩写: 主角在百乐门接头") < note.index("扩写: 上线被捕")
+
+
+@pytest.mark.asyncio
+async def test_failed_expansion_keeps_original(expand_model):
+    expand_model.add("上线被捕")
+    note = await _expand_and_merge()
+    assert "扩写: 主角在百乐门接头" in note
+    assert "暴露\n上线被捕" in note
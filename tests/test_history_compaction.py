@@ -0,0 +1,73 @@
+"""滚动摘要只合并滚出窗口的轮次, 发送的token数随之减少。"""
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.craftcard.prompts import history_summary_prompt
+from app.services.history_compaction import HistoryCompactor
+
+SUMMARY = "用户想要一个1940年代上海的谍战剧本"
+
+
+def _history(turns: int) -> list[BaseMessage]:
+    messages: list[BaseMessage] = [HumanMessage(content="写一个谍战剧本" * 20)]
+    for i in range(turns):
+        messages.append(AIMessage(content=f"第{i}个问题" * 20))
+        messages.append(HumanMessage(content=f"第{i}个回答" * 20))
+    return messages
+
+
+@pytest.fixture
+def summarizer():
+    calls: list[list[BaseMessage]] = []
+
+    def summarize(prompt: list[BaseMessage]) -> AIMessage:
+        calls.append(prompt)
+        return AIMessage(content=f"  {SUMMARY}  ")
+
+    return RunnableLambda(summarize), calls
+
+
+async def _compact(compactor, messages, summarizer, summary="", summarized=0):
+    return await compactor.compact(
+        messages,
+        "系统提示",
+        summary=summary,
+        summarized=summarized,
+        keep_turns=2,
+        budget=None,
+        summarizer=summarizer,
+        summary_prompt=history_summary_prompt,
+    )
+
+
+@pytest.mark.asyncio
+async def test_short_history_is_sent_verbatim(summarizer):
+    model, calls = summarizer
+    messages = _history(2)
+    sent, summary, summarized = await _compact(HistoryCompactor(), messages, model)
+    assert not calls
+    assert (summary, summarized) == ("", 0)
+    assert sent[1:] == messages
+
+
+@pytest.mark.asyncio
+async def test_old_turns_roll_into_summary(summarizer):
+    model, calls = summarizer
+    compactor = HistoryCompactor()
+    messages = _history(4)
+    sent, summary, summarized = await _compact(compactor, messages, model)
+    assert len(calls) == 1
+    assert summary == SUMMARY
+    # 保留最近2轮与本轮用户消息
+    assert sent[1:] == messages[summarized:] and len(sent) == 6
+    assert SUMMARY in sent[0].text()
+
+    # 下一轮沿用摘要, 未滚出窗口时不再调用模型
+    messages += [AIMessage(content="新问题"), HumanMessage(content="新回答")]
+    await _compact(compactor, messages, model, summary, summarized)
+    assert len(calls) == 1
+    metrics = compactor.metrics()
+    assert metrics.turns == 2 and metrics.summaries == 1
+    assert metrics.tokens_saved > 0
@@ -0,0 +1,49 @@
+"""同步与异步接口读写同一个缓存文件。"""
+
+import pytest
+import pytest_asyncio
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from app.services.llm_cache import SQLiteLLMCache
+
+PROMPT = '[{"id": ["HumanMessage"], "kwargs": {"content": "写一个剧本"}}]'
+LLM = "gpt-test"
+
+
+@pytest_asyncio.fixture
+async def cache(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "cache.db"), ttl_seconds=60, max_bytes=4096)
+    yield cache
+    await cache.close()
+
+
+def _generation(text: str) -> list[ChatGeneration]:
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+@pytest.mark.asyncio
+async def test_sync_and_async_share_entries(cache):
+    assert cache.lookup(PROMPT, LLM) is None
+    cache.update(PROMPT, LLM, _generation("雨夜"))
+    assert (await cache.alookup(PROMPT, LLM))[0].message.content == "雨夜"
+
+    await cache.aupdate(PROMPT, LLM, _generation("外滩"))
+    assert cache.lookup(PROMPT, LLM)[0].message.content == "外滩"
+
+    metrics = cache.metrics()
+    assert (metrics.hits, metrics.misses, metrics.entries) == (2, 1, 1)
+
+    cache.clear()
+    assert await cache.alookup(PROMPT, LLM) is None
+    assert cache.metrics().entries == 0
+
+
+def test_sync_update_evicts_over_size_limit(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "cache.db"), ttl_seconds=60, max_bytes=2048)
+    for i in range(8):
+        cache.update(f"{PROMPT}{i}", LLM, _generation("雨夜的外滩" * 20))
+    metrics = cache.metrics()
+    assert metrics.evictions > 0
+    assert 0 < metrics.bytes <= 2048
+    assert cache.lookup(f"{PROMPT}7", LLM) is not None
@@ -0,0 +1,66 @@
+"""全文检索: 少于3个字符的词改用LIKE检索, 而不是拒绝。"""
+
+import pytest
+import pytest_asyncio
+
+from app.models.store import SessionType
+from app.services.store_service import StoreService
+from config.settings import settings
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path, monkeypatch):
+    # 长内容压缩存储, LIKE需要检索解压后的文本
+    monkeypatch.setattr(settings, "content_compression", True)
+    monkeypatch.setattr(settings, "content_compression_min_bytes", 64)
+    store = StoreService(database_path=str(tmp_path / "app.db"), shards=2)
+    await store.init()
+    for query, reply in (
+        ("写一个上海谍战剧本", "1940年的上海, 潜伏者在百乐门接头。" * 10),
+        ("写一个北平谍战剧本", "北平的冬天, 100%的伪装。"),
+        ("写一个校园恋爱剧本", "樱花树下的告白。"),
+    ):
+        turn = await store.begin_turn(query=query, session_type=SessionType.CRAFTCARD)
+        await store.finish_turn(
+            turn["ai_id"], content=reply, session_id=turn["session_id"]
+        )
+    yield store
+    await store.close()
+
+
+async def _hits(store, query, **kwargs):
+    return [
+        (r["kind"], r["snippet"])
+        for r in (await store.search(query, **kwargs))["results"]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_two_character_terms(store):
+    hits = await _hits(store, "上海")
+    assert ("session", "写一个<mark>上海</mark>谍战剧本") in hits
+    # 压缩存储的对话内容同样命中
+    assert any(k == "conversation" and "<mark>上海</mark>" in s for k, s in hits)
+    assert len(hits) == 3
+
+    assert {k for k, _ in await _hits(store, "谍战 北平")} == {
+        "session",
+        "conversation",
+    }
+    assert await _hits(store, "谍战 东京") == []
+    # LIKE通配符按字面匹配
+    assert [k for k, _ in await _hits(store, "0%")] == ["conversation"]
+
+
+@pytest.mark.asyncio
+async def test_short_terms_filter_trigram_matches(store):
+    hits = await _hits(store, "谍战剧本 上海", kinds=["session"])
+    assert len(hits) == 1 and "上海" in hits[0][1]
+
+
+@pytest.mark.asyncio
+async def test_short_terms_only_scan_recent_rows(store, monkeypatch):
+    monkeypatch.setattr(settings, "search_like_window", 1)
+    # 每个分片每张表只看最新的一行
+    hits = await _hits(store, "剧本", kinds=["session"])
+    assert 1 <= len(hits) < 3
@@ -0,0 +1,68 @@
+"""分片迁移复制会话相关的全部表, 以及后台任务与事件日志。"""
+
+import os
+
+import pytest
+
+from app.models.store import SessionType
+from app.services.shard_migrate import migrate
+from app.services.store_service import StoreService
+
+
+@pytest.mark.asyncio
+async def test_migrate_copies_every_table(tmp_path):
+    source = str(tmp_path / "app.db")
+    store = StoreService(database_path=source, shards=1)
+    await store.init()
+    sessions = []
+    for i in range(6):
+        turn = await store.begin_turn(
+            query=f"剧本{i}", session_type=SessionType.CRAFTCARD
+        )
+        sessions.append(turn)
+        # 未合并的AI消息分片
+        await store.append_chunks(
+            turn["ai_id"], 0, [f"第{i}段\n", "..."], session_id=turn["session_id"]
+        )
+        await store.put_checkpoint(
+            turn["session_id"], "", "c1", None, ("msgpack", b"state"), ("json", b"{}")
+        )
+        await store.put_checkpoint_writes(
+            turn["session_id"],
+            "",
+            "c1",
+            [("task", 0, "messages", "msgpack", b"value", "")],
+        )
+        await store.create_job(f"job{i}", "craftcard", "{}", "done")
+        await store.append_job_events(f"job{i}", 0, [f"event{i}", "[DONE]"])
+    await store.close()
+
+    totals = await migrate(source, shards=3, batch_size=4)
+    assert totals == {
+        "session": 6,
+        "conversation": 12,
+        "card": 0,
+        "conversation_chunk": 12,
+        "checkpoint": 6,
+        "checkpoint_write": 6,
+        "job": 6,
+        "job_event": 12,
+    }
+    assert all(os.path.exists(tmp_path / f"app.shard{i}.db") for i in range(3))
+
+    sharded = StoreService(database_path=source, shards=3)
+    await sharded.init()
+    try:
+        assert await sharded.recover_chunks() == 6
+        for i, turn in enumerate(sessions):
+            conversation = await sharded.get_conversation(turn["ai_id"])
+            assert conversation["content"] == f"第{i}段\n..."
+            checkpoint = await sharded.get_checkpoint(turn["session_id"])
+            assert checkpoint["checkpoint_id"] == "c1"
+            assert (await sharded.get_job(f"job{i}"))["events"] == 2
+            assert await sharded.list_job_events(f"job{i}") == [
+                (0, f"event{i}"),
+                (1, "[DONE]"),
+            ]
+    finally:
+        await sharded.close()